@@ -7,3 +7,20 @@ handling its repositories.
 """
 
 VERSION = "0.1.4"
+
+
+# The implementation is imported on use, so that importing vip stays cheap
+# for `vip command` calls
+
+def activate(start=".", python=None):
+    """ Activates a virtualenv found from start in the running interpreter,
+    see `vip.environment.activate`.
+    """
+    from vip import environment
+    return environment.activate(start, python)
+
+
+def deactivate(unload=True):
+    """ Reverts `activate`, see `vip.environment.deactivate`. """
+    from vip import environment
+    return environment.deactivate(unload)
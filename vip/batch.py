@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+"""
+Running many commands concurrently, either from one virtualenv or one command
+from many virtualenvs.
+
+Virtualenvs are discovered once for the whole batch, and commands are run as
+child processes by a bounded pool of worker threads. Output of every command
+is collected into a temporary file and written out as a whole when the
+command finishes, so outputs of concurrent commands are never interleaved.
+"""
+
+import os
+import shlex
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from vip import core
+
+
+SEPARATOR = "--"
+
+# Exit code reported for commands, which could not be started
+NOT_STARTED = 127
+
+
+def get_default_jobs():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
+def parse_batch_file(lines):
+    """ Returns a list of commands, each being a list of arguments, from
+    lines of a batch file. Empty lines and lines starting with # are skipped.
+    """
+    commands = []
+    for line in lines:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            commands.append(shlex.split(line))
+    return commands
+
+
+def read_batch_file(filename):
+    """ Reads commands from a batch file, "-" stands for standard input.
+
+    Raises:
+        VipError: when the file cannot be read
+    """
+    if filename == "-":
+        return parse_batch_file(sys.stdin)
+
+    try:
+        with open(filename) as f:
+            return parse_batch_file(f)
+    except (IOError, OSError) as e:
+        raise core.VipError("cannot read batch file %s: %s" % (filename, e))
+
+
+def split_commands(arguments):
+    """ Splits a list of arguments into commands separated by "--". """
+    commands = [[]]
+    for argument in arguments:
+        if argument == SEPARATOR:
+            commands.append([])
+        else:
+            commands[-1].append(argument)
+    return [command for command in commands if command]
+
+
+class Task(object):
+    """ A command to run from a virtualenv, along with its outcome. """
+
+    def __init__(self, vip_directory, command, cwd=None, label=None):
+        self.vip_directory = vip_directory
+        self.command = list(command)
+        self.cwd = cwd
+        self.label = " ".join(self.command) if label is None else label
+
+        # Exit code and duration in seconds, None until the task is run
+        self.code = None
+        self.duration = None
+
+
+class Batch(object):
+    """ Runs tasks using at most jobs threads.
+
+    Unless keep_going is set, no new tasks are started once one of them
+    fails, but those already running are allowed to finish. With progress
+    set, a line is logged whenever a task finishes.
+    """
+
+    def __init__(self, tasks, jobs=None, keep_going=False, output=None,
+                 progress=False):
+        self.tasks = list(tasks)
+        self.jobs = max(1, min(jobs or get_default_jobs(),
+                               len(self.tasks) or 1))
+        self.keep_going = keep_going
+        self.output = sys.stdout if output is None else output
+        self.progress = progress
+
+        self._pending = queue.Queue()
+        self._output_lock = threading.Lock()
+        self._failed = threading.Event()
+        self._finished = 0
+
+    def _write_output(self, task, captured):
+        output = getattr(self.output, "buffer", self.output)
+
+        with self._output_lock:
+            self.output.flush()
+            output.write(("==> %s\n" % task.label).encode("utf-8"))
+            shutil.copyfileobj(captured, output)
+            output.write(("<== %s: exit code %d\n" % (task.label, task.code))
+                         .encode("utf-8"))
+            output.flush()
+
+            self._finished += 1
+            if self.progress:
+                core.logger.info("[%d/%d] %s: exit code %d in %.1fs" % (
+                    self._finished, len(self.tasks), task.label, task.code,
+                    task.duration))
+
+    def _run_one(self, task):
+        started = time.time()
+        with tempfile.TemporaryFile() as captured:
+            try:
+                code = core.execute_virtualenv_command(
+                    task.vip_directory, task.command[0], task.command[1:],
+                    stdout=captured, stderr=captured, cwd=task.cwd)
+            except core.VipError as e:
+                captured.write(("%s\n" % e).encode("utf-8"))
+                code = NOT_STARTED
+
+            task.code = 1 if code is None else code
+            task.duration = time.time() - started
+
+            captured.seek(0)
+            self._write_output(task, captured)
+
+    def _worker(self):
+        while True:
+            try:
+                task = self._pending.get_nowait()
+            except queue.Empty:
+                return
+
+            if self._failed.is_set() and not self.keep_going:
+                continue
+
+            self._run_one(task)
+            if task.code != 0:
+                self._failed.set()
+
+    def run(self):
+        """ Runs all tasks and returns the aggregate exit code: 0 when all
+        of them succeeded, otherwise the code of the first failed one.
+        """
+        for task in self.tasks:
+            self._pending.put(task)
+
+        workers = [threading.Thread(target=self._worker)
+                   for _ in range(self.jobs)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        for task in self.tasks:
+            if task.code:
+                return task.code
+        return 0
+
+    def get_skipped(self):
+        """ Returns tasks, which were not run because of a failure. """
+        return [task for task in self.tasks if task.code is None]
+
+    def write_summary(self):
+        """ Writes exit codes and durations of all tasks to output. """
+        lines = ["%-8s %8s\n" % ("exit", "time")]
+        for task in self.tasks:
+            if task.code is None:
+                lines.append("%-8s %8s  %s\n" % ("skipped", "-", task.label))
+            else:
+                lines.append("%-8d %7.1fs  %s\n" % (
+                    task.code, task.duration, task.label))
+
+        with self._output_lock:
+            self.output.flush()
+            output = getattr(self.output, "buffer", self.output)
+            output.write("".join(lines).encode("utf-8"))
+            output.flush()
+
+
+def run_batch(vip_directory, commands, jobs=None, keep_going=False,
+              output=None):
+    """ Runs commands from vip_directory concurrently and returns the
+    aggregate exit code.
+
+    Args:
+        vip_directory: str, a path to virtualenv
+        commands: a list of commands, each being a list of arguments
+        jobs: int, maximal number of commands running at once, a number of
+            CPUs by default
+        keep_going: bool, whether to start remaining commands after one of
+            them failed
+        output: file, where outputs of commands go, sys.stdout by default
+    """
+    batch = Batch([Task(vip_directory, command) for command in commands],
+                  jobs=jobs, keep_going=keep_going, output=output)
+    code = batch.run()
+
+    for task in batch.get_skipped():
+        core.logger.warning("Skipped: %s" % task.label)
+
+    return code
+
+
+def run_each(vip_directories, command, jobs=None, keep_going=False,
+             output=None):
+    """ Runs command from each of vip_directories concurrently, inside the
+    directory containing the virtualenv, and writes a summary of exit codes
+    and durations.
+
+    Args:
+        vip_directories: a list of paths to virtualenvs
+        command: a list of arguments, the first one being the executable
+        jobs, keep_going, output: like in `run_batch`
+
+    Returns:
+        the aggregate exit code
+    """
+    tasks = [Task(vip_directory, command,
+                  cwd=core.get_project_directory(vip_directory),
+                  label=vip_directory)
+             for vip_directory in vip_directories]
+
+    batch = Batch(tasks, jobs=jobs, keep_going=keep_going, output=output,
+                  progress=True)
+    code = batch.run()
+    batch.write_summary()
+    return code
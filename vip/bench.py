@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of vip operations, run them with:
+
+    python -m vip.bench [name ...]
+
+Available benchmarks are listed in `BENCHMARKS`. All of them work offline:
+packages installed by `init` come from a wheel generated on the fly.
+
+Results can be stored as a baseline and later compared with it, failing
+when any median got slower by more than a threshold:
+
+    python -m vip.bench --save-baseline bench.json
+    python -m vip.bench --baseline bench.json --threshold 0.2
+"""
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+from vip import core
+from vip import templates
+from vip import trace
+
+
+DEFAULT_THRESHOLD = 0.2
+
+PERCENTILES = (50, 90, 99)
+
+
+def measure(function, repeat):
+    """ Calls function repeat times and returns a list of durations. """
+    timings = []
+    for i in range(repeat):
+        started = trace.clock()
+        function(i)
+        timings.append(trace.clock() - started)
+    return timings
+
+
+def percentile(timings, point):
+    """ Returns point-th percentile of timings, interpolating between the
+    closest ranks.
+    """
+    timings = sorted(timings)
+    rank = (len(timings) - 1) * point / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(timings) - 1)
+    return timings[lower] + (timings[upper] - timings[lower]) * (rank - lower)
+
+
+def summarize(timings):
+    """ Returns a dict with minimum, maximum and percentiles of timings. """
+    summary = {"n": len(timings), "min": min(timings), "max": max(timings)}
+    for point in PERCENTILES:
+        summary["p%d" % point] = percentile(timings, point)
+    return summary
+
+
+def run_python(code, *args, **kwargs):
+    """ Runs code in a fresh interpreter, which sees vip from this tree. """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    environ = dict(os.environ, **kwargs.pop("env", {}))
+    environ["PYTHONPATH"] = os.pathsep.join(
+        [root] + [p for p in [os.environ.get("PYTHONPATH")] if p])
+
+    subprocess.check_call([sys.executable, "-c", code] + list(args),
+                          env=environ, **kwargs)
+
+
+def bench_import(repeat=20):
+    """ Measures how long importing vip.main takes in a fresh interpreter,
+    compared to starting the interpreter alone.
+    """
+    return {
+        "python -c pass": measure(lambda i: run_python("pass"), repeat),
+        "import vip.main": measure(
+            lambda i: run_python("import vip.main"), repeat),
+    }
+
+
+def make_tree(root, depth, width):
+    """ Creates a chain of depth nested directories below root, each having
+    width sibling files, and returns the deepest one.
+    """
+    directory = root
+    for level in range(depth):
+        directory = os.path.join(directory, "level%d" % level)
+        os.mkdir(directory)
+        for i in range(width):
+            open(os.path.join(directory, "file%d" % i), "w").close()
+    return directory
+
+
+def find_by_listing(start):
+    """ The search of `core.find_vip_directory` done by listing every
+    ancestor, as vip used to do, for comparison.
+    """
+    look_for = set(core.DEFAULT_VIRTUALENV_DIRS)
+    directory = os.path.abspath(start)
+
+    while os.path.dirname(directory) != directory:
+        if any(i in look_for and os.path.isdir(os.path.join(directory, i))
+               for i in os.listdir(directory)):
+            return directory
+        directory = os.path.dirname(directory)
+
+
+def bench_find_vip_directory(repeat=100, depth=30, width=1000):
+    """ Compares searches for `.vip` directory in a deep tree with large
+    directories, listing them, probing them and stopping at a ceiling.
+    """
+    root = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(root, core.VIP_DIRECTORY))
+        start = make_tree(root, depth, width)
+        ceiling = os.path.dirname(os.path.dirname(start))
+
+        def with_ceiling(i):
+            try:
+                core.find_vip_directory(start, ceilings=[ceiling])
+            except core.VipError:
+                pass
+
+        return {
+            "listing ancestors": measure(
+                lambda i: find_by_listing(start), repeat),
+            "core.find_vip_directory": measure(
+                lambda i: core.find_vip_directory(start, ceilings=[]),
+                repeat),
+            "core.find_vip_directory+ceiling": measure(with_ceiling, repeat),
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_dispatch(repeat=20, depth=10):
+    """ Compares running `vip true` from a nested directory with running
+    `.vip/bin/true` directly.
+    """
+    root = tempfile.mkdtemp()
+    try:
+        bin_directory = os.path.join(root, core.VIP_DIRECTORY, "bin")
+        os.makedirs(bin_directory)
+        executable = os.path.join(bin_directory, "true")
+        with open(executable, "w") as f:
+            f.write("#!/bin/sh\nexit 0\n")
+        os.chmod(executable, 0o755)
+
+        start = make_tree(root, depth, 0)
+        environ = {"VIP_CACHE_DIR": os.path.join(root, "cache")}
+
+        def vip_true(i):
+            run_python("from vip.main import main; main()", "true",
+                       cwd=start, env=environ)
+
+        return {
+            ".vip/bin/true": measure(
+                lambda i: subprocess.check_call([executable], cwd=start),
+                repeat),
+            "vip true": measure(vip_true, repeat),
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+def make_wheel(directory, name="vipbench", version="1.0"):
+    """ Builds a minimal pure Python wheel in directory and returns its
+    path, so that installs can be measured without network access.
+    """
+    dist_info = "%s-%s.dist-info" % (name, version)
+    files = [
+        ("%s.py" % name, "VERSION = %r\n" % version),
+        (dist_info + "/METADATA", "Metadata-Version: 2.1\nName: %s\n"
+         "Version: %s\n" % (name, version)),
+        (dist_info + "/WHEEL", "Wheel-Version: 1.0\nGenerator: vip.bench\n"
+         "Root-Is-Purelib: true\nTag: py2-none-any\nTag: py3-none-any\n"),
+    ]
+
+    record = []
+    for filename, content in files:
+        digest = hashlib.sha256(content.encode("utf-8")).digest()
+        record.append("%s,sha256=%s,%d\n" % (
+            filename,
+            base64.urlsafe_b64encode(digest).decode("ascii").rstrip("="),
+            len(content)))
+    record.append("%s/RECORD,,\n" % dist_info)
+    files.append((dist_info + "/RECORD", "".join(record)))
+
+    wheel = os.path.join(directory, "%s-%s-py2.py3-none-any.whl" % (
+        name, version))
+    with zipfile.ZipFile(wheel, "w") as archive:
+        for filename, content in files:
+            archive.writestr(filename, content)
+    return wheel
+
+
+def bench_init(repeat=3):
+    """ Compares creating a virtualenv from scratch with cloning it from a
+    template, and measures `core.create_virtualenv` with and without
+    requirements to install.
+    """
+    import virtualenv
+
+    root = tempfile.mkdtemp()
+    try:
+        store = templates.TemplateStore(os.path.join(root, "templates"))
+        template = store.ensure()
+
+        wheel = make_wheel(root)
+        requirements = "--no-index\n--find-links %s\nvipbench\n" % (
+            os.path.dirname(wheel))
+
+        def from_scratch(i):
+            virtualenv.create_environment(
+                os.path.join(root, "scratch%d" % i, core.VIP_DIRECTORY))
+
+        def from_template(i):
+            templates.materialize(template, os.path.join(
+                root, "template%d" % i, core.VIP_DIRECTORY))
+
+        def create(i, content=None):
+            directory = os.path.join(root, "project%d-%s" % (i, bool(content)))
+            os.mkdir(directory)
+            if content is not None:
+                with open(os.path.join(directory, core.REQUIREMENTS_FILENAME),
+                          "w") as f:
+                    f.write(content)
+            core.create_virtualenv(directory)
+
+        return {
+            "virtualenv.create_environment": measure(from_scratch, repeat),
+            "templates.materialize": measure(from_template, repeat),
+            "core.create_virtualenv": measure(create, repeat),
+            "core.create_virtualenv+requirements": measure(
+                lambda i: create(i, requirements), repeat),
+        }
+    finally:
+        shutil.rmtree(root)
+
+
+BENCHMARKS = {
+    "import": bench_import,
+    "find": bench_find_vip_directory,
+    "dispatch": bench_dispatch,
+    "init": bench_init,
+}
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """ Compares medians of results with a baseline.
+
+    Args:
+        results, baseline: dicts mapping benchmark names to dicts mapping
+            labels to summaries
+        threshold: float, a relative slowdown still accepted
+
+    Returns:
+        a list of (benchmark, label, baseline median, current median)
+        tuples for measurements slower than allowed
+    """
+    regressions = []
+    for name, summaries in sorted(results.items()):
+        for label, summary in sorted(summaries.items()):
+            expected = baseline.get(name, {}).get(label)
+            if expected is None:
+                continue
+            if summary["p50"] > expected["p50"] * (1 + threshold):
+                regressions.append((name, label, expected["p50"],
+                                    summary["p50"]))
+    return regressions
+
+
+def write_results(results, output=sys.stdout):
+    columns = ["min"] + ["p%d" % point for point in PERCENTILES] + ["max"]
+    output.write("%-48s %5s %s\n" % ("", "n", " ".join(
+        "%10s" % column for column in columns)))
+
+    for name, summaries in sorted(results.items()):
+        for label, summary in sorted(summaries.items()):
+            output.write("%-48s %5d %s\n" % (
+                "%s: %s" % (name, label), summary["n"], " ".join(
+                    "%8.2fms" % (summary[column] * 1000)
+                    for column in columns)))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="vip benchmarks")
+    parser.add_argument("names", metavar="name", nargs="*",
+                        help="benchmarks to run, all by default (%s)" %
+                        ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument("--repeat", type=int,
+                        help="how many times to repeat each measurement")
+    parser.add_argument("--baseline", metavar="file",
+                        help="compares results with a stored baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="accepted relative slowdown of medians, "
+                        "%.2f by default" % DEFAULT_THRESHOLD)
+    parser.add_argument("--save-baseline", metavar="file",
+                        help="stores results as a baseline")
+    args = parser.parse_args(argv)
+
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark: %s" % name)
+
+    results = {}
+    for name in args.names or sorted(BENCHMARKS):
+        kwargs = {} if args.repeat is None else {"repeat": args.repeat}
+        timings = BENCHMARKS[name](**kwargs)
+        results[name] = dict((label, summarize(values))
+                             for label, values in timings.items())
+
+    write_results(results)
+
+    if args.save_baseline:
+        core.atomic_write(args.save_baseline, json.dumps(
+            results, indent=2, sort_keys=True) + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+        for name, label, expected, current in regressions:
+            sys.stdout.write("regression: %s: %s %.2fms -> %.2fms\n" % (
+                name, label, expected * 1000, current * 1000))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
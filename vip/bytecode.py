@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+Precompiling bytecode of virtualenvs.
+
+Python compiles modules on first import, so the first run of tests in a
+fresh virtualenv spends a while compiling thousands of files. `vip --compile
+[levels]` compiles site-packages ahead, and so do `--init`, `--install` and
+`--sync` when `VIP_COMPILE` environment variable lists optimization levels.
+
+Files are compiled by `compileall` of the virtualenv interpreter, so bytecode
+matches its version. Entries of site-packages are split into chunks compiled
+by several processes at once, and `compileall` skips files, which bytecode
+is already up to date. Optimization levels are those of `python -O` and
+`python -OO`.
+"""
+
+import os
+import re
+
+from vip import core
+from vip import trace
+
+
+OPTIMIZATION_FLAGS = {
+    0: [],
+    1: ["-O"],
+    2: ["-OO"],
+}
+
+# How compileall reports files it cannot compile
+_error_re = re.compile(r"^\*\*\* Error compiling '(.+)'\.\.\.", re.MULTILINE)
+
+
+def parse_levels(value):
+    """ Parses a comma separated list of optimization levels, like "0,1".
+
+    Raises:
+        VipError: when a level is not 0, 1 or 2
+    """
+    levels = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part not in ("0", "1", "2"):
+            raise core.VipError("invalid optimization level: %s (expected "
+                                "0, 1 or 2)" % part)
+        if int(part) not in levels:
+            levels.append(int(part))
+
+    if not levels:
+        raise core.VipError("no optimization levels given: %s" % value)
+    return levels
+
+
+def get_levels(environ=None):
+    """ Returns optimization levels to precompile after installs, from
+    `VIP_COMPILE` environment variable, an empty list when it is not set.
+    """
+    environ = os.environ if environ is None else environ
+    value = environ.get("VIP_COMPILE", "")
+    return parse_levels(value) if value else []
+
+
+def split_chunks(paths, count):
+    """ Splits paths into at most count lists of similar length. """
+    count = max(1, min(count, len(paths)))
+    return [paths[i::count] for i in range(count)]
+
+
+def compile_virtualenv(vip_directory, levels=(0,), jobs=None):
+    """ Compiles modules in site-packages of a virtualenv for every
+    optimization level, by at most jobs processes at once.
+
+    Returns:
+        a list of files that could not be compiled, which usually are
+        modules for other interpreter versions shipped by packages
+
+    Raises:
+        VipError: when the interpreter or site-packages of virtualenv is
+            missing
+    """
+    import subprocess
+
+    from vip import batch
+
+    python = core.find_virtualenv_executable(vip_directory, "python")
+    site_packages = core.get_site_packages(vip_directory)
+    try:
+        paths = sorted(os.path.join(site_packages, name)
+                       for name in os.listdir(site_packages))
+    except OSError as e:
+        raise core.VipError("cannot list %s: %s" % (site_packages, e))
+    if not paths:
+        return []
+
+    chunks = split_chunks(paths, jobs or batch.get_default_jobs())
+    failed = []
+    started = trace.clock()
+
+    for level in levels:
+        with trace.span("compileall", level=level):
+            processes = [subprocess.Popen(
+                [python] + OPTIMIZATION_FLAGS[level] +
+                ["-m", "compileall", "-q"] + chunk,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                for chunk in chunks]
+
+            for process in processes:
+                output = process.communicate()[0].decode("utf-8", "replace")
+                for filename in _error_re.findall(output):
+                    if filename not in failed:
+                        failed.append(filename)
+
+    core.logger.info("Compiled %s at optimization levels %s in %.1f s, "
+                     "using %d processes" % (
+                         site_packages,
+                         ",".join(str(level) for level in levels),
+                         trace.clock() - started, len(chunks)))
+    if failed:
+        core.logger.warning("Could not compile %d files: %s" % (
+            len(failed), ", ".join(failed)))
+    return failed
@@ -1,41 +1,60 @@
 # -*- coding: utf-8 -*-
 
-import itertools
-import logging
+# Only os and sys are imported here on purpose: this module is on the path of
+# every `vip command` call, so anything else is imported where it is needed.
+# See TestStartupBudget in test_main.py.
 import os
-import path
-import signal
-try:
-    import StringIO
-except ImportError:
-    import io as StringIO
-
-import subprocess
 import sys
-import virtualenv
+
+from vip import trace
 
 
 VIP_DIRECTORY = ".vip"
 DEFAULT_VIRTUALENV_DIRS = [VIP_DIRECTORY, '.venv']
 REQUIREMENTS_FILENAME = 'requirements.txt'
 
+# A file in a virtualenv directory holding one virtualenv per interpreter
+# version, like `.vip/py27`, with the default version
+DEFAULT_PYTHON_FILENAME = "default-python"
+
+# A lock file next to a virtualenv directory, held while it is created or
+# installed into, see `lock_virtualenv`
+LOCK_SUFFIX = ".lock"
+
 is_win = sys.platform.startswith("win")
 
+# Windows has no real exec(), os.exec* spawns a new process there
+EXEC_BY_DEFAULT = not is_win
+
 
 class _Logger(object):
+    verbose = False
+
     def __init__(self):
-        self._logger = logging.getLogger(__name__)
-        self._logger.addHandler(logging.StreamHandler())
-        self._logger.setLevel(logging.INFO)
+        self._logger = None
+
+    def _get_logger(self):
+        # logging is imported and configured on first use
+        if self._logger is None:
+            import logging
+            self._logger = logging.getLogger(__name__)
+            self._logger.addHandler(logging.StreamHandler())
+            self._logger.setLevel(logging.INFO)
+        return self._logger
+
+    def timing(self, name, seconds):
+        """ Reports how long a phase took, in verbose mode only. """
+        if self.verbose:
+            self.info("%s took %.1f ms" % (name, seconds * 1000))
 
     def exception(self, *args, **kwargs):
         if self.verbose:
-            self._logger.exception(*args, **kwargs)
+            self._get_logger().exception(*args, **kwargs)
         else:
             self.error(*args, **kwargs)
 
     def __getattr__(self, name):
-        return getattr(self._logger, name)
+        return getattr(self._get_logger(), name)
 
 
 logger = _Logger()
@@ -46,78 +65,742 @@ class VipError(Exception):
 
 
 def is_exe(p):
-    return p.isfile() and p.access(os.X_OK)
+    return os.path.isfile(p) and os.access(p, os.X_OK)
+
+
+def get_cache_directory():
+    """ Returns a per-user directory where vip keeps its caches.
+
+    The location can be overridden with VIP_CACHE_DIR environment variable.
+    """
+    if os.environ.get("VIP_CACHE_DIR"):
+        return os.environ["VIP_CACHE_DIR"]
+
+    if is_win and os.environ.get("LOCALAPPDATA"):
+        return os.path.join(os.environ["LOCALAPPDATA"], "vip", "cache")
+
+    base = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "vip")
+
 
+def atomic_write(filename, data):
+    """ Writes data to a file, so that readers never see partial content.
+
+    The data is written to a temporary file next to the target, which is
+    then renamed over it.
+    """
+    temp = "%s.%d.tmp" % (filename, os.getpid())
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+
+        replace = getattr(os, "replace", None)
+        if replace is not None:
+            replace(temp, filename)
+        else:
+            if is_win and os.path.exists(filename):
+                os.remove(filename)
+            os.rename(temp, filename)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+# ioctl request cloning a file on copy-on-write filesystems (Linux)
+_FICLONE = 0x40049409
+
+
+def clone_file(source, target, link="auto"):
+    """ Makes target a copy of source as cheaply as possible
+
+    Args:
+        source: str, an existing regular file
+        target: str, a path that does not exist yet
+        link: str, one of 'reflink', 'hardlink', 'copy' or 'auto', which
+            tries the former ones in that order. Reflinks share data blocks
+            until one of the files is modified, hardlinks share the whole
+            file, so it must not be modified in place afterwards.
+
+    Returns:
+        The method that has been used
 
-def find_vip_directory(start="."):
+    Raises:
+        OSError, IOError: when the file cannot be cloned with given method
+    """
+    import shutil
+
+    if link in ("auto", "reflink") and sys.platform.startswith("linux"):
+        import fcntl
+
+        try:
+            with open(source, "rb") as src:
+                with open(target, "wb") as dst:
+                    fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            shutil.copystat(source, target)
+            return "reflink"
+        except (IOError, OSError):
+            if os.path.exists(target):
+                os.remove(target)
+            if link == "reflink":
+                raise
+
+    if link == "reflink":
+        raise OSError("reflinks are not supported on %s" % sys.platform)
+
+    if link in ("auto", "hardlink") and hasattr(os, "link"):
+        try:
+            os.link(source, target)
+            return "hardlink"
+        except OSError:
+            if link == "hardlink":
+                raise
+
+    shutil.copy2(source, target)
+    return "copy"
+
+
+def get_ceiling_directories(environ=None):
+    """ Returns absolute paths of directories listed in
+    `VIP_CEILING_DIRECTORIES`, separated like in PATH.
+    """
+    environ = os.environ if environ is None else environ
+    value = environ.get("VIP_CEILING_DIRECTORIES", "")
+    return [os.path.abspath(d) for d in value.split(os.pathsep) if d]
+
+
+def is_one_filesystem(environ=None):
+    """ Tells whether `VIP_ONE_FILESYSTEM` is set to a true value. """
+    environ = os.environ if environ is None else environ
+    value = environ.get("VIP_ONE_FILESYSTEM", "")
+    return value.lower() in ("1", "true", "yes")
+
+
+@trace.traced("find_vip_directory")
+def find_vip_directory(start=".", ceilings=None, one_filesystem=None):
     """ Finds the `.vip` directory up in the directory tree.
 
+    Each directory is probed for `DEFAULT_VIRTUALENV_DIRS` with a stat call
+    per name, so the cost depends on the depth only, not on the number of
+    entries in ancestors.
+
     Args:
         start: str directory name from where the search is started
+        ceilings: a list of directories, which the search does not enter
+            when going up, `VIP_CEILING_DIRECTORIES` by default
+        one_filesystem: bool, whether to stop at a filesystem boundary,
+            `VIP_ONE_FILESYSTEM` by default
 
     Returns:
-        An absolute path to `.vip` directory.
+        An absolute path to `.vip` (or `.venv`) directory.
 
     Raises:
         VipError: when no `.vip` directory has been found to the root.
     """
-    look_for = set(DEFAULT_VIRTUALENV_DIRS)
+    if ceilings is None:
+        ceilings = get_ceiling_directories()
+    if one_filesystem is None:
+        one_filesystem = is_one_filesystem()
+
+    ceilings = set(os.path.normcase(c) for c in ceilings)
+    directory = os.path.abspath(start)
+    device = os.stat(directory).st_dev if one_filesystem else None
 
-    directory = path.path(start).abspath()
+    while True:
+        for name in DEFAULT_VIRTUALENV_DIRS:
+            candidate = os.path.join(directory, name)
+            if os.path.isdir(candidate):
+                return candidate
 
-    while directory.parent != directory:
-        items = os.listdir(directory)
-        if any(i in look_for and (directory / i).isdir() for i in items):
-            return directory / VIP_DIRECTORY
+        parent = os.path.dirname(directory)
+        if parent == directory or os.path.normcase(parent) in ceilings:
+            break
+        if one_filesystem and os.stat(parent).st_dev != device:
+            break
 
-        directory = directory.parent
+        directory = parent
 
     raise VipError(
         "not a virtualenv (or any of the parent directories): %s" % start)
 
 
-def create_virtualenv(directory=".", install_requirements=True):
+def _iter_subdirectories(directory):
+    """ Yields (name, is_symlink) pairs for subdirectories of directory. """
+    scandir = getattr(os, "scandir", None)
+
+    if scandir is None:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                yield name, os.path.islink(path)
+        return
+
+    for entry in list(scandir(directory)):
+        try:
+            if entry.is_dir():
+                yield entry.name, entry.is_symlink()
+        except OSError:
+            pass
+
+
+def find_virtualenv_directories(root="."):
+    """ Finds all virtualenv directories below root.
+
+    Virtualenvs are looked up by `DEFAULT_VIRTUALENV_DIRS` names, like in
+    `find_vip_directory`. The walk does not descend into virtualenvs, hidden
+    directories and symbolic links.
+
+    Returns:
+        A sorted list of absolute paths to virtualenv directories.
+    """
+    look_for = set(DEFAULT_VIRTUALENV_DIRS)
+    found = []
+    pending = [os.path.abspath(root)]
+
+    while pending:
+        directory = pending.pop()
+        try:
+            subdirectories = list(_iter_subdirectories(directory))
+        except OSError as e:
+            logger.debug("cannot list %s: %s" % (directory, e))
+            continue
+
+        names = set(name for name, _ in subdirectories)
+        for name in DEFAULT_VIRTUALENV_DIRS:
+            if name in names:
+                found.append(os.path.join(directory, name))
+                break
+
+        pending.extend(os.path.join(directory, name)
+                       for name, is_symlink in subdirectories
+                       if not is_symlink and name not in look_for and
+                       not name.startswith("."))
+
+    return sorted(found)
+
+
+def parse_python_version(value):
+    """ Parses an interpreter version like "2.7" into a (2, 7) tuple.
+
+    Raises:
+        VipError: when value is not a version
+    """
+    parts = value.strip().split(".")
+    if len(parts) != 2 or not all(part.isdigit() for part in parts):
+        raise VipError("invalid Python version: %s (expected X.Y)" % value)
+    return int(parts[0]), int(parts[1])
+
+
+def get_environment_name(version):
+    """ Returns a name of the virtualenv for an interpreter version, like
+    `py27`.
+    """
+    return "py%d%d" % tuple(version[:2])
+
+
+def select_virtualenv(vip_directory, python=None, environ=None):
+    """ Returns a virtualenv in vip_directory for an interpreter version
+
+    A virtualenv directory holds either a single virtualenv, or one for every
+    interpreter version and `DEFAULT_PYTHON_FILENAME` (see
+    `vip.interpreters`). Then the version is python, `VIP_PYTHON`
+    environment variable or the default one, in this order.
+
+    Args:
+        vip_directory: str, a path to virtualenv directory
+        python: str, an interpreter version, like "2.7"
+        environ: a dict with environment variables, os.environ by default
+
+    Raises:
+        VipError: when there is no virtualenv for the version
+    """
+    try:
+        with open(os.path.join(vip_directory, DEFAULT_PYTHON_FILENAME)) as f:
+            default = f.read().strip()
+    except (IOError, OSError):
+        default = None
+
+    if default is None:
+        if python and parse_python_version(python) != \
+                get_virtualenv_python_version(vip_directory):
+            raise VipError("no virtualenv for Python %s in %s" % (
+                python, vip_directory))
+        return vip_directory
+
+    environ = os.environ if environ is None else environ
+    python = python or environ.get("VIP_PYTHON") or default
+    environment = os.path.join(
+        vip_directory, get_environment_name(parse_python_version(python)))
+    if not os.path.isdir(environment):
+        raise VipError("no virtualenv for Python %s in %s" % (
+            python, vip_directory))
+    return environment
+
+
+def get_project_directory(vip_directory):
+    """ Returns a directory containing a virtualenv, where requirements
+    files are, also for virtualenvs selected by `select_virtualenv`.
+    """
+    parent = os.path.dirname(os.path.abspath(vip_directory))
+    if os.path.isfile(os.path.join(parent, DEFAULT_PYTHON_FILENAME)):
+        return os.path.dirname(parent)
+    return parent
+
+
+@trace.traced("create_virtualenv")
+def create_virtualenv(directory=".", install_requirements=True,
+                      wheel_cache=None, from_template=False, precompile=None):
     """ Creates an virtualenv in given directory
 
+    A new virtualenv is built in a temporary directory and renamed into
+    place when its requirements are installed, so a half-built one is never
+    found by `find_vip_directory`. Creation and installs hold a lock (see
+    `vip.locking`), so processes initializing the same directory at once
+    wait for the first one and reuse the virtualenv it has built.
+
+    Args:
+        directory: str, where to create `.vip` directory
+        install_requirements: bool, whether to install requirements files
+        wheel_cache: bool, whether to install through the shared wheel
+            cache, see `install_requirements_files`
+        from_template: bool, whether to clone the virtualenv from a template
+            instead of creating it from scratch, see `vip.templates`
+        precompile: a list of optimization levels to compile bytecode at,
+            see `install_requirements_files`
+
     Returns:
         A path to directory containing virtualenv
 
     Raises:
-        VipError: when installation cannot be finished
+        VipError: when installation cannot be finished, or the lock is not
+            released in time
     """
+    with trace.span("import virtualenv"):
+        import path
+        import virtualenv
 
     directory = path.path(directory)
 
     try:
-        vip_directory = find_vip_directory(directory)
+        vip_directory = path.path(find_vip_directory(directory))
     except VipError:
         vip_directory = (path.path(directory) / VIP_DIRECTORY).abspath()
 
-    # TODO: allow to pass additional flags to virtualenv tool
-    if not vip_directory.exists():
-        virtualenv.create_environment(vip_directory)
+    if not vip_directory.parent.isdir():
+        vip_directory.parent.makedirs()
 
-    else:
-        logger.warning("Found %s directory, assuming it is "
-                       "a virtualenv" % vip_directory)
+    def create(temp):
+        # TODO: allow to pass additional flags to virtualenv tool
+        if from_template:
+            from vip import templates
+            templates.create_from_template(
+                temp, directory if install_requirements else None,
+                wheel_cache)
+        else:
+            with trace.span("virtualenv.create_environment"):
+                virtualenv.create_environment(temp)
 
-    # Let's assume that if .vip is directory it is also our virtualenv
-    if vip_directory.exists() and not vip_directory.isdir():
-        raise VipError("%s is not a directory" % vip_directory)
+    with lock_virtualenv(vip_directory) as lock:
+        if not vip_directory.exists():
+            build_virtualenv(vip_directory, create, directory,
+                             install_requirements, wheel_cache, precompile)
+            return vip_directory
 
-    # if requirements.txt exists try to install all packages
-    if install_requirements:
-        # TODO(dejw): allow installing all *requirements.txt files
-        requirements_file = directory / REQUIREMENTS_FILENAME
+        if lock.waited:
+            logger.info("Reusing %s created by another process" %
+                        vip_directory)
+        else:
+            logger.warning("Found %s directory, assuming it is "
+                           "a virtualenv" % vip_directory)
+
+        # Let's assume that if .vip is directory it is also our virtualenv
+        if not vip_directory.isdir():
+            raise VipError("%s is not a directory" % vip_directory)
 
-        if requirements_file.exists() and requirements_file.isfile():
-            logger.info("Installing requirements from %s" % requirements_file)
-            execute_virtualenv_command(vip_directory, "pip",
-                                       ["install", "-r", requirements_file])
+        # if requirements files exist try to install all packages
+        if install_requirements:
+            install_requirements_files(vip_directory, directory,
+                                       wheel_cache=wheel_cache,
+                                       uninstall=True, precompile=precompile)
 
     return vip_directory
 
 
+def lock_virtualenv(vip_directory):
+    """ Returns a lock (see `vip.locking`), which is held while a virtualenv
+    is created or installed into, on a `LOCK_SUFFIX` file next to it.
+    """
+    from vip import locking
+    return locking.FileLock("%s%s" % (vip_directory, LOCK_SUFFIX))
+
+
+def build_virtualenv(vip_directory, create, directory=None,
+                     install_requirements=True, wheel_cache=None,
+                     precompile=None):
+    """ Builds a virtualenv with requirements in a temporary directory next
+    to vip_directory, and renames it into place. The caller holds the lock
+    of `lock_virtualenv`.
+
+    Args:
+        vip_directory: str, where the virtualenv is going to be
+        create: a function creating an empty virtualenv in a given
+            directory
+        directory: str, where requirements files are
+        install_requirements: bool, whether to install requirements files
+        wheel_cache: bool, see `install_requirements_files`
+        precompile: a list of optimization levels, see
+            `install_requirements_files`
+    """
+    import shutil
+    from vip import relocate
+
+    # Leftovers of processes killed while building
+    parent, name = os.path.split(vip_directory)
+    for entry in os.listdir(parent):
+        if entry.startswith(name + ".") and entry.endswith(".tmp"):
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+
+    temp = "%s.%d.tmp" % (vip_directory, os.getpid())
+    try:
+        create(temp)
+
+        # if requirements files exist try to install all packages
+        if install_requirements:
+            install_requirements_files(temp, directory,
+                                       wheel_cache=wheel_cache,
+                                       uninstall=True, precompile=[])
+
+        relocate.relocate(temp, temp, vip_directory)
+        os.rename(temp, vip_directory)
+    finally:
+        if os.path.exists(temp):
+            shutil.rmtree(temp)
+
+    # Bytecode holds paths of modules, so it is compiled in place
+    levels = _get_precompile_levels(precompile)
+    if levels:
+        from vip import bytecode
+        bytecode.compile_virtualenv(vip_directory, levels)
+
+
+@trace.traced("install_requirements_files")
+def install_requirements_files(vip_directory, directory=None, prefix=None,
+                               wheel_cache=None, uninstall=False,
+                               force=False, precompile=None):
+    """ Installs packages from all applicable requirements files at once
+
+    Files are looked up with `get_requirements_filenames`, for given prefix
+    and the current interpreter version. When there are several of them,
+    they are merged into a single install plan, so that pip is run only once.
+    When a lockfile for the prefix and interpreter version of the virtualenv
+    exists (see `vip.lockfile`), it is installed instead of them.
+
+    A fingerprint of the installed plan is kept in vip_directory. When it
+    matches, pip is not run at all, and when it does not, only new or
+    changed requirements are installed. Prefixes installed before are kept
+    too, so projects still required by their files are never uninstalled.
+
+    Args:
+        vip_directory: str, a path to virtualenv
+        directory: str, where requirements files are, by default the
+            directory containing vip_directory
+        prefix: str, a prefix of additional requirements files to install
+        wheel_cache: bool, whether to build and install wheels through the
+            host-wide cache (see `vip.wheels`), by default it is used when
+            VIP_WHEEL_CACHE environment variable is set
+        uninstall: bool, whether to uninstall packages, which are no longer
+            required since the last install
+        force: bool, whether to install everything regardless of the
+            fingerprint
+        precompile: a list of optimization levels to compile bytecode of
+            site-packages at after packages are installed (see
+            `vip.bytecode`), by default those listed in VIP_COMPILE
+            environment variable
+
+    Returns:
+        A list of installed requirements files
+
+    Raises:
+        VipError: when requirements conflict or cannot be installed
+    """
+    from vip import requirements
+
+    if directory is None:
+        directory = get_project_directory(vip_directory)
+
+    version = get_virtualenv_python_version(vip_directory)
+    filenames, locked = _find_layer_files(directory, prefix, version)
+    if locked is not None:
+        from vip import lockfile
+        lockfile.warn_if_stale(locked, directory, prefix, version)
+    plan = requirements.InstallPlan.from_files(filenames)
+
+    installed = None if force else requirements.load_installed(vip_directory)
+    if installed is not None and installed["python"] != version:
+        installed = None
+
+    if installed is None:
+        if not filenames:
+            return filenames
+        to_install, to_remove = plan, []
+    elif installed["fingerprint"] == plan.fingerprint(version):
+        logger.info("Requirements are up to date")
+        return filenames
+    else:
+        to_install, to_remove = plan.difference(installed["plan"])
+
+    # Layers installed with other prefixes stay, e.g. `--sync` after
+    # `--install devel` keeps projects of devel requirements files
+    prefixes = set(installed["prefixes"]) if installed is not None else set()
+    others = [p for p in prefixes if p != prefix]
+    removed = []
+    if to_remove and uninstall:
+        required = _get_layers_projects(directory, others, version)
+        removed = [name for name in to_remove if name not in required]
+
+    if removed:
+        logger.info("Uninstalling %s" % ", ".join(removed))
+        code = execute_virtualenv_command(vip_directory, "pip",
+                                          ["uninstall", "-y"] + removed)
+        if code:
+            raise VipError("uninstallation failed with exit code %s" % code)
+
+    locked = locked is not None
+    if to_install is plan and len(filenames) == 1:
+        logger.info("Installing requirements from %s" % filenames[0])
+        install_requirements_file(vip_directory, filenames[0], wheel_cache,
+                                  locked=locked)
+
+    elif to_install.requirements:
+        logger.info("Installing requirements from %s" % ", ".join(filenames))
+        plan_filename = os.path.join(vip_directory, "install-plan.txt")
+        atomic_write(plan_filename, str(to_install))
+        try:
+            install_requirements_file(vip_directory, plan_filename,
+                                      wheel_cache, locked=locked)
+        finally:
+            os.remove(plan_filename)
+
+    # Projects left installed are remembered, so that they are uninstalled
+    # by a later sync
+    saved = plan
+    left = [name for name in to_remove if name not in removed]
+    if left:
+        saved = requirements.InstallPlan()
+        for line in plan.lines():
+            saved.add_line(line)
+        for requirement in installed["plan"].requirements:
+            if requirements.get_project_name(requirement) in left:
+                saved.add_line(str(requirement))
+
+    if prefix:
+        prefixes.add(prefix)
+    requirements.save_installed(vip_directory, saved, version, prefixes)
+
+    levels = _get_precompile_levels(precompile)
+    if levels and to_install.requirements:
+        from vip import bytecode
+        bytecode.compile_virtualenv(vip_directory, levels)
+
+    return filenames
+
+
+def _find_layer_files(directory, prefix, version):
+    """ Returns files to install for a prefix, either a lockfile or
+    requirements files, and the lockfile or None.
+    """
+    from vip import lockfile
+    from vip import requirements
+
+    locked = lockfile.find_lockfile(directory, prefix, version)
+    if locked is not None:
+        return [locked], locked
+    return requirements.find_requirements_files(directory, prefix,
+                                                version), None
+
+
+def _get_layers_projects(directory, prefixes, version):
+    """ Returns names of projects required by files of given prefixes. """
+    from vip import requirements
+
+    names = set()
+    for prefix in prefixes:
+        filenames = _find_layer_files(directory, prefix, version)[0]
+        plan = requirements.InstallPlan.from_files(filenames)
+        names.update(requirements.get_project_name(requirement)
+                     for requirement in plan.requirements)
+    return names
+
+
+def _get_precompile_levels(precompile):
+    if precompile is not None:
+        return precompile
+
+    from vip import bytecode
+    return bytecode.get_levels()
+
+
+def update_requirements_file(vip_directory, directory=None, create=True):
+    """ Updates `requirements.txt` to match packages installed in a
+    virtualenv, without running pip
+
+    Installed versions are read from metadata in site-packages. Entries keep
+    their order and comments, and projects listed in other applicable
+    requirements files, prefixed layers like `devel-requirements.txt`
+    included, are not added.
+
+    Args:
+        vip_directory: str, a path to virtualenv
+        directory: str, where requirements file is, by default the
+            directory containing vip_directory
+        create: bool, whether to create the file when it does not exist
+
+    Returns:
+        A path to the updated file, or None when it does not exist and
+        create is False
+    """
+    from vip import metadata
+    from vip import requirements
+
+    if directory is None:
+        directory = get_project_directory(vip_directory)
+    directory = os.path.abspath(directory)
+    filename = os.path.join(directory, REQUIREMENTS_FILENAME)
+
+    try:
+        with open(filename) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        if not create:
+            return None
+        lines = []
+
+    installed = dict(
+        (key, value) for key, value in
+        metadata.get_installed_index(vip_directory).items()
+        if key not in metadata.IGNORED_PROJECTS)
+
+    version = get_virtualenv_python_version(vip_directory)
+    others = []
+    for prefix in [None] + requirements.find_prefixes(directory):
+        for name in requirements.find_requirements_files(directory, prefix,
+                                                         version):
+            if name != filename and name not in others:
+                others.append(name)
+    plan = requirements.InstallPlan.from_files(others)
+    local = metadata.get_local_projects(vip_directory)
+    known = set()
+    for requirement in plan.requirements:
+        name = requirements.get_project_name(requirement)
+        if name is None:
+            name = local.get(requirements.get_local_path(requirement,
+                                                         directory))
+        known.add(name)
+
+    updated = requirements.update_requirements_lines(lines, installed, known,
+                                                     local, directory)
+    atomic_write(filename, "".join(updated))
+    return filename
+
+
+def check_requirements(vip_directory, directory=None, prefix=None):
+    """ Compares packages installed in a virtualenv with all applicable
+    requirements files, without running pip
+
+    Args:
+        vip_directory: str, a path to virtualenv
+        directory: str, where requirements files are, by default the
+            directory containing vip_directory
+        prefix: str, a prefix of additional requirements files to check
+
+    Returns:
+        A report, see `requirements.check_requirements`, with an additional
+        `files` list of checked requirements files
+
+    Raises:
+        VipError: when requirements conflict or cannot be parsed
+    """
+    from vip import metadata
+    from vip import requirements
+
+    if directory is None:
+        directory = get_project_directory(vip_directory)
+
+    version = get_virtualenv_python_version(vip_directory)
+    filenames = requirements.find_requirements_files(directory, prefix,
+                                                     version)
+    plan = requirements.InstallPlan.from_files(filenames)
+
+    installed = dict(
+        (key, value) for key, value in
+        metadata.get_installed_index(vip_directory).items()
+        if key not in metadata.IGNORED_PROJECTS)
+
+    report = requirements.check_requirements(plan, installed)
+    report["files"] = filenames
+    return report
+
+
+def is_package_command(command, args):
+    """ Tells whether a command changes installed packages, like
+    `pip install` or `easy_install`.
+    """
+    name = os.path.basename(command).lower()
+    if name.endswith(".exe"):
+        name = name[:-len(".exe")]
+
+    if name.startswith("easy_install"):
+        return True
+    if name != "pip" and not (name.startswith("pip") and
+                              name[3:].replace(".", "").isdigit()):
+        return False
+
+    subcommands = [arg for arg in args if not arg.startswith("-")]
+    return bool(subcommands) and subcommands[0] in ("install", "uninstall")
+
+
+def is_auto_update_enabled(environ=None):
+    """ Tells whether requirements file should be updated after package
+    commands, which can be disabled with `VIP_AUTO_UPDATE=0`.
+    """
+    environ = os.environ if environ is None else environ
+    value = environ.get("VIP_AUTO_UPDATE", "1")
+    return value.lower() not in ("0", "false", "no")
+
+
+def install_requirements_file(vip_directory, requirements_file,
+                              wheel_cache=None, locked=False):
+    """ Installs packages from a single requirements file with pip
+
+    Locked requirements are installed without resolving dependencies and
+    with hash checking, and never through the wheel cache, since wheels
+    built from source distributions do not match their hashes.
+
+    Raises:
+        VipError: when pip fails
+    """
+    from vip import lockfile
+    from vip import wheels
+
+    with trace.span("pip install", requirements=requirements_file):
+        if locked:
+            code = execute_virtualenv_command(
+                vip_directory, "pip", ["install"] +
+                lockfile.INSTALL_ARGUMENTS + ["-r", requirements_file])
+        elif wheels.is_enabled(wheel_cache):
+            code = wheels.Wheelhouse().install(vip_directory,
+                                               requirements_file)
+        else:
+            code = execute_virtualenv_command(
+                vip_directory, "pip", ["install", "-r", requirements_file])
+
+    if code:
+        raise VipError("installation of %s failed with exit code %s" % (
+            requirements_file, code))
+
+
 def find_windows_executable(exe_base):
     """ Given a base filepath, try to resolve the file path to an executable
     on Windows. If the base filepath exists and is a file, we'll return that
@@ -134,6 +817,8 @@ def find_windows_executable(exe_base):
     Raises:
         VipError: when no executable can be found.
     """
+    import path
+
     exe_base = path.path(exe_base)
 
     ext_val = os.environ["PATHEXT"].lower()\
@@ -160,30 +845,154 @@ def find_windows_executable(exe_base):
         raise VipError("%s not found or is not executable" % exe_base)
 
 
-def execute_virtualenv_command(vip_directory, command, args):
+@trace.traced("find_virtualenv_executable")
+def find_virtualenv_executable(vip_directory, command):
+    """ Resolves a command name to an executable in vip_directory
+
+    Returns:
+        A path to vip_directory/bin/command executable
+
+    Raises:
+        VipError: when command is not found or is not executable
+    """
+    if is_win:
+        executable_base = os.path.join(vip_directory, "Scripts", command)
+        return find_windows_executable(executable_base)
+
+    executable_path = os.path.join(vip_directory, "bin", command)
+    if not os.path.exists(executable_path) or not is_exe(executable_path):
+        raise VipError(
+            "%s not found or is not executable" % executable_path)
+
+    return executable_path
+
+
+def get_virtualenv_python_version(vip_directory):
+    """ Guesses version of the interpreter in vip_directory without running it
+
+    Returns:
+        A (major, minor) tuple, version of the current interpreter when it
+        cannot be determined
+    """
+    import re
+
+    try:
+        with open(os.path.join(vip_directory, "pyvenv.cfg")) as f:
+            match = re.search(r"^version(?:_info)?\s*=\s*(\d+)\.(\d+)",
+                              f.read(), re.MULTILINE)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+    except (IOError, OSError):
+        pass
+
+    if not is_win:
+        try:
+            entries = os.listdir(os.path.join(vip_directory, "lib"))
+        except OSError:
+            entries = []
+
+        for entry in sorted(entries):
+            match = re.match(r"^python(\d+)\.(\d+)$", entry)
+            if match:
+                return int(match.group(1)), int(match.group(2))
+
+    return tuple(sys.version_info[:2])
+
+
+def get_site_packages(vip_directory):
+    """ Returns a path to site-packages directory of a virtualenv """
+    if is_win:
+        return os.path.join(vip_directory, "Lib", "site-packages")
+
+    return os.path.join(vip_directory, "lib",
+                        "python%d.%d" % get_virtualenv_python_version(
+                            vip_directory),
+                        "site-packages")
+
+
+def get_virtualenv_environ(vip_directory, environ=None):
+    """ Produces environment variables of an activated virtualenv
+
+    It mimics what `bin/activate` script does: sets VIRTUAL_ENV, puts
+    virtualenv executables in front of PATH and unsets PYTHONHOME.
+
+    Args:
+        vip_directory: str, a path to virtualenv
+        environ: a mapping to start with, os.environ by default
+
+    Returns:
+        A new dict with environment variables
+    """
+    environ = dict(os.environ if environ is None else environ)
+    vip_directory = os.path.abspath(vip_directory)
+    bin_directory = os.path.join(vip_directory,
+                                 "Scripts" if is_win else "bin")
+
+    paths = [bin_directory]
+    if environ.get("PATH"):
+        paths.append(environ["PATH"])
+
+    environ["PATH"] = os.pathsep.join(paths)
+    environ["VIRTUAL_ENV"] = vip_directory
+    environ.pop("PYTHONHOME", None)
+    return environ
+
+
+def exec_virtualenv_command(vip_directory, command, args):
+    """ Replaces current process with vip_directory/bin/command executable
+
+    Unlike `execute_virtualenv_command` this function does not return on
+    success: the command inherits process id, standard streams and signals,
+    and its exit code is passed directly to the caller of vip.
+
+    Raises:
+        VipError: when command is not found or cannot be executed
+    """
+    executable_path = find_virtualenv_executable(vip_directory, command)
+    environ = get_virtualenv_environ(vip_directory)
+
+    # Buffered output would be lost otherwise
+    trace.flush()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    try:
+        os.execve(executable_path, [executable_path] + list(args), environ)
+    except OSError as e:
+        raise VipError("cannot execute %s: %s" % (executable_path, e))
+
+
+def execute_virtualenv_command(vip_directory, command, args, stdout=None,
+                               stderr=None, cwd=None, interactive=False):
     """ Executes a vip_directory/bin/command executable with given arguments
 
+    Output goes to stdout and stderr, sys.stdout and sys.stderr by default.
+    The command is run in cwd directory, the current one by default, with
+    environment variables of an activated virtualenv, like in
+    `exec_virtualenv_command`. Unless interactive is set, the command gets a
+    closed standard input.
+
     Raises:
         VipError: when command is not found or cannot be executed
     """
-    vip_directory = path.path(vip_directory)
+    import subprocess
 
-    if is_win:
-        executable_base = vip_directory / "Scripts" / command
-        executable_path = find_windows_executable(executable_base)
-    else:
-        executable_path = vip_directory / "bin" / command
-        if not executable_path.exists() or not is_exe(executable_path):
-            raise VipError(
-                "%s not found or is not executable" % executable_path)
+    executable_path = find_virtualenv_executable(vip_directory, command)
 
-    arguments = [executable_path] + args
-    p = subprocess.Popen(arguments, stdout=sys.stdout, stderr=sys.stderr,
-                         stdin=subprocess.PIPE)
+    arguments = [executable_path] + list(args)
+    with trace.span("spawn", command=command):
+        p = subprocess.Popen(arguments,
+                             stdout=sys.stdout if stdout is None else stdout,
+                             stderr=sys.stderr if stderr is None else stderr,
+                             stdin=None if interactive else subprocess.PIPE,
+                             cwd=cwd,
+                             env=get_virtualenv_environ(vip_directory))
 
     try:
-        p.stdin.close()
-        p.communicate()
+        if not interactive:
+            p.stdin.close()
+        with trace.span("wait", command=command):
+            p.communicate()
         return p.returncode
     except subprocess.CalledProcessError as e:
         raise VipError(str(e))
@@ -215,18 +1024,20 @@ def get_requirements_filenames(prefix=None, version=None, extension='txt'):
     Args:
         prefix: str, a prefix for requirements, like 'dev', 'devel', 'prod'
         version: an iterable, with version segments to use, using
-            os.version_info by default
+            sys.version_info by default
         extension: str, what extension to use, 'txt' by default
 
     Returns:
         a sequence of filenames
     """
+    import itertools
+
     prefixes = ['']
 
     if prefix:
         prefixes.append('%s-' % prefix)
 
-    version = os.version_info if version is None else version
+    version = sys.version_info[:3] if version is None else version
     version = [str(v) for v in version]
     version = [''] + ['-%s' % ''.join(version[:i + 1])
                       for i, v in enumerate(version) if v]
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+"""
+Deduplication of identical files across virtualenvs on a host.
+
+Virtualenvs of many projects hold byte-identical copies of the same
+packages. `vip --dedupe [root ...]` finds virtualenvs below roots (like
+`--each` does), and replaces duplicate files with reflinks or hard links
+(see `core.clone_file`), so they share disk space and page cache.
+
+Only files of the same size, permissions and owner on the same filesystem
+can be duplicates, so only those are hashed, by a pool of threads. Hashes
+are kept in an index in the cache directory along with size, modification
+time and inode of every file, so files that have not changed are not read
+again on later runs.
+
+Hard linked files share data, so a file modified in place changes in every
+virtualenv. pip replaces files instead of modifying them, which keeps linked
+copies intact.
+"""
+
+import hashlib
+import json
+import os
+import stat
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from vip import core
+
+
+INDEX_FILENAME = "dedupe-index.json"
+
+# Smaller files are not worth linking
+DEFAULT_MIN_SIZE = 4096
+
+HASH_ALGORITHM = "sha256"
+
+
+class FileInfo(object):
+    """ A regular file found in a virtualenv. """
+
+    def __init__(self, path, st):
+        self.path = path
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.device = st.st_dev
+        self.inode = st.st_ino
+        self.mode = stat.S_IMODE(st.st_mode)
+        self.uid = getattr(st, "st_uid", 0)
+        self.digest = None
+
+        # Reflinked files have their own inodes, they are marked instead
+        self.cloned = False
+
+    @property
+    def group(self):
+        """ Files can be linked only within the same group. """
+        return self.device, self.size, self.mode, self.uid
+
+    def is_indexed(self, entry):
+        return entry is not None and \
+            entry[:3] == [self.size, self.mtime, self.inode]
+
+    def to_entry(self):
+        return [self.size, self.mtime, self.inode, self.digest, self.cloned]
+
+
+def iter_files(vip_directory, min_size=DEFAULT_MIN_SIZE):
+    """ Yields FileInfo of regular files in a virtualenv of at least
+    min_size bytes. Symbolic links are not followed.
+    """
+    for root, dirs, files in os.walk(vip_directory):
+        for name in files:
+            filename = os.path.join(root, name)
+            try:
+                st = os.lstat(filename)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode) and st.st_size >= min_size:
+                yield FileInfo(filename, st)
+
+
+def find_candidates(files):
+    """ Returns files, which have others of the same size, permissions and
+    owner on the same filesystem, stored in other inodes.
+    """
+    groups = {}
+    for info in files:
+        groups.setdefault(info.group, []).append(info)
+
+    return [info for group in groups.values()
+            if len(set(i.inode for i in group)) > 1
+            for info in group]
+
+
+def hash_file(filename, algorithm=HASH_ALGORITHM):
+    digest = hashlib.new(algorithm)
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(files, index, jobs=None):
+    """ Sets digests of files, reading only those not up to date in index,
+    by a pool of jobs threads.
+
+    Returns:
+        number of files that have been read
+    """
+    from vip import batch
+
+    pending = queue.Queue()
+    for info in files:
+        entry = index.get(info.path)
+        if info.is_indexed(entry):
+            info.digest = entry[3]
+            info.cloned = bool(entry[4:] and entry[4])
+        else:
+            pending.put(info)
+
+    read = pending.qsize()
+
+    def worker():
+        while True:
+            try:
+                info = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                info.digest = hash_file(info.path)
+            except (IOError, OSError) as e:
+                core.logger.debug("cannot read %s: %s" % (info.path, e))
+
+    jobs = max(1, min(jobs or batch.get_default_jobs(), read))
+    workers = [threading.Thread(target=worker) for _ in range(jobs)]
+    for thread in workers:
+        thread.daemon = True
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    return read
+
+
+def link_file(source, target, link="auto"):
+    """ Replaces target with a link or a clone of source, atomically.
+
+    Returns:
+        the method that has been used, or None when the file has changed
+        or only a copy could be made
+    """
+    temp = "%s.%d.dedupe" % (target, os.getpid())
+    try:
+        method = core.clone_file(source, temp, link)
+        if method == "copy":
+            return None
+        os.rename(temp, target)
+        return method
+    finally:
+        if os.path.lexists(temp):
+            os.remove(temp)
+
+
+class Deduplicator(object):
+    """ Replaces duplicate files in virtualenvs with links.
+
+    Args:
+        index_filename: str, where to keep the index of hashes, in the cache
+            directory by default
+        min_size: int, ignores files smaller than that
+        jobs: int, how many files to hash at once
+        link: str, a method passed to `core.clone_file`
+    """
+
+    def __init__(self, index_filename=None, min_size=DEFAULT_MIN_SIZE,
+                 jobs=None, link="auto"):
+        if index_filename is None:
+            index_filename = os.path.join(core.get_cache_directory(),
+                                          INDEX_FILENAME)
+        self.index_filename = index_filename
+        self.min_size = min_size
+        self.jobs = jobs
+        self.link = link
+
+    def load_index(self):
+        try:
+            with open(self.index_filename) as f:
+                index = json.load(f)
+            if isinstance(index, dict):
+                return index
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def save_index(self, index):
+        directory = os.path.dirname(self.index_filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        core.atomic_write(self.index_filename,
+                          json.dumps(index, sort_keys=True) + "\n")
+
+    def run(self, vip_directories):
+        """ Deduplicates files of virtualenvs.
+
+        Returns:
+            a dict with numbers of `scanned`, `hashed` and `linked` files,
+            `reclaimed` bytes and a count of every link `methods` used
+        """
+        files = []
+        for vip_directory in vip_directories:
+            files.extend(iter_files(vip_directory, self.min_size))
+
+        candidates = find_candidates(files)
+        index = self.load_index()
+        hashed = hash_files(candidates, index, self.jobs)
+
+        # Entries of removed or changed files of scanned virtualenvs are
+        # dropped, entries of other virtualenvs are kept
+        prefixes = tuple(os.path.join(os.path.abspath(d), "")
+                         for d in vip_directories)
+        seen = dict((info.path, info) for info in files)
+        index = dict((path, entry) for path, entry in index.items()
+                     if not path.startswith(prefixes) or
+                     (path in seen and seen[path].is_indexed(entry)))
+
+        report = {"scanned": len(files), "hashed": hashed, "linked": 0,
+                  "reclaimed": 0, "methods": {}}
+
+        duplicates = {}
+        for info in candidates:
+            if info.digest is not None:
+                duplicates.setdefault(info.group + (info.digest,),
+                                      []).append(info)
+
+        for group in duplicates.values():
+            # Files already sharing the most links are kept
+            group.sort(key=lambda i: (-sum(1 for j in group
+                                           if j.inode == i.inode), i.path))
+            source = group[0]
+
+            for info in group:
+                if info.inode != source.inode and not info.cloned:
+                    self._replace(source, info, report)
+                index[info.path] = info.to_entry()
+
+        self.save_index(index)
+        return report
+
+    def _replace(self, source, info, report):
+        try:
+            # Files changed since they were hashed are left alone
+            st = os.lstat(info.path)
+            if [st.st_size, st.st_mtime, st.st_ino] != \
+                    [info.size, info.mtime, info.inode]:
+                return
+
+            method = link_file(source.path, info.path, self.link)
+        except (IOError, OSError) as e:
+            core.logger.debug("cannot link %s: %s" % (info.path, e))
+            return
+
+        if method is None:
+            return
+
+        st = os.lstat(info.path)
+        info.mtime, info.inode = st.st_mtime, st.st_ino
+        info.cloned = method == "reflink"
+
+        report["linked"] += 1
+        report["reclaimed"] += info.size
+        report["methods"][method] = report["methods"].get(method, 0) + 1
+
+
+def dedupe(roots, jobs=None, link="auto"):
+    """ Deduplicates files of all virtualenvs found below roots, see
+    `Deduplicator.run`.
+
+    Raises:
+        VipError: when no virtualenvs are found
+    """
+    vip_directories = []
+    for root in roots:
+        for directory in core.find_virtualenv_directories(root):
+            if directory not in vip_directories:
+                vip_directories.append(directory)
+
+    if not vip_directories:
+        raise core.VipError("no virtualenvs found below %s" %
+                            ", ".join(roots))
+
+    core.logger.info("Found %d virtualenvs" % len(vip_directories))
+    report = Deduplicator(jobs=jobs, link=link).run(vip_directories)
+    report["virtualenvs"] = len(vip_directories)
+    return report
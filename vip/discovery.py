@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+"""
+Persistent cache for `.vip` directory discovery.
+
+Looking for `.vip` directory requires inspecting every ancestor of the
+start directory, which is slow on network filesystems with large parent
+directories. The cache remembers where the search ended for a given start
+directory, along with inode numbers and modification times of all
+directories on the way. Adding or removing an entry changes modification
+time of a directory, so a cached result is valid as long as none of those
+directories has changed, which can be checked with a few `stat` calls.
+
+Ceiling directories and filesystem boundaries only cut the search short, so
+they are not part of an entry; a cached result is just checked to be
+reachable under the current settings.
+"""
+
+import os
+
+from vip import core
+from vip import trace
+
+
+CACHE_FILENAME = "locations"
+MAX_ENTRIES = 256
+
+
+def _stamp(st):
+    return "%d:%r" % (st.st_ino, st.st_mtime)
+
+
+def _chain(start, vip_directory):
+    """ Yields directories examined when searching from start to
+    vip_directory.
+    """
+    top = os.path.dirname(vip_directory)
+    directory = start
+
+    while True:
+        yield directory
+        if directory == top:
+            return
+
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            raise ValueError("%s is not below %s" % (start, top))
+        directory = parent
+
+
+class DiscoveryCache(object):
+    """ LRU cache of discovery results, kept in a plain text file.
+
+    Each line holds a start directory, a found `.vip` directory and stamps
+    of directories in between, separated with tabs. Lines are ordered from
+    the least to the most recently used one.
+    """
+
+    def __init__(self, filename=None, max_entries=MAX_ENTRIES):
+        if filename is None:
+            filename = os.path.join(core.get_cache_directory(),
+                                    CACHE_FILENAME)
+
+        self.filename = filename
+        self.max_entries = max_entries
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self):
+        entries = []
+
+        try:
+            with open(self.filename) as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) == 3:
+                        entries.append(fields)
+        except (IOError, OSError):
+            pass
+
+        return entries
+
+    def _save(self):
+        data = "".join("\t".join(entry) + "\n" for entry in self.entries)
+
+        try:
+            directory = os.path.dirname(self.filename)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            core.atomic_write(self.filename, data)
+        except (IOError, OSError) as e:
+            core.logger.debug("cannot write discovery cache: %s" % e)
+
+    def _index(self, start):
+        for i, entry in enumerate(self.entries):
+            if entry[0] == start:
+                return i
+        return None
+
+    def lookup(self, start, ceilings=(), one_filesystem=False):
+        """ Returns a cached `.vip` directory for start, or None when there
+        is no valid entry, or when it is not reachable from start with
+        given ceilings and one_filesystem settings.
+        """
+        start = os.path.abspath(start)
+        index = self._index(start)
+        if index is None:
+            return None
+
+        _, vip_directory, stamps = self.entries[index]
+        try:
+            chain = list(_chain(start, vip_directory))
+            stats = [os.stat(d) for d in chain]
+            valid = (os.path.isdir(vip_directory) and
+                     stamps.split(" ") == [_stamp(st) for st in stats])
+        except (OSError, ValueError):
+            valid = False
+
+        if valid:
+            ceilings = set(os.path.normcase(c) for c in ceilings)
+            if (any(os.path.normcase(d) in ceilings for d in chain[1:]) or
+                    one_filesystem and
+                    len(set(st.st_dev for st in stats)) > 1):
+                # The entry itself is fine, only not usable right now
+                return None
+
+        entry = self.entries.pop(index)
+        if not valid:
+            self._save()
+            return None
+
+        # Move the entry to the end, but avoid rewriting the file when it
+        # already was the most recently used one
+        self.entries.append(entry)
+        if index != len(self.entries) - 1:
+            self._save()
+
+        return vip_directory
+
+    def store(self, start, vip_directory):
+        """ Remembers that the search from start has found vip_directory.
+        """
+        start = os.path.abspath(start)
+        vip_directory = os.path.abspath(vip_directory)
+
+        if any(c in p for p in (start, vip_directory) for c in "\t\n"):
+            return
+
+        try:
+            stamps = " ".join(_stamp(os.stat(d))
+                              for d in _chain(start, vip_directory))
+        except (OSError, ValueError):
+            return
+
+        index = self._index(start)
+        if index is not None:
+            del self.entries[index]
+
+        self.entries.append([start, vip_directory, stamps])
+        del self.entries[:-self.max_entries]
+        self._save()
+
+
+@trace.traced("discovery")
+def find_vip_directory(start=".", refresh=False, cache=None, ceilings=None,
+                       one_filesystem=None):
+    """ Finds the `.vip` directory like `core.find_vip_directory`, but
+    consults the discovery cache first.
+
+    Args:
+        start: str directory name from where the search is started
+        refresh: bool, when True the cache is not consulted, but the
+            result of the search is stored in it
+        cache: DiscoveryCache instance, a default one is used if not given
+        ceilings, one_filesystem: like in `core.find_vip_directory`
+
+    Returns:
+        An absolute path to `.vip` directory.
+
+    Raises:
+        VipError: when no `.vip` directory has been found to the root.
+    """
+    cache = DiscoveryCache() if cache is None else cache
+    if ceilings is None:
+        ceilings = core.get_ceiling_directories()
+    if one_filesystem is None:
+        one_filesystem = core.is_one_filesystem()
+
+    if not refresh:
+        vip_directory = cache.lookup(start, ceilings, one_filesystem)
+        if vip_directory is not None:
+            return vip_directory
+
+    vip_directory = core.find_vip_directory(start, ceilings, one_filesystem)
+    cache.store(start, vip_directory)
+    return vip_directory
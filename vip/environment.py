@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Activation of virtualenvs in the running interpreter.
+
+`vip.activate()` makes packages of a virtualenv importable without starting
+`vip python`, which is what `activate_this.py` of virtualenv does: it adds
+site-packages with `site.addsitedir` (so `.pth` files are processed) in front
+of `sys.path`, points `sys.prefix` and `sys.exec_prefix` at the virtualenv,
+and sets environment variables as `bin/activate` does, for subprocesses.
+
+The state it replaces is kept, so `vip.deactivate()` puts it back, and
+activating another virtualenv deactivates the current one first. Packages
+are compiled for an interpreter version, so a virtualenv of another version
+is refused.
+"""
+
+import os
+import sys
+
+from vip import core
+from vip import trace
+
+
+class _Activation(object):
+    """ What has been changed by activating a virtualenv. """
+
+    def __init__(self, vip_directory):
+        self.vip_directory = vip_directory
+        self.added_paths = []
+        self.prefix = sys.prefix
+        self.exec_prefix = sys.exec_prefix
+        self.environ = {}
+
+
+_active = None
+
+
+def get_active():
+    """ Returns a path to the virtualenv activated in this interpreter, or
+    None.
+    """
+    return _active.vip_directory if _active is not None else None
+
+
+def check_version(vip_directory):
+    """ Raises VipError, when vip_directory is a virtualenv of another
+    interpreter version than the running one.
+    """
+    version = core.get_virtualenv_python_version(vip_directory)
+    if tuple(version) != tuple(sys.version_info[:2]):
+        raise core.VipError(
+            "%s is a virtualenv of Python %d.%d, cannot activate it in "
+            "Python %d.%d" % ((vip_directory,) + tuple(version) +
+                              tuple(sys.version_info[:2])))
+
+
+@trace.traced("activate")
+def activate(start=".", python=None):
+    """ Activates a virtualenv in the running interpreter.
+
+    Args:
+        start: str, a directory where the search for `.vip` starts, see
+            `core.find_vip_directory`
+        python: str, an interpreter version, see `core.select_virtualenv`
+
+    Returns:
+        A path to the activated virtualenv
+
+    Raises:
+        VipError: when no virtualenv is found, or it is of another
+            interpreter version
+    """
+    import site
+
+    global _active
+
+    vip_directory = core.select_virtualenv(
+        core.find_vip_directory(start), python)
+    if vip_directory == get_active():
+        return vip_directory
+
+    check_version(vip_directory)
+    site_packages = core.get_site_packages(vip_directory)
+    if not os.path.isdir(site_packages):
+        raise core.VipError("%s not found" % site_packages)
+
+    deactivate()
+    activation = _Activation(vip_directory)
+
+    # addsitedir appends, entries of the virtualenv go first like in
+    # activate_this.py
+    previous = set(sys.path)
+    site.addsitedir(site_packages)
+    added = [p for p in sys.path if p not in previous]
+    sys.path[:] = added + [p for p in sys.path if p not in added]
+    activation.added_paths = added
+
+    sys.prefix = sys.exec_prefix = vip_directory
+
+    environ = core.get_virtualenv_environ(vip_directory)
+    for name in ("PATH", "VIRTUAL_ENV", "PYTHONHOME"):
+        activation.environ[name] = os.environ.get(name)
+        if name in environ:
+            os.environ[name] = environ[name]
+        else:
+            os.environ.pop(name, None)
+
+    _invalidate_caches()
+    _active = activation
+    return vip_directory
+
+
+def deactivate(unload=True):
+    """ Reverts `activate`, does nothing when no virtualenv is active.
+
+    Args:
+        unload: bool, whether to remove modules imported from the virtualenv
+            from `sys.modules`, so that they are imported again from the
+            next one
+
+    Returns:
+        A path to the deactivated virtualenv, or None
+    """
+    global _active
+
+    activation, _active = _active, None
+    if activation is None:
+        return None
+
+    sys.path[:] = [p for p in sys.path if p not in activation.added_paths]
+    sys.prefix = activation.prefix
+    sys.exec_prefix = activation.exec_prefix
+
+    for name, value in activation.environ.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+    if unload:
+        _unload_modules(activation.vip_directory)
+
+    _invalidate_caches()
+    return activation.vip_directory
+
+
+def _unload_modules(vip_directory):
+    prefix = os.path.join(vip_directory, "")
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, "__file__", None)
+        if filename and os.path.abspath(filename).startswith(prefix):
+            del sys.modules[name]
+
+
+def _invalidate_caches():
+    # Finders of Python 3 cache directory listings
+    try:
+        import importlib
+        importlib.invalidate_caches()
+    except (ImportError, AttributeError):
+        pass
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+"""
+Virtualenvs for several interpreter versions in one project.
+
+`vip --init --python 2.7,3.3` creates a virtualenv for every version inside
+`.vip` directory, named by `core.get_environment_name` (`.vip/py27`,
+`.vip/py33`), and writes the first version to `.vip/default-python`.
+Interpreters are looked up as `pythonX.Y` on PATH, virtualenvs are created
+and their requirements installed concurrently, each one with requirements
+files and lockfiles for its own version.
+
+Commands are run from the default virtualenv, unless another version is
+given with `vip --python X.Y command` or `VIP_PYTHON` environment variable,
+see `core.select_virtualenv`.
+"""
+
+import os
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from vip import core
+from vip import trace
+
+
+def parse_versions(value):
+    """ Parses a comma separated list of interpreter versions.
+
+    Returns:
+        a list of (major, minor) tuples, without duplicates
+
+    Raises:
+        VipError: when any of them is not a version
+    """
+    versions = []
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        version = core.parse_python_version(item)
+        if version not in versions:
+            versions.append(version)
+
+    if not versions:
+        raise core.VipError("no Python versions given")
+    return versions
+
+
+def find_interpreter(version, environ=None):
+    """ Returns a path to `pythonX.Y` executable from PATH.
+
+    Raises:
+        VipError: when there is no such interpreter
+    """
+    environ = os.environ if environ is None else environ
+    names = ["python%d.%d" % version]
+    if core.is_win:
+        names = [name + ".exe" for name in names]
+
+    for directory in environ.get("PATH", "").split(os.pathsep):
+        for name in names:
+            executable = os.path.join(directory, name)
+            if core.is_exe(executable):
+                return executable
+
+    raise core.VipError("cannot find Python %d.%d interpreter (%s) on PATH" %
+                        (version + (names[0],)))
+
+
+def create_environment(directory, version, install_requirements=True,
+                       wheel_cache=None):
+    """ Creates a virtualenv for an interpreter version in `.vip` directory
+    of a project, and installs requirements for the version into it.
+
+    Like `core.create_virtualenv`, it holds a lock meanwhile, and builds the
+    virtualenv in a temporary directory, so it is never seen half-built.
+
+    Returns:
+        a path to the virtualenv
+
+    Raises:
+        VipError: when the interpreter is missing, or creation or
+            installation fails
+    """
+    import subprocess
+
+    directory = os.path.abspath(directory)
+    environment = os.path.join(directory, core.VIP_DIRECTORY,
+                               core.get_environment_name(version))
+
+    def create(temp):
+        interpreter = find_interpreter(version)
+        core.logger.info("Creating virtualenv for Python %d.%d" % version)
+
+        with trace.span("virtualenv", python="%d.%d" % version):
+            process = subprocess.Popen(
+                [sys.executable, "-m", "virtualenv", "--python",
+                 interpreter, temp],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = process.communicate()[0]
+
+        if process.returncode:
+            raise core.VipError(
+                "creating virtualenv for Python %d.%d failed with exit code "
+                "%s:\n%s" % (version + (process.returncode,
+                                        output.decode("utf-8", "replace"))))
+
+    if not os.path.isdir(os.path.dirname(environment)):
+        os.makedirs(os.path.dirname(environment))
+
+    with core.lock_virtualenv(environment) as lock:
+        if not os.path.isdir(environment):
+            core.build_virtualenv(environment, create, directory,
+                                  install_requirements, wheel_cache)
+            return environment
+
+        if lock.waited:
+            core.logger.info("Reusing %s created by another process" %
+                             environment)
+        else:
+            core.logger.warning("Found %s directory, assuming it is "
+                                "a virtualenv" % environment)
+
+        if install_requirements:
+            core.install_requirements_files(environment, directory,
+                                            wheel_cache=wheel_cache,
+                                            uninstall=True)
+
+    return environment
+
+
+def create_environments(directory, versions, jobs=None,
+                        install_requirements=True, wheel_cache=None):
+    """ Creates virtualenvs for interpreter versions concurrently, see
+    `create_environment`. The first version becomes the default one.
+
+    Args:
+        directory: str, a project directory
+        versions: a list of (major, minor) tuples
+        jobs: int, how many virtualenvs to create at once, all by default
+
+    Returns:
+        a list of paths to virtualenvs
+
+    Raises:
+        VipError: when `.vip` is a single virtualenv, or any virtualenv
+            could not be created, after all of them have finished
+    """
+    vip_directory = os.path.join(os.path.abspath(directory),
+                                 core.VIP_DIRECTORY)
+    default_filename = os.path.join(vip_directory,
+                                    core.DEFAULT_PYTHON_FILENAME)
+
+    if os.path.isdir(vip_directory) and \
+            not os.path.isfile(default_filename) and os.listdir(vip_directory):
+        raise core.VipError("%s is a virtualenv for a single interpreter" %
+                            vip_directory)
+
+    if not os.path.isdir(vip_directory):
+        os.makedirs(vip_directory)
+    core.atomic_write(default_filename, "%d.%d\n" % versions[0])
+
+    pending = queue.Queue()
+    for version in versions:
+        pending.put(version)
+
+    results = {}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                version = pending.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                result = create_environment(directory, version,
+                                            install_requirements, wheel_cache)
+            except core.VipError as e:
+                result = e
+            except Exception as e:
+                result = core.VipError("creating virtualenv for Python "
+                                       "%d.%d failed: %s" % (version + (e,)))
+            with lock:
+                results[version] = result
+
+    jobs = len(versions) if not jobs else min(jobs, len(versions))
+    workers = [threading.Thread(target=worker) for _ in range(jobs)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    errors = [results[v] for v in versions
+              if isinstance(results[v], core.VipError)]
+    if errors:
+        raise core.VipError("\n".join(str(e) for e in errors))
+
+    return [results[version] for version in versions]
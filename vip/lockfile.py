@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lockfiles with exact versions and artifact hashes of all requirements.
+
+`vip --lock` resolves requirements files once, with `pip download`, and
+writes every downloaded project pinned to its version, with a hash of the
+artifact, to `[prefix-]requirements-XY.lock` file for the interpreter version
+of the virtualenv (see `core.get_requirements_filenames`):
+
+    nose==1.3.7 \\
+        --hash=sha256:9ff7c6cc443f8c51994b34a667bbcf45afd6d945be74...
+
+When a lockfile applies, it is installed instead of requirements files, with
+`--no-deps --require-hashes`, so no dependencies are resolved and every
+artifact must match its hash. Its header records a fingerprint of the
+requirements files it was generated from, so a lockfile, which has not been
+regenerated after they changed, is reported when it is installed.
+"""
+
+import hashlib
+import os
+import re
+import sys
+
+from vip import core
+from vip import requirements
+
+
+LOCK_EXTENSION = "lock"
+
+HASH_ALGORITHM = "sha256"
+
+# Options of requirements files, which are needed to install a lockfile
+LOCKED_OPTIONS = ("-i", "--index-url", "--extra-index-url", "-f",
+                  "--find-links", "--trusted-host", "--no-index")
+
+# Arguments of pip installing a lockfile
+INSTALL_ARGUMENTS = ["--no-deps", "--require-hashes"]
+
+_fingerprint_re = re.compile(r"^# Requirements fingerprint: ([0-9a-f]+)$",
+                             re.MULTILINE)
+
+_sdist_re = re.compile(r"^(?P<name>.+)-(?P<version>[^-]+?)"
+                       r"\.(?:tar\.gz|tar\.bz2|tar\.xz|tgz|zip)$")
+
+
+def get_lockfile_name(prefix=None, version=None):
+    """ Returns a name of the lockfile for a prefix and an interpreter
+    version, like `devel-requirements-27.lock`.
+    """
+    version = sys.version_info[:2] if version is None else version
+    return list(core.get_requirements_filenames(
+        prefix, version[:2], extension=LOCK_EXTENSION))[-1]
+
+
+def find_lockfile(directory, prefix=None, version=None):
+    """ Returns a path to the most specific existing lockfile for a prefix and
+    an interpreter version, or None when there is none.
+
+    A lockfile for a prefix covers also files without the prefix, so files
+    without it are used only when prefix is not given.
+    """
+    names = list(core.get_requirements_filenames(
+        prefix, version, extension=LOCK_EXTENSION))
+    if prefix:
+        names = [name for name in names if name.startswith(prefix + "-")]
+
+    for name in reversed(names):
+        filename = os.path.join(directory, name)
+        if os.path.isfile(filename):
+            return filename
+    return None
+
+
+def parse_artifact_filename(filename):
+    """ Splits a wheel or a source distribution filename into a normalized
+    project name and version.
+
+    Returns:
+        a (name, version) tuple, or None for other files
+    """
+    from vip import wheels
+
+    parsed = wheels.parse_wheel_filename(filename)
+    if parsed is not None:
+        return parsed
+
+    match = _sdist_re.match(os.path.basename(filename))
+    if match is None:
+        return None
+    return requirements.normalize_name(match.group("name")), \
+        match.group("version")
+
+
+def hash_file(filename, algorithm=HASH_ALGORITHM):
+    """ Returns `algorithm:digest` of a file, as accepted by `--hash`. """
+    digest = hashlib.new(algorithm)
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return "%s:%s" % (algorithm, digest.hexdigest())
+
+
+def format_lockfile(options, artifacts, sources=(), fingerprint=None):
+    """ Returns content of a lockfile.
+
+    Args:
+        options: a list of pip option lines to keep
+        artifacts: a list of paths of downloaded artifacts
+        sources: a list of requirements files it was generated from
+        fingerprint: str, a fingerprint of their install plan, see
+            `get_source_fingerprint`
+
+    Raises:
+        VipError: when an artifact cannot be recognized, or several versions
+            of a project were downloaded
+    """
+    projects = {}
+    for filename in artifacts:
+        parsed = parse_artifact_filename(filename)
+        if parsed is None:
+            raise core.VipError("cannot lock unknown artifact %s" %
+                                os.path.basename(filename))
+
+        name, version = parsed
+        pinned = projects.setdefault(name, (version, []))
+        if pinned[0] != version:
+            raise core.VipError("cannot lock %s: several versions (%s, %s)" %
+                                (name, pinned[0], version))
+        pinned[1].append(hash_file(filename))
+
+    lines = ["# Generated by vip --lock from %s, do not edit" % (
+        ", ".join(os.path.basename(s) for s in sources) or "no files")]
+    if fingerprint is not None:
+        lines.append("# Requirements fingerprint: %s" % fingerprint)
+    lines.extend(options)
+    for name in sorted(projects):
+        version, hashes = projects[name]
+        lines.append(" \\\n".join(
+            ["%s==%s" % (name, version)] +
+            ["    --hash=%s" % digest for digest in sorted(hashes)]))
+
+    return "".join("%s\n" % line for line in lines)
+
+
+def get_source_fingerprint(plan, version=None):
+    """ Returns a fingerprint of requirements files a lockfile is generated
+    from, for an interpreter version.
+    """
+    version = sys.version_info if version is None else version
+    return plan.fingerprint(tuple(version)[:2])
+
+
+def read_source_fingerprint(filename):
+    """ Returns the fingerprint recorded in a lockfile, or None when it has
+    none (e.g. it was generated by an older vip) or cannot be read.
+    """
+    try:
+        with open(filename) as f:
+            match = _fingerprint_re.search(f.read())
+    except (IOError, OSError):
+        return None
+    return match.group(1) if match else None
+
+
+def is_stale(filename, directory, prefix=None, version=None):
+    """ Tells whether requirements files for a prefix and an interpreter
+    version have changed since a lockfile was generated from them.
+    Lockfiles without a fingerprint are never stale.
+
+    Raises:
+        VipError: when requirements files cannot be read
+    """
+    recorded = read_source_fingerprint(filename)
+    if recorded is None:
+        return False
+
+    version = sys.version_info if version is None else version
+    plan = requirements.InstallPlan.from_files(
+        requirements.find_requirements_files(directory, prefix,
+                                             tuple(version)[:2]))
+    return recorded != get_source_fingerprint(plan, version)
+
+
+def warn_if_stale(filename, directory, prefix=None, version=None):
+    """ Logs a warning when a lockfile is stale, see `is_stale`. """
+    if is_stale(filename, directory, prefix, version):
+        core.logger.warning(
+            "%s is out of date with requirements files, run vip --lock%s "
+            "to update it" % (filename, " " + prefix if prefix else ""))
+
+
+def create_lockfile(vip_directory, directory=None, prefix=None):
+    """ Resolves all applicable requirements files with pip in a virtualenv
+    and writes a lockfile for its interpreter version next to them.
+
+    Args:
+        vip_directory: str, a path to virtualenv
+        directory: str, where requirements files are, by default the
+            directory containing vip_directory
+        prefix: str, a prefix of additional requirements files to lock
+
+    Returns:
+        A path to the lockfile
+
+    Raises:
+        VipError: when there is nothing to lock, requirements cannot be
+            locked, or pip fails
+    """
+    import shutil
+    import tempfile
+
+    if directory is None:
+        directory = core.get_project_directory(vip_directory)
+
+    version = core.get_virtualenv_python_version(vip_directory)
+    filenames = requirements.find_requirements_files(directory, prefix,
+                                                     version)
+    if not filenames:
+        raise core.VipError("no requirements files to lock in %s" %
+                            directory)
+
+    plan = requirements.InstallPlan.from_files(filenames)
+    if not plan.requirements:
+        raise core.VipError("no requirements to lock in %s" %
+                            ", ".join(filenames))
+
+    for requirement in plan.requirements:
+        if not isinstance(requirement, requirements.Requirement) and \
+                requirement.split()[0] in requirements.EDITABLE_OPTIONS:
+            raise core.VipError("cannot lock editable requirement: %s" %
+                                requirement)
+
+    options = [line for line in plan.options
+               if re.split(r"[\s=]", line, 1)[0] in LOCKED_OPTIONS]
+
+    temp_directory = tempfile.mkdtemp(dir=vip_directory)
+    try:
+        plan_filename = os.path.join(temp_directory, "lock-plan.txt")
+        artifacts = os.path.join(temp_directory, "artifacts")
+        core.atomic_write(plan_filename, str(plan))
+
+        code = core.execute_virtualenv_command(
+            vip_directory, "pip",
+            ["download", "--dest", artifacts, "-r", plan_filename])
+        if code:
+            raise core.VipError("resolving requirements failed with exit "
+                                "code %s" % code)
+
+        content = format_lockfile(
+            options, [os.path.join(artifacts, name)
+                      for name in sorted(os.listdir(artifacts))], filenames,
+            get_source_fingerprint(plan, version))
+    finally:
+        shutil.rmtree(temp_directory)
+
+    lockfile = os.path.join(directory, get_lockfile_name(prefix, version))
+    core.atomic_write(lockfile, content)
+    return lockfile
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Advisory file locks shared between processes.
+
+Processes running `vip --init` in the same project at once (e.g. parallel CI
+jobs in a shared workspace) take a lock on a file next to `.vip` (see
+`core.create_virtualenv`), so only one of them builds the virtualenv and the
+others wait for it and reuse it.
+
+Locks are held by `fcntl.flock` on POSIX systems and `msvcrt.locking` on
+Windows, so they are released by the operating system when the process
+holding them dies. Shared locks, held by many processes at once, exist only
+on POSIX systems, they are exclusive on Windows. Lock files are never
+removed: a process could be waiting on a file, which another one has just
+removed and recreated.
+"""
+
+import os
+import time
+
+from vip import core
+
+
+# How long to wait for a lock, can be overridden with VIP_LOCK_TIMEOUT
+DEFAULT_TIMEOUT = 600
+
+POLL_INTERVAL = 0.1
+
+
+def get_timeout(environ=None):
+    """ Returns seconds to wait for a lock, `VIP_LOCK_TIMEOUT` environment
+    variable or `DEFAULT_TIMEOUT`.
+
+    Raises:
+        VipError: when the variable is not a number
+    """
+    environ = os.environ if environ is None else environ
+    value = environ.get("VIP_LOCK_TIMEOUT")
+    if not value:
+        return DEFAULT_TIMEOUT
+    try:
+        return float(value)
+    except ValueError:
+        raise core.VipError("invalid VIP_LOCK_TIMEOUT: %s" % value)
+
+
+def _try_lock(fd, shared=False):
+    """ Locks an open file without waiting, tells whether it succeeded. """
+    if core.is_win:
+        import msvcrt
+
+        try:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except (IOError, OSError):
+            return False
+        return True
+
+    import errno
+    import fcntl
+
+    try:
+        fcntl.flock(fd, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) |
+                    fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return False
+        raise
+    return True
+
+
+def _unlock(fd):
+    if core.is_win:
+        import msvcrt
+
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+class FileLock(object):
+    """ A lock on a file, used as a context manager.
+
+    Args:
+        filename: str, a path to the lock file, created when missing
+        timeout: float, seconds to wait for the lock, see `get_timeout`
+        shared: bool, whether other processes can hold a shared lock on the
+            file at the same time
+    """
+
+    def __init__(self, filename, timeout=None, shared=False):
+        self.filename = filename
+        self.timeout = get_timeout() if timeout is None else timeout
+        self.shared = shared
+        self.waited = False
+        self._fd = None
+
+    def acquire(self):
+        """ Waits until the lock is held by this process.
+
+        Raises:
+            VipError: when the lock is not released in time
+        """
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o666)
+        deadline = time.time() + self.timeout
+        try:
+            while not _try_lock(fd, self.shared):
+                if time.time() >= deadline:
+                    raise core.VipError(
+                        "timed out after %g seconds waiting for %s held by "
+                        "another process" % (self.timeout, self.filename))
+                if not self.waited:
+                    core.logger.info("Waiting for another vip process "
+                                     "holding %s" % self.filename)
+                    self.waited = True
+                time.sleep(POLL_INTERVAL)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def release(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            _unlock(fd)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
@@ -1,26 +1,56 @@
 # -*- coding: utf-8 -*-
 
-import argparse
-import contextlib
+# Keep imports of this module light, `vip command ...` dispatch is
+# performance critical. See TestStartupBudget in test_main.py.
 import sys
 
 import vip
 from vip import core
+from vip import discovery
+from vip import trace
 
 
-@contextlib.contextmanager
-def protect_from_VipError():
-    try:
-        yield
-    except core.VipError as e:
-        core.logger.exception("fatal: " + str(e))
+class protect_from_VipError(object):
+    """ Reports VipError raised in the block as a fatal error, and exits with
+    status 1. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and issubclass(exc_type, core.VipError):
+            core.logger.exception("fatal: " + str(exc_value))
+            sys.exit(1)
+
 
+def create_argument_parser(argv=None):
+    import argparse
+
+    from vip import shell
 
-def create_argument_parser():
     usage = """
   %(prog)s command ...
-  %(prog)s --init [directory]
+  %(prog)s [--python X.Y] command ...
+  %(prog)s --init [directory] [--python X.Y[,X.Y ...]]
+  %(prog)s --install [prefix]
+  %(prog)s --sync [prefix]
+  %(prog)s --watch [prefix]
+  %(prog)s --update
+  %(prog)s --lock [prefix]
+  %(prog)s --compile [levels]
+  %(prog)s --snapshot file
+  %(prog)s --restore file
+  %(prog)s --check [prefix] [--json]
+  %(prog)s --batch file
+  %(prog)s --batch -- command ... [-- command ...]
+  %(prog)s --each [root] -- command ...
   %(prog)s --locate [directory]
+  %(prog)s --cache {stats,prune}
+  %(prog)s --dedupe [root ...]
+  %(prog)s --shell-hook {bash,zsh}
+  %(prog)s --serve [--preload modules]
+
+Any of them can be preceded by --trace[=file] [--trace-format=chrome]
 """
 
     parser = argparse.ArgumentParser(description=vip.__doc__, usage=usage)
@@ -37,28 +67,411 @@ def create_argument_parser():
                         help='initializes a brand new virtualenv in '
                         'given directory, using "." by default')
 
+    parser.add_argument('--python', metavar="X.Y[,X.Y ...]",
+                        help='with --init, creates a virtualenv for every '
+                        'interpreter version concurrently, the first one '
+                        'being the default, otherwise selects a virtualenv '
+                        'created this way, VIP_PYTHON environment variable '
+                        'by default')
+
+    parser.add_argument('--from-template', action='store_true',
+                        help='with --init, clones the virtualenv from a '
+                        'cached template with requirements already '
+                        'installed, instead of creating it from scratch')
+
+    parser.add_argument('--install', metavar="prefix", nargs="?",
+                        const=True,
+                        help='installs packages from all requirements files '
+                        'for the current interpreter, including prefixed '
+                        'ones like "devel-requirements.txt" when prefix is '
+                        'given')
+
+    parser.add_argument('--lock', metavar="prefix", nargs="?", const=True,
+                        help='resolves requirements files once and writes '
+                        'exact versions with artifact hashes to a lockfile '
+                        'like "requirements-27.lock", which is installed '
+                        'instead of them when present')
+
+    parser.add_argument('--compile', metavar="levels", nargs="?",
+                        const="0",
+                        help='compiles bytecode of site-packages by several '
+                        'processes at once, for a comma separated list of '
+                        'optimization levels, 0 by default, which --init, '
+                        '--install and --sync also do when VIP_COMPILE '
+                        'environment variable lists them')
+
+    parser.add_argument('--snapshot', metavar="file",
+                        help='packs the virtualenv into a tar archive, which '
+                        'can be restored in another directory, "-" for '
+                        'standard output')
+
+    parser.add_argument('--restore', metavar="file",
+                        help='restores a snapshot into .vip in the current '
+                        'directory, "-" for standard input')
+
+    parser.add_argument('--sync', metavar="prefix", nargs="?", const=True,
+                        help='like --install, but also uninstalls packages '
+                        'removed from requirements files since the last '
+                        'install')
+
+    parser.add_argument('--watch', metavar="prefix", nargs="?", const=True,
+                        help='watches requirements files and syncs the '
+                        'virtualenv in the background whenever they change, '
+                        'like --sync does')
+
+    parser.add_argument('-u', '--update', action='store_true',
+                        help='updates requirements.txt to match installed '
+                        'packages, which is done automatically after '
+                        '"pip install", "pip uninstall" and "easy_install"')
+
+    parser.add_argument('--check', metavar="prefix", nargs="?", const=True,
+                        help='checks whether installed packages satisfy '
+                        'requirements files, like --install would use them')
+
+    parser.add_argument('--json', action='store_true',
+                        help='with --check, prints the report as JSON')
+
+    parser.add_argument('--wheel-cache', action='store_true', default=None,
+                        help='build and install wheels through the cache '
+                        'shared by all environments, it is also enabled by '
+                        'VIP_WHEEL_CACHE environment variable')
+
+    parser.add_argument('--cache', choices=['stats', 'prune'],
+                        help='shows statistics or prunes the wheel cache')
+
+    parser.add_argument('--batch', metavar="file", nargs="?", const=True,
+                        help='runs commands listed in a file, one per line '
+                        '("-" for standard input), or given after "--" and '
+                        'separated by "--", concurrently in the same '
+                        'virtualenv')
+
+    parser.add_argument('--each', metavar="root", nargs="?", const=".",
+                        help='runs command in every virtualenv found below '
+                        'root directory, using "." by default')
+
+    parser.add_argument('--dedupe', metavar="root", nargs="*",
+                        help='replaces files duplicated in virtualenvs found '
+                        'below roots with reflinks or hard links, using "." '
+                        'by default')
+
+    parser.add_argument('-j', '--jobs', metavar="N", type=int,
+                        help='with --batch or --each, runs at most N '
+                        'commands at once, a number of CPUs by default, with '
+                        '--init --python creates at most N virtualenvs at '
+                        'once, with --dedupe hashes N files at once, with '
+                        '--compile runs N compiling processes at once')
+
+    parser.add_argument('-k', '--keep-going', action='store_true',
+                        help='with --batch or --each, does not stop starting '
+                        'commands after one of them failed')
+
     parser.add_argument('-l', '--locate', metavar="directory",
                         nargs="?", const=".",
                         help='shows where the .vip directory is')
 
+    parser.add_argument('--no-exec', dest='use_exec', action='store_false',
+                        default=core.EXEC_BY_DEFAULT,
+                        help='run command as a child process instead of '
+                        'replacing vip with it')
+
+    parser.add_argument('--tee', action='store_true',
+                        help='copies output of command to a rotating log '
+                        'file in .vip/logs directory')
+
+    parser.add_argument('--timestamps', action='store_true',
+                        help='with --tee, prefixes lines of output with '
+                        'time')
+
+    parser.add_argument('--serve', action='store_true',
+                        help='runs a server with interpreter of the '
+                        'virtualenv, which forks processes for "vip python '
+                        '..." commands with modules already imported')
+
+    parser.add_argument('--preload', metavar="modules",
+                        help='with --serve, a comma separated list of modules '
+                        'to import, VIP_PRELOAD environment variable by '
+                        'default')
+
+    parser.add_argument('-r', '--refresh', action='store_true',
+                        help='bypass the discovery cache and refresh its '
+                        'entry for the current directory')
+
+    parser.add_argument('--shell-hook', choices=shell.SHELLS,
+                        help='prints shell code, which activates the nearest '
+                        '.vip directory whenever working directory changes')
+
+    parser.add_argument('--trace', metavar="file", nargs="?", const=True,
+                        help='writes how long phases of vip took, as JSON '
+                        'to a file or to standard error, it is also '
+                        'enabled by VIP_TRACE environment variable')
+
+    parser.add_argument('--trace-format', choices=trace.FORMATS,
+                        help='with --trace, writes a JSON record or a Chrome '
+                        'trace-event file')
+
     parser.add_argument('-v', '--verbose', action='store_true',
                         help='verbose error messages')
 
     parser.add_argument('-V', '--version', action='store_true',
                         help='prints version and exits')
 
-    return parser, parser.parse_args()
+    return parser, parser.parse_args(argv)
+
+
+def find_virtualenv(refresh=False, python=None):
+    """ Finds the nearest .vip directory and a virtualenv in it for an
+    interpreter version, see `core.select_virtualenv` """
+    directory = discovery.find_vip_directory(refresh=refresh)
+    return core.select_virtualenv(directory, python)
+
+
+def run_command(command, arguments, use_exec=core.EXEC_BY_DEFAULT,
+                refresh=False, tee=False, timestamps=False, python=None):
+    """ Runs a command from the nearest .vip directory and exits """
+    directory = find_virtualenv(refresh, python)
+
+    if command == "python" and not tee:
+        code = request_zygote(directory, arguments)
+        if code is not None:
+            sys.exit(code)
+
+    # vip has to outlive commands, after which requirements are updated
+    update = (core.is_package_command(command, arguments) and
+              core.is_auto_update_enabled())
+
+    if tee:
+        from vip import stream
+        code = stream.tee_virtualenv_command(directory, command, arguments,
+                                             timestamps=timestamps)
+    elif use_exec and not update:
+        core.exec_virtualenv_command(directory, command, arguments)
+    else:
+        code = core.execute_virtualenv_command(directory, command, arguments,
+                                               interactive=update)
+
+    if update and code == 0:
+        filename = core.update_requirements_file(directory, create=False)
+        if filename is not None:
+            core.logger.info("Updated %s" % filename)
+
+    sys.exit(code)
+
+
+def request_zygote(directory, arguments):
+    """ Runs python from directory through the zygote server, if it is
+    running there.
+
+    Returns:
+        exit code, or None when there is no server to run the command
+    """
+    import os
+
+    # zygote imports nothing but os and sys until a server is found
+    from vip import zygote
+
+    socket_path = zygote.get_socket_path(directory)
+    if not os.path.exists(socket_path) or \
+            not zygote.can_serve("python", arguments):
+        return None
+
+    try:
+        return zygote.request(socket_path, arguments,
+                              core.get_virtualenv_environ(directory),
+                              os.getcwd())
+    except zygote.ZygoteError as e:
+        raise core.VipError(str(e))
+
+
+def serve(preload=None, refresh=False, python=None):
+    """ Replaces vip with the zygote server for the nearest .vip directory
+    """
+    import os
+
+    from vip import zygote
+
+    if core.is_win:
+        raise core.VipError("zygote server is not supported on Windows")
+
+    directory = find_virtualenv(refresh, python)
+    if preload is None:
+        preload = os.environ.get("VIP_PRELOAD", "")
+
+    script = os.path.splitext(os.path.abspath(zygote.__file__))[0] + ".py"
+    core.exec_virtualenv_command(directory, "python", [
+        script, "--socket", zygote.get_socket_path(directory),
+        "--preload", preload])
+
+
+def check_requirements(prefix, as_json=False, refresh=False, python=None):
+    """ Reports differences between installed packages and requirements
+    files and exits with 1 when requirements are not satisfied """
+    directory = find_virtualenv(refresh, python)
+    report = core.check_requirements(directory, prefix=prefix)
+
+    if as_json:
+        import json
+        sys.stdout.write(json.dumps(report, indent=2, sort_keys=True) + "\n")
+    else:
+        for requirement in report["missing"]:
+            sys.stdout.write("missing: %s\n" % requirement)
+        for requirement, version in report["mismatched"]:
+            sys.stdout.write("mismatched: %s (installed %s)\n" % (
+                requirement, version))
+        for name, version in report["extra"]:
+            sys.stdout.write("extra: %s==%s\n" % (name, version))
+        for requirement in report["unchecked"]:
+            sys.stdout.write("unchecked: %s\n" % requirement)
+
+        if report["satisfied"]:
+            core.logger.info("Requirements are satisfied")
+
+    sys.exit(0 if report["satisfied"] else 1)
+
+
+def run_batch(batch_file, arguments, jobs=None, keep_going=False,
+              refresh=False, python=None):
+    """ Runs a batch of commands from the nearest .vip directory and exits """
+    from vip import batch
+
+    if batch_file is True:
+        commands = batch.split_commands(arguments)
+    else:
+        commands = batch.read_batch_file(batch_file)
+
+    if not commands:
+        raise core.VipError("no commands to run")
+
+    directory = find_virtualenv(refresh, python)
+    sys.exit(batch.run_batch(directory, commands, jobs=jobs,
+                             keep_going=keep_going))
+
+
+def run_each(root, command, arguments, jobs=None, keep_going=False,
+             python=None):
+    """ Runs a command in every virtualenv below root and exits """
+    from vip import batch
+
+    if not command:
+        raise core.VipError("no command to run")
+
+    directories = [core.select_virtualenv(directory, python) for directory
+                   in core.find_virtualenv_directories(root)]
+    if not directories:
+        raise core.VipError("no virtualenvs found below %s" % root)
+
+    core.logger.info("Found %d virtualenvs" % len(directories))
+    sys.exit(batch.run_each(directories, [command] + arguments, jobs=jobs,
+                            keep_going=keep_going))
+
+
+def show_wheel_cache(action):
+    from vip import wheels
+
+    wheelhouse = wheels.Wheelhouse()
+    if action == "prune":
+        removed = wheelhouse.prune()
+        core.logger.info("Removed %d wheels" % len(removed))
+
+    stats = wheelhouse.stats()
+    sys.stdout.write("%s\n" % stats["directory"])
+    for tag, (count, size) in sorted(stats["tags"].items()):
+        sys.stdout.write("  %s: %d wheels, %.1f MB\n" % (
+            tag, count, size / 1048576.0))
+    sys.stdout.write("total: %d wheels, %.1f MB of %.1f MB\n" % (
+        stats["count"], stats["size"] / 1048576.0,
+        stats["max_size"] / 1048576.0))
+
+
+def dedupe_virtualenvs(roots, jobs=None):
+    from vip import dedupe
+
+    report = dedupe.dedupe(roots, jobs=jobs)
+    methods = ", ".join("%d %s" % (count, method) for method, count in
+                        sorted(report["methods"].items()))
+    sys.stdout.write("%d virtualenvs, %d files scanned, %d hashed\n" % (
+        report["virtualenvs"], report["scanned"], report["hashed"]))
+    sys.stdout.write("%d files linked (%s), %.1f MB reclaimed\n" % (
+        report["linked"], methods or "none", report["reclaimed"] / 1048576.0))
+
+
+def split_trace_options(argv):
+    """ Removes --trace[=file] and --trace-format=format options given
+    before a command, or before `--`, from argv.
+
+    Returns:
+        a tuple with remaining arguments and a dict of found options
+    """
+    options = {}
+    remaining = []
+    for i, arg in enumerate(argv):
+        if arg == "--" or not arg.startswith("-"):
+            return remaining + argv[i:], options
+
+        if arg == "--trace":
+            options["trace"] = True
+        elif arg.startswith("--trace="):
+            options["trace"] = arg[len("--trace="):]
+        elif arg.startswith("--trace-format="):
+            options["format"] = arg[len("--trace-format="):]
+        else:
+            remaining.append(arg)
+
+    return remaining, options
+
+
+def enable_tracing(filename=None, format=None):
+    try:
+        trace.enable(None if filename is True else filename, format)
+    except ValueError as e:
+        raise core.VipError(str(e))
 
 
 def main():
-    parser, args = create_argument_parser()
+    argv, options = split_trace_options(sys.argv[1:])
 
-    commands = ["init", "locate", "command"]
+    with protect_from_VipError():
+        if "trace" in options:
+            enable_tracing(options["trace"], options.get("format"))
+        else:
+            trace.enable_from_environment()
+
+    try:
+        dispatch(argv)
+    finally:
+        trace.flush()
+
+
+def dispatch(argv):
+    # `vip command ...` is dispatched without building the parser
+    if argv and not argv[0].startswith("-"):
+        with protect_from_VipError():
+            run_command(argv[0], argv[1:])
+        return
+
+    with trace.span("parse arguments"):
+        parser, args = create_argument_parser(argv)
+
+    commands = ["init", "install", "sync", "watch", "update", "lock",
+                "compile", "snapshot", "restore", "check", "batch", "each",
+                "cache", "dedupe", "locate", "shell_hook", "serve",
+                "command"]
+
+    # Commands given to --batch or --each as arguments are not a separate
+    # command
+    if args.batch or args.each:
+        commands.remove("command")
+
+    if args.dedupe == []:
+        args.dedupe = ["."]
 
     # Configure logger using --verbose option
     core.logger.verbose = bool(args.verbose)
 
     with protect_from_VipError():
+        if args.trace and not trace.is_enabled():
+            enable_tracing(args.trace, args.trace_format)
+        if args.verbose:
+            trace.enable_reporting(core.logger.timing)
 
         if args.version:
             sys.stdout.write("%s\n" % vip.VERSION)
@@ -69,19 +482,120 @@ def main():
         if sum(used_commands) > 1:
             parser.print_help()
 
+        elif args.init and args.python:
+            from vip import interpreters
+
+            if args.from_template:
+                raise core.VipError("--from-template cannot be used with "
+                                    "--python")
+            directories = interpreters.create_environments(
+                args.init, interpreters.parse_versions(args.python),
+                jobs=args.jobs, wheel_cache=args.wheel_cache)
+            for directory in directories:
+                core.logger.info("Initialized virtualenv in %s" % directory)
+
         elif args.init:
-            directory = core.create_virtualenv(args.init)
+            directory = core.create_virtualenv(
+                args.init, wheel_cache=args.wheel_cache,
+                from_template=args.from_template)
             core.logger.info("Initialized virtualenv in %s" % directory)
 
+        elif args.install or args.sync:
+            prefix = args.install or args.sync
+            prefix = None if prefix is True else prefix
+            directory = find_virtualenv(args.refresh, args.python)
+            with core.lock_virtualenv(directory):
+                filenames = core.install_requirements_files(
+                    directory, prefix=prefix, wheel_cache=args.wheel_cache,
+                    uninstall=bool(args.sync))
+            if not filenames:
+                core.logger.warning("No requirements files found")
+
+        elif args.watch:
+            from vip import watch
+
+            prefix = None if args.watch is True else args.watch
+            directory = find_virtualenv(args.refresh, args.python)
+            watch.watch(directory, prefix=prefix,
+                        wheel_cache=args.wheel_cache)
+
+        elif args.lock:
+            from vip import lockfile
+
+            prefix = None if args.lock is True else args.lock
+            directory = find_virtualenv(args.refresh, args.python)
+            filename = lockfile.create_lockfile(directory, prefix=prefix)
+            core.logger.info("Locked requirements in %s" % filename)
+
+        elif args.compile:
+            from vip import bytecode
+
+            levels = bytecode.parse_levels(args.compile)
+            directory = find_virtualenv(args.refresh, args.python)
+            bytecode.compile_virtualenv(directory, levels, jobs=args.jobs)
+
+        elif args.snapshot:
+            from vip import snapshot
+
+            directory = find_virtualenv(args.refresh, args.python)
+            snapshot.create_snapshot(directory, args.snapshot)
+            core.logger.info("Saved snapshot of %s" % directory)
+
+        elif args.restore:
+            from vip import snapshot
+
+            directory = snapshot.restore_snapshot(args.restore)
+            core.logger.info("Restored virtualenv in %s" % directory)
+
+        elif args.update:
+            directory = find_virtualenv(args.refresh, args.python)
+            filename = core.update_requirements_file(directory)
+            core.logger.info("Updated %s" % filename)
+
+        elif args.check:
+            prefix = None if args.check is True else args.check
+            check_requirements(prefix, as_json=args.json,
+                               refresh=args.refresh, python=args.python)
+
+        elif args.batch:
+            if args.batch is not True and args.command:
+                raise core.VipError(
+                    "--batch takes either a file or commands after \"--\", "
+                    "like: vip --batch -- %s ..." % args.batch)
+            arguments = []
+            if args.command:
+                arguments = [args.command] + args.arguments
+            run_batch(args.batch, arguments, jobs=args.jobs,
+                      keep_going=args.keep_going, refresh=args.refresh,
+                      python=args.python)
+
+        elif args.each:
+            run_each(args.each, args.command, args.arguments, jobs=args.jobs,
+                     keep_going=args.keep_going, python=args.python)
+
+        elif args.cache:
+            show_wheel_cache(args.cache)
+
+        elif args.dedupe:
+            dedupe_virtualenvs(args.dedupe, jobs=args.jobs)
+
+        elif args.shell_hook:
+            from vip import shell
+            sys.stdout.write(shell.get_shell_hook(args.shell_hook))
+
+        elif args.serve:
+            serve(args.preload, refresh=args.refresh, python=args.python)
+
         elif args.locate:
-            sys.stdout.write(core.find_vip_directory(args.locate) + "\n")
+            directory = discovery.find_vip_directory(args.locate,
+                                                     refresh=args.refresh)
+            sys.stdout.write(directory + "\n")
 
         elif args.command:
-            directory = core.find_vip_directory()
-            return_code = core.execute_virtualenv_command(
-                directory, args.command, args.arguments)
-
-            sys.exit(return_code)
+            run_command(args.command, args.arguments,
+                        use_exec=args.use_exec, refresh=args.refresh,
+                        tee=args.tee, timestamps=args.timestamps,
+                        python=args.python)
         else:
             parser.print_help()
 
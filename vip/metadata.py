@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reading metadata of distributions installed in a virtualenv.
+
+Installed projects are found by `*.dist-info` and `*.egg-info` entries in
+site-packages, and their names and versions are read from metadata headers,
+so that no interpreter from the virtualenv has to be started, like it would
+be for `pip freeze`.
+
+Names and versions are also kept in an index file in the virtualenv, which
+stays valid as long as site-packages directory has not changed: installing,
+upgrading or removing a project adds or removes a metadata entry there, and
+so changes its modification time.
+"""
+
+import json
+import os
+
+from vip import core
+from vip import requirements
+
+
+# A file in virtualenv directory with the index of installed projects
+INDEX_FILENAME = "installed-index.json"
+
+METADATA_SUFFIXES = {
+    ".dist-info": "METADATA",
+    ".egg-info": "PKG-INFO",
+}
+
+# Projects left out from requirements files, like `pip freeze` does
+IGNORED_PROJECTS = ("pip", "setuptools", "wheel", "distribute")
+
+
+class Distribution(object):
+    """ A project installed in site-packages. """
+
+    def __init__(self, name, version, location):
+        self.name = name
+        self.version = version
+        self.location = location
+
+    @property
+    def key(self):
+        return requirements.normalize_name(self.name)
+
+    def __str__(self):
+        return "%s==%s" % (self.name, self.version)
+
+    def __repr__(self):
+        return "<Distribution %s>" % self
+
+
+def read_headers(filename):
+    """ Returns a dict with headers of a metadata file, up to the first
+    empty line. Only the first occurrence of a header is kept.
+    """
+    headers = {}
+    with open(filename, "rb") as f:
+        for line in f:
+            line = line.decode("utf-8", "replace").rstrip("\r\n")
+            if not line:
+                break
+            if line[0] in " \t" or ":" not in line:
+                continue
+            name, value = line.split(":", 1)
+            headers.setdefault(name.strip().lower(), value.strip())
+    return headers
+
+
+def _split_entry_name(entry):
+    """ Guesses name and version from `name-version[-pyX.Y].dist-info`. """
+    parts = os.path.splitext(entry)[0].split("-")
+    if len(parts) < 2:
+        return parts[0], None
+    return parts[0], parts[1]
+
+
+def read_distribution(location):
+    """ Reads a `*.dist-info` or `*.egg-info` entry.
+
+    Returns:
+        a Distribution, or None when location is not a metadata entry
+    """
+    entry = os.path.basename(location)
+    suffix = os.path.splitext(entry)[1]
+    if suffix not in METADATA_SUFFIXES:
+        return None
+
+    # An egg-info may be a single PKG-INFO file
+    filename = location
+    if os.path.isdir(location):
+        filename = os.path.join(location, METADATA_SUFFIXES[suffix])
+
+    name, version = _split_entry_name(entry)
+    try:
+        headers = read_headers(filename)
+        name = headers.get("name", name)
+        version = headers.get("version", version)
+    except (IOError, OSError) as e:
+        core.logger.debug("cannot read %s: %s" % (filename, e))
+
+    if not name or not version:
+        return None
+
+    return Distribution(name, version, location)
+
+
+def iter_distributions(site_packages):
+    """ Yields distributions installed in site_packages directory. """
+    try:
+        entries = sorted(os.listdir(site_packages))
+    except OSError:
+        return
+
+    for entry in entries:
+        distribution = read_distribution(os.path.join(site_packages, entry))
+        if distribution is not None:
+            yield distribution
+
+
+def get_installed_distributions(vip_directory):
+    """ Returns a dict of distributions installed in a virtualenv, keyed by
+    normalized project names.
+    """
+    site_packages = core.get_site_packages(vip_directory)
+    distributions = {}
+    for distribution in iter_distributions(site_packages):
+        distributions.setdefault(distribution.key, distribution)
+    return distributions
+
+
+def get_local_projects(vip_directory):
+    """ Returns a dict mapping real paths of projects installed from local
+    directories or archives (like `-e .`) into a virtualenv to their
+    normalized names, read from `direct_url.json` files of dist-info entries
+    and from `.egg-link` files of `setup.py develop`.
+    """
+    site_packages = core.get_site_packages(vip_directory)
+    try:
+        entries = sorted(os.listdir(site_packages))
+    except OSError:
+        return {}
+
+    projects = {}
+    for entry in entries:
+        location = os.path.join(site_packages, entry)
+        try:
+            if entry.endswith(".egg-link"):
+                with open(location) as f:
+                    line = "-e %s" % f.readline().strip()
+                name = entry[:-len(".egg-link")]
+            elif entry.endswith(".dist-info"):
+                with open(os.path.join(location, "direct_url.json")) as f:
+                    line = json.load(f)["url"]
+                distribution = read_distribution(location)
+                if distribution is None:
+                    continue
+                name = distribution.name
+            else:
+                continue
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            continue
+
+        path = requirements.get_local_path(line, site_packages)
+        if path is not None:
+            projects[path] = requirements.normalize_name(name)
+    return projects
+
+
+def _stamp(directory):
+    st = os.stat(directory)
+    return "%d:%r" % (st.st_ino, st.st_mtime)
+
+
+def get_installed_index(vip_directory, refresh=False):
+    """ Returns a dict mapping normalized names of projects installed in a
+    virtualenv to (name, version) pairs, using the index file when it is
+    up to date.
+
+    Args:
+        vip_directory: str, a path to virtualenv
+        refresh: bool, whether to rebuild the index regardless of its state
+    """
+    site_packages = core.get_site_packages(vip_directory)
+    filename = os.path.join(vip_directory, INDEX_FILENAME)
+
+    try:
+        stamp = _stamp(site_packages)
+    except OSError:
+        return {}
+
+    if not refresh:
+        try:
+            with open(filename) as f:
+                index = json.load(f)
+            if index["stamp"] == stamp and \
+                    index["site_packages"] == site_packages:
+                return dict((key, tuple(value)) for key, value in
+                            index["distributions"].items())
+        except (IOError, OSError, ValueError, KeyError, TypeError,
+                AttributeError):
+            pass
+
+    distributions = dict(
+        (key, (distribution.name, distribution.version))
+        for key, distribution in
+        get_installed_distributions(vip_directory).items())
+
+    index = {
+        "site_packages": site_packages,
+        "stamp": stamp,
+        "distributions": distributions,
+    }
+    try:
+        core.atomic_write(filename, json.dumps(index, indent=2,
+                                               sort_keys=True) + "\n")
+    except (IOError, OSError) as e:
+        core.logger.debug("cannot write %s: %s" % (filename, e))
+
+    return distributions
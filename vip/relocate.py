@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+Moving virtualenvs between directories.
+
+Virtualenvs embed their absolute location in a few places: shebang lines of
+scripts, activation scripts, `.pth` and `.egg-link` files, and lists of
+installed files. This module finds such files and rewrites them, so that a
+virtualenv copied to a new place keeps working.
+"""
+
+import os
+import stat
+
+from vip import core
+
+
+# Larger files are not expected to contain paths that need rewriting
+MAX_FILE_SIZE = 1024 * 1024
+
+RECORD_FILES = ((".dist-info", "RECORD"), (".egg-info", "installed-files.txt"))
+
+
+def _get_bin_directory(vip_directory):
+    return os.path.join(vip_directory, "Scripts" if core.is_win else "bin")
+
+
+def iter_candidates(vip_directory):
+    """ Yields paths of files, which may contain the virtualenv location,
+    relative to vip_directory.
+    """
+    bin_directory = _get_bin_directory(vip_directory)
+    if os.path.isdir(bin_directory):
+        for name in sorted(os.listdir(bin_directory)):
+            filename = os.path.join(bin_directory, name)
+            if not os.path.islink(filename) and os.path.isfile(filename):
+                yield os.path.relpath(filename, vip_directory)
+
+    if os.path.isfile(os.path.join(vip_directory, "pyvenv.cfg")):
+        yield "pyvenv.cfg"
+
+    site_packages = core.get_site_packages(vip_directory)
+    if os.path.isdir(site_packages):
+        for name in sorted(os.listdir(site_packages)):
+            if name.endswith((".pth", ".egg-link")):
+                yield os.path.relpath(os.path.join(site_packages, name),
+                                      vip_directory)
+
+            # Lists of installed files, which may hold absolute paths
+            for suffix, listing in RECORD_FILES:
+                filename = os.path.join(site_packages, name, listing)
+                if name.endswith(suffix) and os.path.isfile(filename):
+                    yield os.path.relpath(filename, vip_directory)
+
+
+def _read(filename):
+    if os.path.getsize(filename) > MAX_FILE_SIZE:
+        return None
+
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+def find_files_to_relocate(vip_directory, old_path=None):
+    """ Lists files that refer to old_path, the current location of a
+    virtualenv by default.
+
+    Returns:
+        a list of paths relative to vip_directory
+    """
+    old_path = os.path.abspath(vip_directory if old_path is None
+                               else old_path)
+    needle = old_path.encode("utf-8")
+
+    found = []
+    for name in iter_candidates(vip_directory):
+        content = _read(os.path.join(vip_directory, name))
+        if content is not None and needle in content:
+            found.append(name)
+    return found
+
+
+def rewrite_file(source, target, old_path, new_path):
+    """ Writes content of source file to target, replacing old_path with
+    new_path. Permissions are preserved and target is replaced atomically.
+    """
+    with open(source, "rb") as f:
+        content = f.read()
+
+    content = content.replace(old_path.encode("utf-8"),
+                              new_path.encode("utf-8"))
+
+    temp = "%s.%d.tmp" % (target, os.getpid())
+    with open(temp, "wb") as f:
+        f.write(content)
+    os.chmod(temp, stat.S_IMODE(os.stat(source).st_mode))
+
+    if core.is_win and os.path.exists(target):
+        os.remove(target)
+    os.rename(temp, target)
+
+
+def is_link_below(link, path):
+    """ Tells whether a symbolic link points to path or below it. """
+    destination = os.readlink(link)
+    return destination == path or destination.startswith(path + os.sep)
+
+
+def relocate_link(link, old_path, new_path):
+    """ Points an absolute symbolic link below old_path to new_path. """
+    if is_link_below(link, old_path):
+        destination = os.readlink(link)
+        os.remove(link)
+        os.symlink(new_path + destination[len(old_path):], link)
+
+
+def relocate(vip_directory, old_path, new_path=None, files=None):
+    """ Replaces references to old_path in a virtualenv with new_path.
+
+    Args:
+        vip_directory: str, the current location of virtualenv
+        old_path: str, where the virtualenv was created
+        new_path: str, where the virtualenv is going to be used,
+            vip_directory by default
+        files: a list of relative paths to rewrite, found with
+            `find_files_to_relocate` by default
+
+    Returns:
+        a list of rewritten files
+    """
+    vip_directory = os.path.abspath(vip_directory)
+    new_path = vip_directory if new_path is None else new_path
+    if files is None:
+        files = find_files_to_relocate(vip_directory, old_path)
+
+    for name in files:
+        filename = os.path.join(vip_directory, name)
+        rewrite_file(filename, filename, old_path, new_path)
+
+    for root, dirs, names in os.walk(vip_directory):
+        for name in dirs + names:
+            filename = os.path.join(root, name)
+            if os.path.islink(filename):
+                relocate_link(filename, old_path, new_path)
+
+    return files
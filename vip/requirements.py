@@ -0,0 +1,568 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parsing and merging of layered requirements files.
+
+A project may keep its requirements in several files, as produced by
+`core.get_requirements_filenames`. Instead of running pip once per file,
+all of them are merged into a single install plan, where every project is
+listed once, so that pip resolves dependencies only once.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from vip import core
+
+
+# A file in virtualenv directory, which describes what has been installed
+INSTALLED_FILENAME = "installed-requirements.json"
+
+
+# Options that may appear in a requirements file, mapped to a flag whether
+# they take a value
+PIP_OPTIONS = {
+    "-i": True,
+    "--index-url": True,
+    "--extra-index-url": True,
+    "-f": True,
+    "--find-links": True,
+    "--trusted-host": True,
+    "-c": True,
+    "--constraint": True,
+    "--no-index": False,
+    "--pre": False,
+    "--prefer-binary": False,
+    "--require-hashes": False,
+}
+
+INCLUDE_OPTIONS = ("-r", "--requirement")
+EDITABLE_OPTIONS = ("-e", "--editable")
+
+_requirement_re = re.compile(
+    r"^(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*"
+    r"(?:\[(?P<extras>[^\]]*)\])?\s*"
+    r"(?P<specs>[^;]*?)\s*"
+    r"(?:;\s*(?P<marker>.*?))?\s*$")
+
+_pin_re = re.compile(r"^===?\s*(.+)$")
+
+_hash_re = re.compile(r"\s*--hash[=\s]\s*(\S+)")
+
+
+def normalize_name(name):
+    """ Normalizes a project name, so that different spellings compare equal.
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def get_project_name(requirement):
+    """ Returns a normalized project name of an install plan entry, or None
+    when it cannot be determined.
+    """
+    if isinstance(requirement, Requirement):
+        return normalize_name(requirement.name)
+
+    match = re.search(r"[#&]egg=([A-Za-z0-9._-]+)", requirement)
+    return normalize_name(match.group(1)) if match else None
+
+
+def get_local_path(line, directory):
+    """ Returns a real path of a project directory or an archive an entry
+    refers to, like `-e .`, `./package` or a `file:` URL, or None for other
+    entries. Relative paths are relative to directory.
+    """
+    option, value = _split_option(line)
+    if option in EDITABLE_OPTIONS:
+        line = value
+    elif option is not None:
+        return None
+
+    line = line.split("#", 1)[0].strip()
+    if line.startswith("file:"):
+        line = _file_url_to_path(line)
+    elif not line or "://" in line or \
+            not (line.startswith(".") or "/" in line or "\\" in line):
+        return None
+
+    return os.path.normcase(os.path.realpath(
+        os.path.join(directory, os.path.expanduser(line))))
+
+
+def _file_url_to_path(url):
+    try:
+        from urllib.parse import unquote, urlparse
+    except ImportError:  # Python 2
+        from urllib import unquote
+        from urlparse import urlparse
+
+    path = unquote(urlparse(url).path)
+    if core.is_win and re.match(r"^/[A-Za-z]:", path):
+        path = path[1:]
+    return path
+
+
+def find_requirements_files(directory, prefix=None, version=None):
+    """ Lists existing requirements files in a directory.
+
+    Args:
+        directory: str, where to look for files
+        prefix: str, see `core.get_requirements_filenames`
+        version: an iterable, see `core.get_requirements_filenames`
+
+    Returns:
+        a list of paths, from the most general to the most specific one
+    """
+    candidates = (os.path.join(directory, name) for name in
+                  core.get_requirements_filenames(prefix, version))
+    return [name for name in candidates if os.path.isfile(name)]
+
+
+def find_prefixes(directory, extension="txt"):
+    """ Returns sorted prefixes of layers in a directory, like "devel" for
+    `devel-requirements.txt` or `devel-requirements-27.txt`.
+    """
+    pattern = re.compile(r"^(.+)-requirements(?:-\d+)?\.%s$" %
+                         re.escape(extension))
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(set(match.group(1) for match in map(pattern.match, names)
+                      if match))
+
+
+def _split_option(line):
+    for option in sorted(PIP_OPTIONS, key=len, reverse=True) + \
+            list(INCLUDE_OPTIONS + EDITABLE_OPTIONS):
+        if line == option:
+            return option, ""
+        if line.startswith(option) and option.startswith("--") and \
+                line[len(option)] == "=":
+            return option, line[len(option) + 1:].strip()
+        if line.startswith(option) and line[len(option)] in " \t":
+            return option, line[len(option):].strip()
+    return None, line
+
+
+def iter_requirement_lines(filename, _seen=None):
+    """ Yields (filename, line) pairs with meaningful lines of a requirements
+    file, following `-r` includes.
+
+    Comments and blank lines are skipped and continued lines are joined.
+
+    Raises:
+        VipError: when the file cannot be read
+    """
+    filename = os.path.abspath(filename)
+    seen = set() if _seen is None else _seen
+    if filename in seen:
+        return
+    seen.add(filename)
+
+    try:
+        with open(filename) as f:
+            content = f.read()
+    except (IOError, OSError) as e:
+        raise core.VipError("cannot read %s: %s" % (filename, e))
+
+    content = re.sub(r"\\\r?\n", " ", content)
+
+    for line in content.splitlines():
+        line = re.sub(r"(^|\s)#.*$", "", line).strip()
+        if not line:
+            continue
+
+        option, value = _split_option(line)
+        if option in INCLUDE_OPTIONS:
+            include = os.path.join(os.path.dirname(filename), value)
+            for item in iter_requirement_lines(include, seen):
+                yield item
+        else:
+            yield filename, line
+
+
+class Requirement(object):
+    """ A single project requirement, possibly merged from several lines. """
+
+    def __init__(self, name, extras=(), specs=(), marker=None, source=None,
+                 hashes=()):
+        self.name = name
+        self.extras = list(extras)
+        self.specs = list(specs)
+        self.marker = marker
+        self.sources = [source] if source else []
+        self.hashes = list(hashes)
+
+    @classmethod
+    def parse(cls, line, source=None):
+        """ Parses a `name[extras] specs; marker` line, possibly followed by
+        `--hash=algorithm:digest` options.
+
+        Returns:
+            a Requirement, or None when line is not a named requirement (for
+            instance an URL or a local path)
+        """
+        hashes = _hash_re.findall(line)
+        line = _hash_re.sub("", line)
+
+        match = _requirement_re.match(line)
+        if match is None or "://" in line:
+            return None
+
+        extras = [e.strip() for e in (match.group("extras") or "").split(",")
+                  if e.strip()]
+        specs = [s.replace(" ", "") for s in match.group("specs").split(",")
+                 if s.strip()]
+        return cls(match.group("name"), extras, specs,
+                   match.group("marker") or None, source, hashes)
+
+    @property
+    def key(self):
+        return normalize_name(self.name), self.marker
+
+    @property
+    def pins(self):
+        return set(m.group(1) for m in map(_pin_re.match, self.specs) if m)
+
+    def merge(self, other):
+        """ Merges other requirement for the same project into this one.
+
+        Raises:
+            VipError: when requirements pin different versions
+        """
+        for extra in other.extras:
+            if extra not in self.extras:
+                self.extras.append(extra)
+
+        for spec in other.specs:
+            if spec not in self.specs:
+                self.specs.append(spec)
+
+        for digest in other.hashes:
+            if digest not in self.hashes:
+                self.hashes.append(digest)
+
+        self.sources.extend(other.sources)
+
+        if len(self.pins) > 1:
+            raise core.VipError(
+                "conflicting requirements for %s: %s (in %s)" % (
+                    self.name, ", ".join(sorted(self.pins)),
+                    ", ".join(self.sources)))
+
+    def __str__(self):
+        line = self.name
+        if self.extras:
+            line += "[%s]" % ",".join(self.extras)
+        line += ",".join(self.specs)
+        if self.marker:
+            line += "; %s" % self.marker
+        for digest in self.hashes:
+            line += " --hash=%s" % digest
+        return line
+
+
+class InstallPlan(object):
+    """ Deduplicated union of several requirements files. """
+
+    def __init__(self):
+        self.options = []
+        self.requirements = []
+        self._by_key = {}
+
+    @classmethod
+    def from_files(cls, filenames):
+        plan = cls()
+        for filename in filenames:
+            plan.add_file(filename)
+        return plan
+
+    def add_file(self, filename):
+        for source, line in iter_requirement_lines(filename):
+            self.add_line(line, source)
+
+    def add_line(self, line, source=None):
+        option, value = _split_option(line)
+
+        if option in ("-c", "--constraint") and source:
+            value = os.path.join(os.path.dirname(source), value)
+            line = "%s %s" % (option, value)
+
+        if option in PIP_OPTIONS:
+            if line not in self.options:
+                self.options.append(line)
+            return
+
+        requirement = None
+        if option is None:
+            requirement = Requirement.parse(line, source)
+
+        if requirement is None:
+            # Editables, URLs and paths are only deduplicated
+            key = " ".join(line.split())
+            if key not in self._by_key:
+                self._by_key[key] = line
+                self.requirements.append(line)
+            return
+
+        existing = self._by_key.get(requirement.key)
+        if existing is None:
+            self._by_key[requirement.key] = requirement
+            self.requirements.append(requirement)
+        else:
+            existing.merge(requirement)
+
+    def lines(self):
+        return self.options + [str(r) for r in self.requirements]
+
+    def is_local(self):
+        """ Tells whether the plan refers to files of a project, like
+        `-e .`, `./package`, `file:` URLs or constraints files, which a
+        fingerprint does not cover.
+        """
+        for line in self.options:
+            if _split_option(line)[0] in ("-c", "--constraint"):
+                return True
+
+        for requirement in self.requirements:
+            if isinstance(requirement, Requirement):
+                continue
+            option, value = _split_option(requirement)
+            value = value if option in EDITABLE_OPTIONS else requirement
+            if "://" not in value or value.startswith("file:"):
+                return True
+        return False
+
+    def fingerprint(self, version):
+        """ Returns a hash of the plan for an interpreter version. """
+        data = "python %s\n%s" % (".".join(map(str, version)), self)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def difference(self, installed):
+        """ Compares this plan with an already installed one.
+
+        Returns:
+            a tuple with a plan containing only new or changed requirements
+            and a list of names of projects that are no longer required
+        """
+        installed_lines = set(installed.lines())
+
+        added = InstallPlan()
+        for line in self.lines():
+            if line in self.options or line not in installed_lines:
+                added.add_line(line)
+
+        names = set(get_project_name(r) for r in self.requirements)
+        removed = []
+        for requirement in installed.requirements:
+            name = get_project_name(requirement)
+            if name is not None and name not in names and \
+                    name not in removed:
+                removed.append(name)
+
+        return added, removed
+
+    def __str__(self):
+        return "".join("%s\n" % line for line in self.lines())
+
+
+def _update_line(line, requirement, version):
+    """ Pins requirement on a line to version, keeping the trailing comment.
+    """
+    match = re.search(r"(^|\s+)#.*$", line)
+    comment = match.group(0) if match else ""
+    newline = line[len(line.rstrip("\r\n")):]
+
+    pinned = Requirement(requirement.name, requirement.extras,
+                         ["==%s" % version], requirement.marker)
+    return str(pinned) + comment.rstrip("\r\n") + newline
+
+
+def update_requirements_lines(lines, installed, known=(), local=None,
+                              directory="."):
+    """ Updates lines of a requirements file to match installed projects,
+    like `pip freeze` would, but keeping the order of entries, comments,
+    options and entries other than named requirements.
+
+    Args:
+        lines: a list of lines of the file
+        installed: a dict mapping normalized project names to (name,
+            version) pairs
+        known: names of projects, which are listed elsewhere (for instance in
+            other requirements files), so they are not added
+        local: a dict mapping paths of projects installed from local
+            directories to their names, see `metadata.get_local_projects`,
+            so entries like `-e .` are recognized
+        directory: str, what relative paths of entries are relative to
+
+    Returns:
+        a list of updated lines: requirements of installed projects are
+        pinned to installed versions, requirements of projects that are not
+        installed are removed (unless limited by an environment marker) and
+        other installed projects are appended
+    """
+    updated = []
+    seen = set()
+
+    for line in lines:
+        content = re.sub(r"(^|\s)#.*$", "", line).strip()
+        requirement = None
+        if content and not content.startswith("-") and \
+                not content.endswith("\\"):
+            requirement = Requirement.parse(content)
+
+        if requirement is None:
+            # Editables, URLs and paths are kept as they are, and projects
+            # they install are not added again
+            name = get_project_name(content) if content else None
+            if name is None and content and local:
+                name = local.get(get_local_path(content, directory))
+            if name is not None:
+                seen.add(name)
+            updated.append(line)
+            continue
+
+        name = normalize_name(requirement.name)
+        if name in installed:
+            updated.append(_update_line(line, requirement,
+                                        installed[name][1]))
+            seen.add(name)
+        elif requirement.marker:
+            updated.append(line)
+
+    if updated and not updated[-1].endswith("\n"):
+        updated[-1] += "\n"
+
+    for name in sorted(installed):
+        if name not in seen and name not in known:
+            updated.append("%s==%s\n" % installed[name])
+
+    return updated
+
+
+def matches_specs(version, specs):
+    """ Tells whether version satisfies all specs, like [">=1.0", "<2"].
+
+    The `packaging` library is used when available, otherwise
+    `pkg_resources` from setuptools.
+
+    Returns:
+        bool, or None when neither library is available
+
+    Raises:
+        VipError: when specs are invalid
+    """
+    if not specs:
+        return True
+
+    try:
+        try:
+            from packaging.specifiers import SpecifierSet
+        except ImportError:
+            try:
+                import pkg_resources
+            except ImportError:
+                core.logger.debug("neither packaging nor pkg_resources is "
+                                  "available, versions are not compared")
+                return None
+            requirement = pkg_resources.Requirement.parse(
+                "project" + ",".join(specs))
+            return version in requirement
+
+        specifiers = SpecifierSet(",".join(specs))
+        return specifiers.contains(version, prereleases=True)
+    except ValueError as e:
+        raise core.VipError("invalid version specifier %s: %s" % (
+            ",".join(specs), e))
+
+
+def check_requirements(plan, installed):
+    """ Compares an install plan with installed projects.
+
+    Requirements limited by environment markers are not checked, as markers
+    would have to be evaluated by the interpreter of the virtualenv.
+
+    Args:
+        plan: InstallPlan
+        installed: a dict mapping normalized project names to (name,
+            version) pairs
+
+    Returns:
+        a dict with lists of `missing` requirements, `mismatched`
+        (requirement, installed version) pairs, `extra` installed (name,
+        version) pairs, which are not required, `unchecked` requirements
+        and a `satisfied` flag
+    """
+    report = {"missing": [], "mismatched": [], "extra": [], "unchecked": []}
+    required = set()
+
+    for requirement in plan.requirements:
+        name = get_project_name(requirement)
+        required.add(name)
+
+        if name is None or getattr(requirement, "marker", None):
+            report["unchecked"].append(str(requirement))
+            continue
+
+        if name not in installed:
+            report["missing"].append(str(requirement))
+            continue
+        if not isinstance(requirement, Requirement):
+            continue
+
+        matches = matches_specs(installed[name][1], requirement.specs)
+        if matches is None:
+            report["unchecked"].append(str(requirement))
+        elif not matches:
+            report["mismatched"].append((str(requirement),
+                                         installed[name][1]))
+
+    for name in sorted(installed):
+        if name not in required:
+            report["extra"].append(installed[name])
+
+    report["satisfied"] = not (report["missing"] or report["mismatched"])
+    return report
+
+
+def load_installed(vip_directory):
+    """ Reads what has been installed into vip_directory by
+    `save_installed`.
+
+    Returns:
+        a dict with `fingerprint`, `python` version, installed `plan` and
+        `prefixes` of layers installed with it, or None when nothing is
+        known
+    """
+    try:
+        with open(os.path.join(vip_directory, INSTALLED_FILENAME)) as f:
+            state = json.load(f)
+
+        plan = InstallPlan()
+        for line in state["requirements"]:
+            plan.add_line(line)
+
+        return {"fingerprint": state["fingerprint"],
+                "python": tuple(state["python"]),
+                "plan": plan,
+                "prefixes": list(state.get("prefixes", []))}
+    except (IOError, OSError, ValueError, KeyError, TypeError,
+            core.VipError):
+        return None
+
+
+def save_installed(vip_directory, plan, version, prefixes=()):
+    """ Records that plan has been installed into vip_directory, with
+    requirements files of given prefixes.
+    """
+    state = {
+        "fingerprint": plan.fingerprint(version),
+        "prefixes": sorted(prefixes),
+        "python": list(version),
+        "requirements": plan.lines(),
+    }
+    core.atomic_write(os.path.join(vip_directory, INSTALLED_FILENAME),
+                      json.dumps(state, indent=2, sort_keys=True) + "\n")
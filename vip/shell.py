@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Shell integration, which activates the nearest virtualenv whenever the
+working directory changes.
+
+The search for a virtualenv is done by the shell itself, with the same rules
+as `core.find_vip_directory` (including `VIP_CEILING_DIRECTORIES`, given as
+absolute paths), and only when the directory has changed, so
+commands like `python` or `pip` are run directly from `.vip/bin`, without
+starting vip at all. In `.vip` with virtualenvs for several interpreters,
+the one for `VIP_PYTHON` or the default version is activated. Install it by
+adding to `~/.bashrc` or `~/.zshrc`:
+
+    eval "$(vip --shell-hook bash)"
+"""
+
+from vip import core
+
+
+SHELLS = ("bash", "zsh")
+
+# Common part of the hook, written in a subset understood by bash and zsh
+_HOOK = r'''
+_vip_hook() {
+    if [ "$PWD" = "$_VIP_LAST_PWD" ] && [ "$1" != "-f" ]; then
+        return
+    fi
+    _VIP_LAST_PWD="$PWD"
+
+    local _vip_dir="$PWD" _vip_name _vip_found=""
+    while [ -n "$_vip_dir" ] && [ "$_vip_dir" != "/" ]; do
+        for _vip_name in %(names)s; do
+            if [ -d "$_vip_dir/$_vip_name" ]; then
+                _vip_found="$_vip_dir/$_vip_name"
+                break 2
+            fi
+        done
+        _vip_dir="${_vip_dir%%/*}"
+        case ":$VIP_CEILING_DIRECTORIES:" in
+            *":$_vip_dir:"*) break ;;
+        esac
+    done
+
+    if [ -n "$_vip_found" ] && [ -f "$_vip_found/%(default)s" ]; then
+        local _vip_python="${VIP_PYTHON:-$(cat "$_vip_found/%(default)s")}"
+        _vip_found="$_vip_found/py${_vip_python//./}"
+    fi
+
+    if [ "$_vip_found" = "$_VIP_ACTIVE" ]; then
+        return
+    fi
+
+    if [ -n "$_VIP_ACTIVE" ]; then
+        PATH=":$PATH:"
+        PATH="${PATH//:"$_VIP_ACTIVE/bin":/:}"
+        PATH="${PATH#:}"
+        PATH="${PATH%%:}"
+        unset VIRTUAL_ENV
+    fi
+
+    if [ -n "$_vip_found" ]; then
+        PATH="$_vip_found/bin:$PATH"
+        export VIRTUAL_ENV="$_vip_found"
+    fi
+
+    _VIP_ACTIVE="$_vip_found"
+    %(rehash)s
+}
+'''
+
+_INSTALL = {
+    "bash": r'''
+case ";$PROMPT_COMMAND;" in
+    *";_vip_hook;"*) ;;
+    *) PROMPT_COMMAND="_vip_hook${PROMPT_COMMAND:+;$PROMPT_COMMAND}" ;;
+esac
+_vip_hook
+''',
+    "zsh": r'''
+autoload -Uz add-zsh-hook
+add-zsh-hook chpwd _vip_hook
+_vip_hook
+''',
+}
+
+_REHASH = {
+    "bash": "hash -r",
+    "zsh": "rehash",
+}
+
+
+def get_shell_hook(shell):
+    """ Returns shell code, which installs the hook.
+
+    Raises:
+        VipError: when shell is not supported
+    """
+    if shell not in SHELLS:
+        raise core.VipError("unsupported shell: %s (choose from %s)" % (
+            shell, ", ".join(SHELLS)))
+
+    hook = _HOOK % {
+        "names": " ".join(core.DEFAULT_VIRTUALENV_DIRS),
+        "default": core.DEFAULT_PYTHON_FILENAME,
+        "rehash": _REHASH[shell],
+    }
+    return hook.lstrip() + _INSTALL[shell]
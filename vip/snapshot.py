@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+"""
+Portable snapshots of virtualenvs.
+
+`vip --snapshot FILE` packs a virtualenv into a tar archive (compressed by
+its extension, `.tar.gz` by default), which starts with a manifest: where
+the virtualenv was, its interpreter version, files that refer to that
+location (see `vip.relocate`) and symbolic links pointing inside it.
+`vip --restore FILE` extracts the archive while reading it, into a
+temporary directory next to `.vip`, rewrites only files and links listed in
+the manifest, and renames the directory into place. "-" stands for standard
+output or input, so snapshots can be piped.
+
+Files describing the current state of `.vip` directory (a zygote socket,
+logs, an index of installed packages) are left out.
+"""
+
+import json
+import os
+import sys
+import tarfile
+
+from vip import core
+from vip import relocate
+
+
+MANIFEST_NAME = ".vip-snapshot.json"
+
+FORMAT_VERSION = 1
+
+# Entries of a virtualenv, which are not stored in snapshots
+EXCLUDED = ("zygote.sock", "logs", "installed-index.json")
+
+_COMPRESSION = (
+    (".tar.gz", "gz"),
+    (".tgz", "gz"),
+    (".tar.bz2", "bz2"),
+    (".tar.xz", "xz"),
+    (".tar", ""),
+)
+
+
+def get_compression(filename):
+    """ Returns compression of a snapshot by its extension, gzip when it
+    is not known.
+    """
+    for extension, compression in _COMPRESSION:
+        if filename.endswith(extension):
+            return compression
+    return "gz"
+
+
+def _iter_entries(vip_directory):
+    """ Yields paths of files, directories and links of a virtualenv,
+    relative to it, parents first.
+    """
+    for root, dirs, files in os.walk(vip_directory):
+        relative = os.path.relpath(root, vip_directory)
+        if relative == ".":
+            dirs[:] = [d for d in dirs if d not in EXCLUDED]
+            files = [f for f in files if f not in EXCLUDED]
+
+        for name in sorted(dirs) + sorted(files):
+            yield os.path.normpath(os.path.join(relative, name))
+
+        # Links to directories are stored as links
+        dirs[:] = sorted(d for d in dirs
+                         if not os.path.islink(os.path.join(root, d)))
+
+
+def create_manifest(vip_directory, entries):
+    vip_directory = os.path.abspath(vip_directory)
+    links = [name for name in entries
+             if os.path.islink(os.path.join(vip_directory, name)) and
+             relocate.is_link_below(os.path.join(vip_directory, name),
+                                    vip_directory)]
+    return {
+        "format": FORMAT_VERSION,
+        "path": vip_directory,
+        "python": list(core.get_virtualenv_python_version(vip_directory)),
+        "files": relocate.find_files_to_relocate(vip_directory),
+        "links": links,
+    }
+
+
+class _Unclosed(object):
+    """ Uses a standard stream as a context manager, without closing it. """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __enter__(self):
+        return self.stream
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stream.flush()
+        return False
+
+
+def _open(filename, mode):
+    """ Opens a file in binary mode, "-" stands for standard input or
+    output.
+    """
+    if filename == "-":
+        stream = sys.stdin if mode == "rb" else sys.stdout
+        return _Unclosed(getattr(stream, "buffer", stream))
+    return open(filename, mode)
+
+
+def create_snapshot(vip_directory, filename):
+    """ Writes a snapshot of a virtualenv to filename.
+
+    Returns:
+        the manifest
+
+    Raises:
+        VipError: when the snapshot cannot be written
+    """
+    import io
+
+    vip_directory = os.path.abspath(vip_directory)
+    entries = list(_iter_entries(vip_directory))
+    manifest = create_manifest(vip_directory, entries)
+    data = json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8")
+
+    mode = "w|%s" % get_compression(filename)
+    try:
+        with _open(filename, "wb") as output:
+            with tarfile.open(fileobj=output, mode=mode) as archive:
+                info = tarfile.TarInfo(MANIFEST_NAME)
+                info.size = len(data)
+                info.mode = 0o644
+                archive.addfile(info, io.BytesIO(data))
+
+                for name in entries:
+                    archive.add(os.path.join(vip_directory, name), name,
+                                recursive=False)
+    except (IOError, OSError, tarfile.TarError) as e:
+        raise core.VipError("cannot write snapshot %s: %s" % (filename, e))
+
+    return manifest
+
+
+def _read_manifest(archive, member, filename):
+    if member.name != MANIFEST_NAME:
+        raise core.VipError("%s is not a vip snapshot" % filename)
+
+    manifest = json.loads(archive.extractfile(member).read().decode("utf-8"))
+    if manifest.get("format") != FORMAT_VERSION:
+        raise core.VipError("unsupported snapshot format: %s" %
+                            manifest.get("format"))
+    return manifest
+
+
+def _check_member(member):
+    name = os.path.normpath(member.name)
+    if os.path.isabs(name) or name == ".." or \
+            name.startswith(".." + os.sep):
+        raise core.VipError("snapshot contains a file outside of the "
+                            "virtualenv: %s" % member.name)
+
+
+def _extract(archive, member, directory):
+    # Absolute links to the interpreter are expected in virtualenvs, which
+    # the "data" filter of newer Pythons refuses
+    if hasattr(tarfile, "tar_filter"):
+        archive.extract(member, directory, filter="tar")
+    else:
+        archive.extract(member, directory)
+
+
+def restore_snapshot(filename, directory="."):
+    """ Restores a snapshot into `.vip` in directory, which must not exist.
+
+    Returns:
+        a path to the restored virtualenv
+
+    Raises:
+        VipError: when the snapshot is invalid, or the virtualenv exists
+    """
+    import shutil
+
+    target = os.path.join(os.path.abspath(directory), core.VIP_DIRECTORY)
+    if os.path.lexists(target):
+        raise core.VipError("%s already exists" % target)
+
+    temp = "%s.%d.tmp" % (target, os.getpid())
+    try:
+        os.makedirs(temp)
+        manifest = None
+        with _open(filename, "rb") as source:
+            with tarfile.open(fileobj=source, mode="r|*") as archive:
+                for member in archive:
+                    if manifest is None:
+                        manifest = _read_manifest(archive, member, filename)
+                    else:
+                        _check_member(member)
+                        _extract(archive, member, temp)
+
+        if manifest is None:
+            raise core.VipError("%s is empty" % filename)
+
+        old_path = manifest["path"]
+        for name in manifest["files"]:
+            path = os.path.join(temp, name)
+            relocate.rewrite_file(path, path, old_path, target)
+        for name in manifest["links"]:
+            relocate.relocate_link(os.path.join(temp, name), old_path,
+                                   target)
+
+        os.rename(temp, target)
+    except (IOError, OSError, ValueError, KeyError, tarfile.TarError) as e:
+        raise core.VipError("cannot restore snapshot %s: %s" % (filename, e))
+    finally:
+        if os.path.exists(temp):
+            shutil.rmtree(temp)
+
+    python = os.path.join(target, "Scripts", "python.exe") if core.is_win \
+        else os.path.join(target, "bin", "python")
+    if not os.path.exists(python):
+        core.logger.warning("Interpreter of %s (Python %d.%d) is missing on "
+                            "this host" % ((target,) + tuple(
+                                manifest["python"])))
+
+    return target
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming output of commands run in a virtualenv.
+
+Standard output and error of a command are read concurrently, line by
+line, through a bounded queue, so the output is never kept in memory as a
+whole and a slow consumer throttles the command instead of buffering it.
+Lines can be consumed as an iterator or copied to the terminal and to a
+rotating log file inside `.vip` directory.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from vip import core
+
+
+LOG_DIRECTORY = "logs"
+
+# Maximal length of a line, longer lines are split
+MAX_LINE = 64 * 1024
+
+# Maximal number of lines waiting to be consumed
+MAX_QUEUED_LINES = 1024
+
+DEFAULT_LOG_SIZE = 10 * 1024 * 1024
+DEFAULT_LOG_BACKUPS = 3
+
+
+def _read_lines(name, pipe, lines, max_line):
+    """ Puts (name, line) pairs read from pipe into lines queue, followed by
+    (name, None) at the end of the stream.
+    """
+    fd = pipe.fileno()
+    pending = b""
+
+    try:
+        while True:
+            chunk = os.read(fd, max_line)
+            if not chunk:
+                break
+
+            pending += chunk
+            while True:
+                end = pending.find(b"\n")
+                if end < 0 and len(pending) < max_line:
+                    break
+                end = min(end + 1 if end >= 0 else max_line, max_line)
+                lines.put((name, pending[:end]))
+                pending = pending[end:]
+
+        if pending:
+            lines.put((name, pending))
+    finally:
+        pipe.close()
+        lines.put((name, None))
+
+
+class CommandStream(object):
+    """ Runs a command from a virtualenv and iterates over lines of its
+    output as (stream name, line) pairs, where stream name is either
+    'stdout' or 'stderr'.
+
+    Usage:
+
+        stream = CommandStream(vip_directory, "python", ["setup.py", "test"])
+        for name, line in stream:
+            ...
+        stream.returncode
+
+    Raises:
+        VipError: when command is not found or cannot be executed
+    """
+
+    def __init__(self, vip_directory, command, args, encoding="utf-8",
+                 max_line=MAX_LINE):
+        self.encoding = encoding
+        self.returncode = None
+
+        executable_path = core.find_virtualenv_executable(vip_directory,
+                                                          command)
+        try:
+            self._process = subprocess.Popen(
+                [executable_path] + list(args),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                env=core.get_virtualenv_environ(vip_directory))
+        except OSError as e:
+            raise core.VipError(
+                "cannot execute %s: %s" % (executable_path, e))
+
+        self._lines = queue.Queue(MAX_QUEUED_LINES)
+        self._readers = []
+        for name in ("stdout", "stderr"):
+            reader = threading.Thread(
+                target=_read_lines,
+                args=(name, getattr(self._process, name), self._lines,
+                      max_line))
+            reader.daemon = True
+            reader.start()
+            self._readers.append(reader)
+
+    def iter_bytes(self):
+        """ Yields (stream name, line) pairs with undecoded lines. """
+        running = len(self._readers)
+
+        try:
+            while running:
+                name, line = self._lines.get()
+                if line is None:
+                    running -= 1
+                else:
+                    yield name, line
+
+            self.returncode = self._process.wait()
+        finally:
+            self.close()
+
+    def __iter__(self):
+        for name, line in self.iter_bytes():
+            yield name, line.decode(self.encoding, "replace")
+
+    def close(self):
+        """ Terminates the command if it is still running. """
+        if self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+        self.returncode = self._process.returncode
+
+
+class RotatingLog(object):
+    """ A binary log file, rotated when it grows over max_bytes, keeping
+    backups number of older files as filename.1, filename.2, ...
+    """
+
+    def __init__(self, filename, max_bytes=DEFAULT_LOG_SIZE,
+                 backups=DEFAULT_LOG_BACKUPS):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._file = open(filename, "ab")
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        self._file.close()
+
+        for i in range(self.backups - 1, 0, -1):
+            older = "%s.%d" % (self.filename, i)
+            if os.path.exists(older):
+                newer = "%s.%d" % (self.filename, i + 1)
+                if os.path.exists(newer):
+                    os.remove(newer)
+                os.rename(older, newer)
+
+        if self.backups > 0:
+            backup = self.filename + ".1"
+            if os.path.exists(backup):
+                os.remove(backup)
+            os.rename(self.filename, backup)
+        else:
+            os.remove(self.filename)
+
+        self._file = open(self.filename, "ab")
+        self._size = 0
+
+    def write(self, data):
+        if self._size and self._size + len(data) > self.max_bytes:
+            self._rotate()
+        self._file.write(data)
+        self._size += len(data)
+
+    def close(self):
+        self._file.close()
+
+
+def _timestamp():
+    now = time.time()
+    return ("%s.%03d " % (time.strftime("%Y-%m-%dT%H:%M:%S",
+                                        time.localtime(now)),
+                          int(now * 1000) % 1000)).encode("ascii")
+
+
+def _binary(stream):
+    return getattr(stream, "buffer", stream)
+
+
+def get_log_filename(vip_directory, command):
+    return os.path.join(vip_directory, LOG_DIRECTORY,
+                        "%s.log" % os.path.basename(command))
+
+
+def tee_virtualenv_command(vip_directory, command, args, log=True,
+                           timestamps=False, stdout=None, stderr=None):
+    """ Executes a command from vip_directory, copying its output to the
+    terminal and to a rotating log file in `.vip/logs` directory.
+
+    Args:
+        vip_directory: str, a path to virtualenv
+        command: str, a name of executable in vip_directory/bin
+        args: a list of arguments
+        log: bool or str, whether to write the log file, or its path
+        timestamps: bool, whether to prefix lines with time they were read
+        stdout, stderr: where to copy output, sys.stdout and sys.stderr by
+            default
+
+    Returns:
+        exit code of the command
+
+    Raises:
+        VipError: when command is not found or cannot be executed
+    """
+    outputs = {
+        "stdout": _binary(sys.stdout if stdout is None else stdout),
+        "stderr": _binary(sys.stderr if stderr is None else stderr),
+    }
+
+    log_file = None
+    if log:
+        filename = log if log is not True else \
+            get_log_filename(vip_directory, command)
+        log_file = RotatingLog(filename)
+
+    stream = CommandStream(vip_directory, command, args)
+    try:
+        for name, line in stream.iter_bytes():
+            if timestamps:
+                line = _timestamp() + line
+
+            output = outputs[name]
+            output.write(line)
+            output.flush()
+
+            if log_file is not None:
+                log_file.write(line)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stream.close()
+        if log_file is not None:
+            log_file.close()
+
+    return stream.returncode
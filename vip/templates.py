@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+"""
+Creating virtualenvs from templates.
+
+Creating a virtualenv from scratch copies the interpreter, installs
+setuptools and pip, and optionally installs requirements, which takes a
+while. Instead, vip can keep ready-made virtualenvs in a per-user cache
+directory, one for every interpreter version and set of requirements, and
+create new ones by cloning files of a template, which is mostly a matter of
+creating links.
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+
+from vip import core
+from vip import lockfile
+from vip import relocate
+from vip import requirements
+
+
+TEMPLATES_DIRECTORY = "templates"
+
+
+class TemplateStore(object):
+    """ A directory with template virtualenvs. """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(core.get_cache_directory(),
+                                     TEMPLATES_DIRECTORY)
+        self.directory = directory
+
+    def get_path(self, plan=None, directory=None):
+        """ Returns a path of a template for the current interpreter, with
+        requirements from plan installed.
+
+        Plans referring to files of a project (see `InstallPlan.is_local`)
+        are the same text in every project, so templates with them are
+        specific to the project directory.
+        """
+        version = tuple(sys.version_info[:2])
+        name = "py%d%d" % version
+        if plan is not None and plan.requirements:
+            key = plan.fingerprint(version)
+            if plan.is_local() and directory is not None:
+                key = hashlib.sha256(("%s\n%s" % (
+                    key, os.path.abspath(directory))).encode("utf-8")
+                ).hexdigest()
+            name += "-" + key[:16]
+        return os.path.join(self.directory, name)
+
+    def ensure(self, plan=None, wheel_cache=None, locked=False,
+               directory=None):
+        """ Returns a path to a template, creating it when necessary.
+
+        A template is built in a temporary directory and renamed when it is
+        complete, so a template is never used half-built. Plan of a lockfile
+        is installed as locked, see `core.install_requirements_file`.
+        Directory is that of the project the plan comes from, see
+        `get_path`.
+        """
+        template = self.get_path(plan, directory)
+        if os.path.isdir(template):
+            return template
+
+        temp = "%s.%d.tmp" % (template, os.getpid())
+        if os.path.exists(temp):
+            shutil.rmtree(temp)
+
+        try:
+            if plan is not None and plan.requirements:
+                materialize(self.ensure(), temp)
+                _install_plan(temp, plan, wheel_cache, locked)
+            else:
+                import virtualenv
+
+                core.logger.info("Creating template %s" % template)
+                virtualenv.create_environment(temp)
+
+            relocate.relocate(temp, temp, template)
+            try:
+                os.rename(temp, template)
+            except OSError:
+                # Somebody else has created the template in the meantime
+                if not os.path.isdir(template):
+                    raise
+        finally:
+            if os.path.exists(temp):
+                shutil.rmtree(temp)
+
+        return template
+
+
+def _install_plan(vip_directory, plan, wheel_cache=None, locked=False):
+    plan_filename = os.path.join(vip_directory, "install-plan.txt")
+    core.atomic_write(plan_filename, str(plan))
+    try:
+        core.logger.info("Installing requirements into template")
+        core.install_requirements_file(vip_directory, plan_filename,
+                                       wheel_cache, locked)
+    finally:
+        os.remove(plan_filename)
+
+    requirements.save_installed(
+        vip_directory, plan, core.get_virtualenv_python_version(vip_directory))
+
+
+def materialize(template, target, link="auto"):
+    """ Creates a virtualenv in target by cloning a template.
+
+    Files that refer to the template location, or that may be modified in
+    place later (scripts, `.pth` files), are copied and fixed. Other files
+    are cloned with `core.clone_file`.
+
+    Args:
+        template: str, a path to template virtualenv
+        target: str, a path to a new virtualenv, which must not exist
+        link: str, a method passed to `core.clone_file`
+
+    Returns:
+        a dict mapping methods used to numbers of files
+    """
+    template = os.path.abspath(template)
+    target = os.path.abspath(target)
+    copied = set(relocate.iter_candidates(template))
+    methods = {}
+
+    for root, dirs, files in os.walk(template):
+        relative = os.path.relpath(root, template)
+        directory = os.path.normpath(os.path.join(target, relative))
+        os.makedirs(directory)
+
+        for name in dirs + files:
+            source = os.path.join(root, name)
+            if os.path.islink(source):
+                destination = os.readlink(source)
+                if destination == template or \
+                        destination.startswith(template + os.sep):
+                    destination = target + destination[len(template):]
+                os.symlink(destination, os.path.join(directory, name))
+                methods["symlink"] = methods.get("symlink", 0) + 1
+
+        # Links to directories are not followed by os.walk
+        dirs[:] = [d for d in dirs
+                   if not os.path.islink(os.path.join(root, d))]
+
+        for name in files:
+            source = os.path.join(root, name)
+            if os.path.islink(source):
+                continue
+
+            destination = os.path.join(directory, name)
+            if os.path.normpath(os.path.join(relative, name)) in copied:
+                relocate.rewrite_file(source, destination, template, target)
+                method = "copy"
+            else:
+                method = core.clone_file(source, destination, link)
+            methods[method] = methods.get(method, 0) + 1
+
+    return methods
+
+
+def create_from_template(vip_directory, directory=None, wheel_cache=None,
+                         link="auto", store=None):
+    """ Creates a virtualenv from a template with requirements of a project
+    already installed.
+
+    Args:
+        vip_directory: str, where to create the virtualenv
+        directory: str, where requirements files or a lockfile are, when
+            None the template without requirements is used
+        wheel_cache: bool, see `core.install_requirements_files`
+        link: str, a method passed to `core.clone_file`
+        store: a TemplateStore, the default one when not given
+
+    Returns:
+        a path to the template that has been used
+    """
+    store = TemplateStore() if store is None else store
+
+    plan = None
+    locked = None
+    if directory is not None:
+        locked = lockfile.find_lockfile(directory)
+        if locked is not None:
+            lockfile.warn_if_stale(locked, directory)
+        plan = requirements.InstallPlan.from_files(
+            [locked] if locked is not None else
+            requirements.find_requirements_files(directory))
+
+    template = store.ensure(plan, wheel_cache, locked is not None, directory)
+    core.logger.info("Creating virtualenv from template %s" % template)
+    materialize(template, vip_directory, link)
+    return template
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import io
+import os
+import shutil
+import tempfile
+
+from os import path
+
+from .test_helper import unittest
+
+from vip import batch
+from vip import core
+
+
+SCRIPT = """#!/bin/sh
+echo "$@"
+exit $1
+"""
+
+
+class TestBatchParsing(unittest.TestCase):
+
+    def test_should_split_commands(self):
+        self.assertEqual([["flake8", "."], ["py.test", "-x"]],
+                         batch.split_commands(["flake8", ".", "--", "--",
+                                               "py.test", "-x", "--"]))
+
+    def test_should_skip_comments_and_empty_lines(self):
+        lines = ["# linters\n", "flake8 'src dir'\n", "\n", "  py.test -x\n"]
+
+        self.assertEqual([["flake8", "src dir"], ["py.test", "-x"]],
+                         batch.parse_batch_file(lines))
+
+    def test_should_raise_VipError_when_file_is_missing(self):
+        with self.assertRaisesRegexp(core.VipError, "cannot read"):
+            batch.read_batch_file(path.join("missing", "batch.txt"))
+
+
+@unittest.skipIf(core.is_win, "POSIX-specific test")
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.vip_dir = path.join(self.root, ".vip")
+        os.makedirs(path.join(self.vip_dir, "bin"))
+
+        command = path.join(self.vip_dir, "bin", "command")
+        with open(command, "w") as f:
+            f.write(SCRIPT)
+        os.chmod(command, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def run_batch(self, commands, **kwargs):
+        output = io.BytesIO()
+        code = batch.run_batch(self.vip_dir, commands, output=output,
+                               **kwargs)
+        return code, output.getvalue().decode()
+
+    def test_should_group_output_of_commands(self):
+        commands = [["command", "0", str(i)] for i in range(8)]
+
+        code, output = self.run_batch(commands, jobs=4)
+
+        self.assertEqual(0, code)
+        for i in range(8):
+            self.assertIn("==> command 0 %d\n0 %d\n<== command 0 %d: exit "
+                          "code 0\n" % (i, i, i), output)
+
+    def test_should_return_code_of_first_failed_command(self):
+        commands = [["command", "0"], ["command", "3"], ["command", "5"]]
+
+        code, output = self.run_batch(commands, jobs=1, keep_going=True)
+
+        self.assertEqual(3, code)
+        self.assertIn("exit code 5", output)
+
+    def test_should_stop_after_failure(self):
+        commands = [["command", "2"], ["command", "0"]]
+
+        code, output = self.run_batch(commands, jobs=1)
+
+        self.assertEqual(2, code)
+        self.assertNotIn("command 0", output)
+
+    def test_should_report_missing_commands(self):
+        code, output = self.run_batch([["missing"]])
+
+        self.assertEqual(batch.NOT_STARTED, code)
+        self.assertIn("not found", output)
+
+
+@unittest.skipIf(core.is_win, "POSIX-specific test")
+class TestEach(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.vip_dirs = []
+        for name in ["first", "second"]:
+            vip_dir = path.join(self.root, name, ".vip")
+            os.makedirs(path.join(vip_dir, "bin"))
+            command = path.join(vip_dir, "bin", "command")
+            with open(command, "w") as f:
+                f.write("#!/bin/sh\npwd\n")
+            os.chmod(command, 0o755)
+            self.vip_dirs.append(vip_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_should_run_command_in_each_project_directory(self):
+        output = io.BytesIO()
+
+        code = batch.run_each(self.vip_dirs, ["command"], output=output)
+
+        self.assertEqual(0, code)
+        lines = output.getvalue().decode().splitlines()
+        for vip_dir in self.vip_dirs:
+            self.assertIn(path.realpath(path.dirname(vip_dir)),
+                          [path.realpath(line) for line in lines])
+            self.assertRegexpMatches(output.getvalue().decode(),
+                                     r"\n0 +[\d.]+s  %s\n" % vip_dir)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import shutil
+import tempfile
+import zipfile
+
+from .test_helper import unittest
+
+from vip import bench
+
+
+class TestStatistics(unittest.TestCase):
+
+    def test_percentiles(self):
+        summary = bench.summarize([0.4, 0.1, 0.3, 0.2, 0.5])
+
+        self.assertEqual(5, summary["n"])
+        self.assertEqual(0.1, summary["min"])
+        self.assertAlmostEqual(0.3, summary["p50"])
+        self.assertAlmostEqual(0.46, summary["p90"])
+        self.assertEqual(0.5, summary["max"])
+
+    def test_should_report_regressions_over_threshold(self):
+        baseline = {"find": {"fast": {"p50": 1.0}, "slow": {"p50": 1.0}}}
+        results = {"find": {"fast": {"p50": 1.1}, "slow": {"p50": 1.3},
+                            "new": {"p50": 5.0}}}
+
+        self.assertEqual([("find", "slow", 1.0, 1.3)],
+                         bench.compare(results, baseline, threshold=0.2))
+
+
+class TestMakeWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_should_build_wheel_with_record(self):
+        wheel = bench.make_wheel(self.root)
+
+        with zipfile.ZipFile(wheel) as archive:
+            names = archive.namelist()
+            record = archive.read("vipbench-1.0.dist-info/RECORD").decode()
+
+        self.assertTrue(wheel.endswith("vipbench-1.0-py2.py3-none-any.whl"))
+        self.assertEqual(4, len(names))
+        self.assertEqual(sorted(names), sorted(
+            line.split(",")[0] for line in record.splitlines()))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+import tempfile
+
+from os import path
+
+from .test_helper import mox
+from .test_helper import unittest
+
+from vip import bytecode
+from vip import core
+
+
+class TestLevels(unittest.TestCase):
+
+    def test_parse_levels(self):
+        self.assertEqual([0], bytecode.parse_levels("0"))
+        self.assertEqual([2, 0], bytecode.parse_levels("2, 0,2"))
+
+    def test_should_raise_VipError_on_invalid_levels(self):
+        with self.assertRaisesRegexp(core.VipError, "invalid optimization"):
+            bytecode.parse_levels("0,3")
+        with self.assertRaisesRegexp(core.VipError, "no optimization"):
+            bytecode.parse_levels(",")
+
+    def test_get_levels(self):
+        self.assertEqual([], bytecode.get_levels({}))
+        self.assertEqual([0, 1], bytecode.get_levels({"VIP_COMPILE": "0,1"}))
+
+    def test_split_chunks(self):
+        self.assertEqual([["a", "c"], ["b"]],
+                         bytecode.split_chunks(["a", "b", "c"], 2))
+        self.assertEqual([["a"]], bytecode.split_chunks(["a"], 8))
+
+
+@unittest.skipIf(core.is_win or not hasattr(os, "symlink"),
+                 "requires a symbolic link to the interpreter")
+class TestCompileVirtualenv(unittest.TestCase):
+
+    def setUp(self):
+        self.mox = mox.Mox()
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.vip_dir = path.join(self.root, ".vip")
+        self.site_packages = path.join(
+            self.vip_dir, "lib", "python%d.%d" % sys.version_info[:2],
+            "site-packages")
+        os.makedirs(path.join(self.site_packages, "package"))
+        os.makedirs(path.join(self.vip_dir, "bin"))
+        os.symlink(sys.executable, path.join(self.vip_dir, "bin", "python"))
+
+        self.write("module.py", "VALUE = 1\n")
+        self.write(path.join("package", "__init__.py"), "")
+        self.write(path.join("package", "broken.py"), "def (\n")
+
+        self.mox.StubOutWithMock(core, "logger", use_mock_anything=True)
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        with open(path.join(self.site_packages, name), "w") as f:
+            f.write(content)
+
+    def list_bytecode(self, directory):
+        cache = path.join(self.site_packages, directory, "__pycache__")
+        return sorted(name.split(".", 1)[1] for name in os.listdir(cache))
+
+    @unittest.skipIf(sys.version_info < (3, 5), "requires .opt-1.pyc files")
+    def test_should_compile_every_level(self):
+        failed = bytecode.compile_virtualenv(self.vip_dir, [0, 1], jobs=2)
+
+        self.assertEqual([path.join(self.site_packages, "package",
+                                    "broken.py")], failed)
+        tag = sys.implementation.cache_tag
+        self.assertEqual(["%s.opt-1.pyc" % tag, "%s.pyc" % tag],
+                         self.list_bytecode(""))
+        self.assertEqual(["%s.opt-1.pyc" % tag, "%s.pyc" % tag],
+                         self.list_bytecode("package"))
+
+    def test_should_skip_fresh_bytecode(self):
+        bytecode.compile_virtualenv(self.vip_dir, [0])
+        cache = path.join(self.site_packages, "__pycache__")
+        compiled = path.join(cache, os.listdir(cache)[0])
+        os.utime(compiled, (0, 0))
+
+        bytecode.compile_virtualenv(self.vip_dir, [0])
+
+        self.assertEqual(0, os.stat(compiled).st_mtime)
+
+    def test_should_raise_VipError_without_site_packages(self):
+        shutil.rmtree(self.site_packages)
+
+        with self.assertRaisesRegexp(core.VipError, "cannot list"):
+            bytecode.compile_virtualenv(self.vip_dir, [0])
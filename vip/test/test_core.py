@@ -3,9 +3,11 @@
 from __future__ import absolute_import
 
 import os
+import shutil
 import signal
 import sys
 import subprocess
+import tempfile
 import virtualenv
 
 from os import path
@@ -60,6 +62,154 @@ class TestVipDirectoryFinder(unittest.TestCase):
             core.find_vip_directory(start=not_a_virtualenv)
 
 
+class TestCeilingDirectories(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.start = path.join(self.root, "project", "src", "module")
+        os.makedirs(self.start)
+        os.mkdir(path.join(self.root, "project", ".venv"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_should_return_found_directory(self):
+        self.assertEqual(path.join(self.root, "project", ".venv"),
+                         core.find_vip_directory(self.start, ceilings=[]))
+
+    def test_should_not_enter_ceiling_directories(self):
+        ceilings = [path.join(self.root, "project", "src")]
+
+        with self.assertRaisesRegexp(core.VipError, "not a virtualenv"):
+            core.find_vip_directory(self.start, ceilings=ceilings)
+
+        # A ceiling itself is probed when the search starts there
+        os.mkdir(path.join(self.start, ".vip"))
+        self.assertEqual(path.join(self.start, ".vip"),
+                         core.find_vip_directory(self.start,
+                                                 ceilings=[self.start]))
+
+    def test_should_stop_at_filesystem_boundary(self):
+        devices = {self.start: 1}
+        real_stat = os.stat
+
+        class Stat(object):
+            def __init__(self, st_dev):
+                self.st_dev = st_dev
+
+        def fake_stat(p):
+            real_stat(p)
+            return Stat(devices.get(p, 2))
+
+        os.stat = fake_stat
+        try:
+            with self.assertRaisesRegexp(core.VipError, "not a virtualenv"):
+                core.find_vip_directory(self.start, ceilings=[],
+                                        one_filesystem=True)
+        finally:
+            os.stat = real_stat
+
+    def test_should_read_environment(self):
+        environ = {"VIP_CEILING_DIRECTORIES": os.pathsep.join(["/a", "",
+                                                               "/b/c"]),
+                   "VIP_ONE_FILESYSTEM": "yes"}
+
+        self.assertEqual([path.abspath("/a"), path.abspath("/b/c")],
+                         core.get_ceiling_directories(environ))
+        self.assertTrue(core.is_one_filesystem(environ))
+        self.assertFalse(core.is_one_filesystem({}))
+
+
+class TestSelectVirtualenv(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.vip_dir = path.join(self.root, ".vip")
+        os.makedirs(path.join(self.vip_dir, "py27"))
+        os.makedirs(path.join(self.vip_dir, "py33"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write_default(self, version):
+        with open(path.join(self.vip_dir, core.DEFAULT_PYTHON_FILENAME),
+                  "w") as f:
+            f.write(version + "\n")
+
+    def test_should_return_single_virtualenv(self):
+        self.assertEqual(self.vip_dir, core.select_virtualenv(
+            self.vip_dir, environ={"VIP_PYTHON": "2.7"}))
+        self.assertEqual(self.root,
+                         core.get_project_directory(self.vip_dir))
+
+        with self.assertRaisesRegexp(core.VipError, "no virtualenv"):
+            core.select_virtualenv(self.vip_dir, "1.5")
+
+    def test_should_select_interpreter_virtualenv(self):
+        self.write_default("3.3")
+        py27 = path.join(self.vip_dir, "py27")
+
+        self.assertEqual(path.join(self.vip_dir, "py33"),
+                         core.select_virtualenv(self.vip_dir, environ={}))
+        self.assertEqual(py27, core.select_virtualenv(
+            self.vip_dir, environ={"VIP_PYTHON": "2.7"}))
+        self.assertEqual(py27, core.select_virtualenv(
+            self.vip_dir, "2.7", environ={"VIP_PYTHON": "3.3"}))
+        self.assertEqual(self.root, core.get_project_directory(py27))
+
+        with self.assertRaisesRegexp(core.VipError, "no virtualenv"):
+            core.select_virtualenv(self.vip_dir, "3.4")
+        with self.assertRaisesRegexp(core.VipError, "invalid Python"):
+            core.select_virtualenv(self.vip_dir, "3")
+
+
+class TestPackageCommands(unittest.TestCase):
+
+    def test_should_detect_commands_changing_packages(self):
+        for command, args in [("pip", ["install", "nose"]),
+                              ("pip3.4", ["-q", "uninstall", "nose"]),
+                              ("pip.exe", ["install", "-r", "r.txt"]),
+                              ("easy_install", ["nose"])]:
+            self.assertTrue(core.is_package_command(command, args))
+
+        for command, args in [("pip", ["freeze"]), ("pip", []),
+                              ("pipeline", ["install"]),
+                              ("python", ["-m", "pip", "install"])]:
+            self.assertFalse(core.is_package_command(command, args))
+
+    def test_auto_update_can_be_disabled(self):
+        self.assertTrue(core.is_auto_update_enabled({}))
+        self.assertFalse(core.is_auto_update_enabled(
+            {"VIP_AUTO_UPDATE": "0"}))
+
+
+class TestFindVirtualenvDirectories(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for directory in ["a/.vip/lib/nested/.vip", "a/b/.venv",
+                          "c/d/e/.vip", "c/d/e/.venv", ".git/f/.vip",
+                          "g/.vip-file"]:
+            os.makedirs(path.join(self.root, *directory.split("/")))
+        with open(path.join(self.root, "g", ".venv"), "w"):
+            pass
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_should_find_all_virtualenvs(self):
+        directories = core.find_virtualenv_directories(self.root)
+
+        self.assertEqual([path.join(self.root, "a", ".vip"),
+                          path.join(self.root, "a", "b", ".venv"),
+                          path.join(self.root, "c", "d", "e", ".vip")],
+                         directories)
+
+    def test_should_return_empty_list_when_nothing_is_found(self):
+        self.assertEqual([], core.find_virtualenv_directories(
+            path.join(self.root, "g")))
+
+
 @unittest.skipUnless(core.is_win, "Windows-specific test")
 class TestWindowsVipDirectoryFinder(TestVipDirectoryFinder):
 
@@ -97,9 +247,16 @@ class TestCommandExecution(unittest.TestCase):
         (subprocess
             .Popen([EndsWith(command), "-arg", "123"],
                    stdout=mox.IgnoreArg(), stderr=mox.IgnoreArg(),
-                   stdin=subprocess.PIPE)
+                   stdin=subprocess.PIPE, cwd=None,
+                   env=mox.Func(self.is_virtualenv_environ))
             .AndReturn(self.popen_mock))
 
+    def is_virtualenv_environ(self, environ):
+        vip_dir = path.abspath(self.vip_dir)
+        bin_dir = path.join(vip_dir, "Scripts" if core.is_win else "bin")
+        return environ["VIRTUAL_ENV"] == vip_dir and \
+            environ["PATH"].startswith(bin_dir)
+
     def tearDown(self):
         self.mox.ResetAll()
         self.mox.UnsetStubs()
@@ -155,6 +312,64 @@ class TestCommandExecution(unittest.TestCase):
         self.mox.VerifyAll()
 
 
+@unittest.skipIf(core.is_win, "POSIX-specific test")
+class TestCommandExec(unittest.TestCase):
+
+    def setUp(self):
+        self.mox = mox.Mox()
+        self.mox.StubOutWithMock(os, "execve")
+
+        dirname = path.normpath(path.dirname(__file__))
+        self.vip_dir = path.join(dirname, "fixtures", "test1", ".vip")
+        self.command = path.join(self.vip_dir, "bin", "command")
+
+    def tearDown(self):
+        self.mox.ResetAll()
+        self.mox.UnsetStubs()
+
+    def test_should_replace_process_with_command(self):
+        os.execve(self.command, [self.command, "-arg", "123"],
+                  mox.ContainsKeyValue("VIRTUAL_ENV", self.vip_dir))
+        self.mox.ReplayAll()
+
+        core.exec_virtualenv_command(self.vip_dir, "command",
+                                     ["-arg", "123"])
+
+        self.mox.VerifyAll()
+
+    def test_should_raise_VipError_when_exec_fails(self):
+        os.execve(self.command, [self.command], mox.IgnoreArg()).AndRaise(
+            OSError(8, "Exec format error"))
+        self.mox.ReplayAll()
+
+        with self.assertRaisesRegexp(core.VipError, "cannot execute"):
+            core.exec_virtualenv_command(self.vip_dir, "command", [])
+
+        self.mox.VerifyAll()
+
+    def test_should_raise_VipError_when_command_is_not_found(self):
+        self.mox.ReplayAll()
+
+        with self.assertRaisesRegexp(core.VipError, "not found"):
+            core.exec_virtualenv_command(self.vip_dir, "missing", [])
+
+
+class TestVirtualenvEnviron(unittest.TestCase):
+
+    def test_should_activate_virtualenv(self):
+        vip_dir = path.abspath(path.join("project", ".vip"))
+        bin_dir = path.join(vip_dir, "Scripts" if core.is_win else "bin")
+
+        environ = core.get_virtualenv_environ(
+            vip_dir, {"PATH": "/usr/bin", "PYTHONHOME": "/usr", "A": "1"})
+
+        self.assertEqual({
+            "PATH": bin_dir + path.pathsep + "/usr/bin",
+            "VIRTUAL_ENV": vip_dir,
+            "A": "1",
+        }, environ)
+
+
 @unittest.skipUnless(core.is_win, "Windows-specific test")
 class TestWindowsFindExecutable(unittest.TestCase):
 
@@ -205,13 +420,19 @@ class TestCreateVirtualenv(unittest.TestCase):
     def setUp(self):
         self.mox = mox.Mox()
 
+        # Installation leaves its fingerprint in .vip directory
+        self.root = tempfile.mkdtemp()
+        self.repo_dir = path.join(self.root, 'test1')
+        shutil.copytree(path.join(path.dirname(__file__), 'fixtures',
+                                  'test1'), self.repo_dir)
+
     def tearDown(self):
         self.mox.ResetAll()
         self.mox.UnsetStubs()
+        shutil.rmtree(self.root)
 
     def test_create_virtualenv(self):
-        repo_dir = path.normpath(path.join(path.dirname(__file__),
-                                 'fixtures', 'test1'))
+        repo_dir = self.repo_dir
         vip_dir = path.join(repo_dir, '.vip')
 
         self.mox.StubOutWithMock(virtualenv, 'create_environment')
@@ -230,6 +451,52 @@ class TestCreateVirtualenv(unittest.TestCase):
         self.mox.VerifyAll()
         self.assertEqual(vip_dir, dir_)
 
+    def test_should_build_virtualenv_in_temporary_directory(self):
+        project_dir = path.join(self.root, 'project')
+        vip_dir = path.join(project_dir, '.vip')
+        stale = vip_dir + '.1.tmp'
+        os.makedirs(stale)
+        installed_into = []
+
+        def create_environment(directory):
+            self.assertFalse(path.exists(vip_dir))
+            os.makedirs(path.join(directory, 'bin'))
+            with open(path.join(directory, 'bin', 'activate'), 'w') as f:
+                f.write('VIRTUAL_ENV="%s"\n' % directory)
+
+        def install_requirements_files(vip_directory, directory, **kwargs):
+            self.assertFalse(path.exists(vip_dir))
+            installed_into.append(vip_directory)
+
+        self.mox.StubOutWithMock(virtualenv, 'create_environment')
+        virtualenv.create_environment = create_environment
+        self.mox.StubOutWithMock(core, 'install_requirements_files')
+        core.install_requirements_files = install_requirements_files
+
+        self.assertEqual(vip_dir, core.create_virtualenv(project_dir))
+
+        self.assertEqual(1, len(installed_into))
+        self.assertNotEqual(vip_dir, installed_into[0])
+        with open(path.join(vip_dir, 'bin', 'activate')) as f:
+            self.assertEqual('VIRTUAL_ENV="%s"\n' % vip_dir, f.read())
+        self.assertEqual(['.vip', '.vip.lock'],
+                         sorted(os.listdir(project_dir)))
+
+    def test_should_remove_virtualenv_built_partially(self):
+        project_dir = path.join(self.root, 'project')
+
+        def create_environment(directory):
+            os.makedirs(path.join(directory, 'bin'))
+            raise OSError("disk full")
+
+        self.mox.StubOutWithMock(virtualenv, 'create_environment')
+        virtualenv.create_environment = create_environment
+
+        with self.assertRaisesRegexp(OSError, "disk full"):
+            core.create_virtualenv(project_dir, install_requirements=False)
+
+        self.assertEqual(['.vip.lock'], os.listdir(project_dir))
+
 
 class TestGetRequirementsFilenames(unittest.TestCase):
 
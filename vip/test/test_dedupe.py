@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from os import path
+
+from .test_helper import unittest
+
+from vip import core
+from vip import dedupe
+
+
+@unittest.skipIf(core.is_win, "requires hard links")
+class TestDeduplicator(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.index = path.join(self.root, "index.json")
+        self.deduplicator = dedupe.Deduplicator(self.index, min_size=4,
+                                                link="hardlink")
+
+        self.virtualenvs = []
+        for project in ("a", "b", "c"):
+            vip_dir = path.join(self.root, project, ".vip")
+            os.makedirs(path.join(vip_dir, "lib"))
+            self.virtualenvs.append(vip_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, vip_dir, name, content, mode=0o644):
+        filename = path.join(vip_dir, "lib", name)
+        with open(filename, "w") as f:
+            f.write(content)
+        os.chmod(filename, mode)
+        return filename
+
+    def test_should_link_duplicates(self):
+        a, b, c = self.virtualenvs
+        files = [self.write(vip_dir, "six.py", "import sys\n")
+                 for vip_dir in self.virtualenvs]
+        # Same size, other content
+        other = self.write(c, "other.py", "import os \n")
+        # Same content, other permissions
+        script = self.write(c, "script.py", "import sys\n", 0o755)
+        # Too small
+        self.write(a, "tiny.py", "x\n")
+        self.write(b, "tiny.py", "x\n")
+
+        report = self.deduplicator.run(self.virtualenvs)
+
+        self.assertEqual(2, report["linked"])
+        self.assertEqual(2 * len("import sys\n"), report["reclaimed"])
+        self.assertEqual({"hardlink": 2}, report["methods"])
+        self.assertEqual(1, len(set(os.stat(f).st_ino for f in files)))
+        self.assertEqual(1, os.stat(other).st_nlink)
+        self.assertEqual(1, os.stat(script).st_nlink)
+        self.assertEqual(1, os.stat(path.join(a, "lib", "tiny.py")).st_nlink)
+
+    def test_should_not_hash_indexed_files_again(self):
+        for vip_dir in self.virtualenvs[:2]:
+            self.write(vip_dir, "six.py", "import sys\n")
+
+        self.assertEqual(2, self.deduplicator.run(self.virtualenvs)["hashed"])
+
+        # Linked files are no longer candidates
+        report = self.deduplicator.run(self.virtualenvs)
+        self.assertEqual((0, 0), (report["hashed"], report["linked"]))
+
+        self.write(self.virtualenvs[2], "six.py", "import sys\n")
+        report = self.deduplicator.run(self.virtualenvs)
+        self.assertEqual((1, 1), (report["hashed"], report["linked"]))
+
+    def test_should_raise_VipError_without_virtualenvs(self):
+        empty = path.join(self.root, "empty")
+        os.mkdir(empty)
+
+        with self.assertRaisesRegexp(core.VipError, "no virtualenvs"):
+            dedupe.dedupe([empty])
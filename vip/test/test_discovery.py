@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from os import path
+
+from .test_helper import unittest
+
+from vip import core
+from vip import discovery
+
+
+class TestDiscoveryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.project = path.join(self.root, "project")
+        self.start = path.join(self.project, "a", "b")
+        os.makedirs(self.start)
+        os.mkdir(path.join(self.project, ".vip"))
+
+        self.cache = discovery.DiscoveryCache(path.join(self.root, "cache"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def find(self, start=None, **kwargs):
+        start = self.start if start is None else start
+        return discovery.find_vip_directory(start, cache=self.cache,
+                                            **kwargs)
+
+    def test_should_store_found_directory(self):
+        expected = path.join(self.project, ".vip")
+
+        self.assertEqual(expected, self.find())
+        self.assertEqual(expected, self.cache.lookup(self.start))
+
+        reloaded = discovery.DiscoveryCache(self.cache.filename)
+        self.assertEqual(expected, reloaded.lookup(self.start))
+
+    def test_should_invalidate_entry_when_directory_changes(self):
+        self.find()
+        os.mkdir(path.join(self.project, "a", ".vip"))
+        # Make sure the change is visible even on coarse mtime resolution
+        os.utime(path.join(self.project, "a"), (0, 0))
+
+        self.assertIsNone(self.cache.lookup(self.start))
+        self.assertEqual(path.join(self.project, "a", ".vip"), self.find())
+
+    def test_should_invalidate_entry_when_vip_is_removed(self):
+        self.find()
+        os.rmdir(path.join(self.project, ".vip"))
+
+        self.assertIsNone(self.cache.lookup(self.start))
+
+    def test_should_respect_ceiling_directories(self):
+        self.find()
+        ceilings = [path.join(self.project, "a")]
+
+        self.assertIsNone(self.cache.lookup(self.start, ceilings))
+        with self.assertRaisesRegexp(core.VipError, "not a virtualenv"):
+            self.find(ceilings=ceilings)
+
+        # The entry is still there for searches without the ceiling
+        self.assertEqual(path.join(self.project, ".vip"),
+                         self.cache.lookup(self.start))
+
+    def test_should_evict_least_recently_used_entries(self):
+        self.cache.max_entries = 2
+        other = path.join(self.project, "a")
+
+        self.find()
+        self.find(other)
+        self.find()
+        self.find(self.project)
+
+        reloaded = discovery.DiscoveryCache(self.cache.filename)
+        self.assertEqual([self.start, self.project],
+                         [entry[0] for entry in reloaded.entries])
+
+    def test_should_bypass_cache_on_refresh(self):
+        self.find()
+
+        def lookup(start):
+            self.fail("cache should not be consulted")
+        self.cache.lookup = lookup
+
+        self.assertEqual(path.join(self.project, ".vip"),
+                         self.find(refresh=True))
+        self.assertEqual([self.start], [e[0] for e in self.cache.entries])
+
+    def test_should_not_cache_failures(self):
+        with self.assertRaises(core.VipError):
+            self.find(start=path.splitdrive(self.root)[0] + path.sep)
+
+        self.assertEqual([], self.cache.entries)
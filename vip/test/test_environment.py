@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+import tempfile
+
+from os import path
+
+from .test_helper import unittest
+
+import vip
+
+from vip import core
+from vip import environment
+
+
+def make_virtualenv(vip_dir, version=None):
+    """ Creates a fake virtualenv of an interpreter version, the running one
+    by default, with a module and a `.pth` file in site-packages.
+    """
+    version = version or tuple(sys.version_info[:2])
+    if core.is_win:
+        site_packages = path.join(vip_dir, "Lib", "site-packages")
+    else:
+        site_packages = path.join(vip_dir, "lib", "python%d.%d" % version,
+                                  "site-packages")
+    os.makedirs(site_packages)
+    os.makedirs(path.join(vip_dir, "src"))
+    with open(path.join(vip_dir, "pyvenv.cfg"), "w") as f:
+        f.write("version = %d.%d.0\n" % version)
+
+    module = path.basename(path.dirname(vip_dir)) + "_vip_module"
+    with open(path.join(site_packages, module + ".py"), "w") as f:
+        f.write("LOCATION = %r\n" % vip_dir)
+    with open(path.join(site_packages, "project.pth"), "w") as f:
+        f.write(path.join(vip_dir, "src") + "\n")
+    return site_packages, module
+
+
+class TestActivate(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.sys_path = sys.path[:]
+        self.prefix = sys.prefix
+        self.environ = dict(os.environ)
+
+        self.project = path.join(self.root, "a")
+        self.vip_dir = path.join(self.project, core.VIP_DIRECTORY)
+        self.site_packages, self.module = make_virtualenv(self.vip_dir)
+
+    def tearDown(self):
+        vip.deactivate()
+        shutil.rmtree(self.root)
+
+    def test_should_import_from_virtualenv(self):
+        subdirectory = path.join(self.project, "package")
+        os.mkdir(subdirectory)
+
+        self.assertEqual(self.vip_dir, vip.activate(subdirectory))
+
+        module = __import__(self.module)
+        self.assertEqual(self.vip_dir, module.LOCATION)
+        self.assertEqual(self.site_packages, sys.path[0])
+        self.assertIn(path.join(self.vip_dir, "src"), sys.path)
+        self.assertEqual(self.vip_dir, sys.prefix)
+        self.assertEqual(self.vip_dir, os.environ["VIRTUAL_ENV"])
+        self.assertTrue(os.environ["PATH"].startswith(
+            path.join(self.vip_dir, "Scripts" if core.is_win else "bin")))
+        self.assertEqual(self.vip_dir, environment.get_active())
+
+    def test_should_restore_interpreter_state(self):
+        vip.activate(self.project)
+        __import__(self.module)
+
+        self.assertEqual(self.vip_dir, vip.deactivate())
+
+        self.assertEqual(self.sys_path, sys.path)
+        self.assertEqual(self.prefix, sys.prefix)
+        self.assertEqual(self.environ, dict(os.environ))
+        self.assertNotIn(self.module, sys.modules)
+        self.assertIsNone(environment.get_active())
+        self.assertIsNone(vip.deactivate())
+
+    def test_should_switch_virtualenvs(self):
+        other = path.join(self.root, "b", core.VIP_DIRECTORY)
+        other_site_packages, other_module = make_virtualenv(other)
+
+        vip.activate(self.project)
+        vip.activate(path.dirname(other))
+
+        self.assertNotIn(self.site_packages, sys.path)
+        self.assertEqual(other_site_packages, sys.path[0])
+        self.assertEqual(other, __import__(other_module).LOCATION)
+        with self.assertRaises(ImportError):
+            __import__(self.module)
+
+    def test_should_refuse_other_interpreter_version(self):
+        other = path.join(self.root, "b", core.VIP_DIRECTORY)
+        make_virtualenv(other, (1, 5))
+
+        with self.assertRaisesRegexp(core.VipError, "Python 1.5"):
+            vip.activate(path.dirname(other))
+
+        self.assertEqual(self.sys_path, sys.path)
+        self.assertIsNone(environment.get_active())
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from os import path
+
+from .test_helper import mox
+from .test_helper import unittest
+
+from vip import core
+from vip import interpreters
+
+
+class TestParseVersions(unittest.TestCase):
+
+    def test_should_parse_versions(self):
+        self.assertEqual([(2, 7), (3, 3)],
+                         interpreters.parse_versions("2.7, 3.3,,2.7"))
+
+    def test_should_raise_VipError_on_invalid_versions(self):
+        with self.assertRaisesRegexp(core.VipError, "invalid Python"):
+            interpreters.parse_versions("2.7,python3")
+        with self.assertRaisesRegexp(core.VipError, "no Python"):
+            interpreters.parse_versions(",")
+
+
+class TestCreateEnvironments(unittest.TestCase):
+
+    def setUp(self):
+        self.mox = mox.Mox()
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.vip_dir = path.join(self.root, ".vip")
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        shutil.rmtree(self.root)
+
+    def test_find_interpreter(self):
+        executable = path.join(self.root, "python2.7")
+        with open(executable, "w") as f:
+            f.write("#!/bin/sh\n")
+        os.chmod(executable, 0o755)
+
+        environ = {"PATH": os.pathsep.join(["/nowhere", self.root])}
+        if not core.is_win:
+            self.assertEqual(executable, interpreters.find_interpreter(
+                (2, 7), environ))
+        with self.assertRaisesRegexp(core.VipError, "cannot find"):
+            interpreters.find_interpreter((1, 5), environ)
+
+    def test_should_create_environments_concurrently(self):
+        started = []
+        barrier = threading.Event()
+
+        def create_environment(directory, version, install_requirements,
+                               wheel_cache):
+            started.append(version)
+            if len(started) == 2:
+                barrier.set()
+            # Both are running at once, or this times out
+            self.assertTrue(barrier.wait(5))
+            if version == (3, 3):
+                raise core.VipError("boom")
+            return path.join(self.vip_dir, core.get_environment_name(version))
+
+        self.mox.StubOutWithMock(interpreters, "create_environment")
+        interpreters.create_environment = create_environment
+
+        with self.assertRaisesRegexp(core.VipError, "boom"):
+            interpreters.create_environments(self.root, [(3, 3), (2, 7)])
+
+        self.assertEqual(set([(2, 7), (3, 3)]), set(started))
+        with open(path.join(self.vip_dir, core.DEFAULT_PYTHON_FILENAME)) as f:
+            self.assertEqual("3.3\n", f.read())
+
+    def test_should_not_mix_with_single_virtualenv(self):
+        os.makedirs(path.join(self.vip_dir, "bin"))
+
+        with self.assertRaisesRegexp(core.VipError, "single interpreter"):
+            interpreters.create_environments(self.root, [(2, 7)])
+
+    def stub_virtualenv(self, returncode=0):
+        created = []
+
+        class Process(object):
+
+            def __init__(self, args, **kwargs):
+                created.append(args[-1])
+                os.makedirs(path.join(args[-1], "bin"))
+                with open(path.join(args[-1], "bin", "activate"), "w") as f:
+                    f.write('VIRTUAL_ENV="%s"\n' % args[-1])
+                self.returncode = returncode
+
+            def communicate(self):
+                return b"output", None
+
+        self.mox.StubOutWithMock(interpreters, "find_interpreter")
+        interpreters.find_interpreter = lambda version: "python2.7"
+        self.mox.StubOutWithMock(subprocess, "Popen")
+        subprocess.Popen = Process
+        return created
+
+    def test_should_build_environment_in_temporary_directory(self):
+        created = self.stub_virtualenv()
+        installed = []
+
+        def install_requirements_files(vip_directory, directory, **kwargs):
+            installed.append(vip_directory)
+
+        self.mox.StubOutWithMock(core, "install_requirements_files")
+        core.install_requirements_files = install_requirements_files
+        self.mox.StubOutWithMock(core, "logger", use_mock_anything=True)
+
+        environment = interpreters.create_environment(self.root, (2, 7))
+
+        self.assertEqual(path.join(self.vip_dir, "py27"), environment)
+        self.assertNotEqual(environment, created[0])
+        self.assertEqual(created, installed)
+        with open(path.join(environment, "bin", "activate")) as f:
+            self.assertEqual('VIRTUAL_ENV="%s"\n' % environment, f.read())
+        self.assertEqual(["py27", "py27.lock"], sorted(os.listdir(
+            self.vip_dir)))
+
+    def test_should_remove_environment_that_failed(self):
+        self.stub_virtualenv(returncode=1)
+        self.mox.StubOutWithMock(core, "logger", use_mock_anything=True)
+
+        with self.assertRaisesRegexp(core.VipError, "exit code 1"):
+            interpreters.create_environment(self.root, (2, 7))
+
+        self.assertEqual(["py27.lock"], os.listdir(self.vip_dir))
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+from os import path
+
+from .test_helper import mox
+from .test_helper import unittest
+
+from vip import core
+from vip import lockfile
+from vip import requirements
+
+
+def sha256(content):
+    return "sha256:" + hashlib.sha256(content).hexdigest()
+
+
+class LockfileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.vip_dir = path.join(self.root, ".vip")
+        os.mkdir(self.vip_dir)
+        self.version = "".join(map(str, sys.version_info[:2]))
+        self.mox = mox.Mox()
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        filename = path.join(self.root, name)
+        with open(filename, "w") as f:
+            f.write(content)
+        return filename
+
+
+class TestLockfileNames(LockfileTestCase):
+
+    def test_get_lockfile_name(self):
+        self.assertEqual("requirements-27.lock",
+                         lockfile.get_lockfile_name(None, (2, 7, 3)))
+        self.assertEqual("devel-requirements-33.lock",
+                         lockfile.get_lockfile_name("devel", (3, 3)))
+
+    def test_find_most_specific_lockfile(self):
+        self.write("requirements.lock", "")
+        expected = self.write("requirements-27.lock", "")
+        self.write("requirements-33.lock", "")
+
+        self.assertEqual(expected, lockfile.find_lockfile(self.root,
+                                                          version=(2, 7)))
+
+    def test_find_lockfile_with_prefix(self):
+        self.write("requirements-27.lock", "")
+
+        self.assertIsNone(lockfile.find_lockfile(self.root, "devel", (2, 7)))
+
+        expected = self.write("devel-requirements.lock", "")
+        self.assertEqual(expected, lockfile.find_lockfile(self.root, "devel",
+                                                          (2, 7)))
+
+    def test_parse_artifact_filename(self):
+        self.assertEqual(("foo-bar", "1.0"), lockfile.parse_artifact_filename(
+            "Foo_Bar-1.0-py2.py3-none-any.whl"))
+        self.assertEqual(("foo-bar", "1.0.post1"),
+                         lockfile.parse_artifact_filename(
+                             "/tmp/foo-bar-1.0.post1.tar.gz"))
+        self.assertIsNone(lockfile.parse_artifact_filename("README"))
+
+
+class TestCreateLockfile(LockfileTestCase):
+
+    def download(self, artifacts):
+        def execute(vip_directory, command, args):
+            with open(args[-1]) as f:
+                self.downloaded.append((args[:3], f.read()))
+            os.mkdir(args[2])
+            for name, content in artifacts.items():
+                with open(path.join(args[2], name), "wb") as f:
+                    f.write(content)
+            return 0
+
+        self.downloaded = []
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+        core.execute_virtualenv_command = execute
+
+    def test_should_pin_downloaded_artifacts_with_hashes(self):
+        self.write("requirements.txt", "-i http://example.com/simple\n"
+                   "--pre\nrequests>=1.0\n")
+        self.download({"requests-2.0-py2.py3-none-any.whl": b"requests",
+                       "urllib3-1.9.tar.gz": b"urllib3"})
+
+        filename = lockfile.create_lockfile(self.vip_dir)
+
+        self.assertEqual(path.join(self.root, "requirements-%s.lock" %
+                                   self.version), filename)
+        self.assertEqual([(["download", "--dest", mox.IgnoreArg()],
+                           "-i http://example.com/simple\n--pre\n"
+                           "requests>=1.0\n")], self.downloaded)
+
+        plan = requirements.InstallPlan.from_files([filename])
+        self.assertEqual([
+            "-i http://example.com/simple",
+            "requests==2.0 --hash=%s" % sha256(b"requests"),
+            "urllib3==1.9 --hash=%s" % sha256(b"urllib3"),
+        ], plan.lines())
+        self.assertEqual([], os.listdir(self.vip_dir))
+
+    def test_should_notice_changed_requirements(self):
+        self.write("requirements.txt", "requests>=1.0\n")
+        self.download({"requests-2.0-py2.py3-none-any.whl": b"requests"})
+        filename = lockfile.create_lockfile(self.vip_dir)
+        core.execute_virtualenv_command = lambda *args: 0
+
+        self.assertFalse(lockfile.is_stale(filename, self.root))
+
+        self.write("requirements.txt", "requests>=1.0\nnose\n")
+        self.assertTrue(lockfile.is_stale(filename, self.root))
+
+        self.mox.StubOutWithMock(core, "logger", use_mock_anything=True)
+        core.logger.warning(mox.StrContains("out of date"))
+        core.logger.info(mox.IgnoreArg())
+        self.mox.ReplayAll()
+
+        self.assertEqual([filename],
+                         core.install_requirements_files(self.vip_dir))
+        self.mox.VerifyAll()
+
+    def test_lockfiles_without_fingerprint_should_not_be_stale(self):
+        self.write("requirements.txt", "requests\n")
+        locked = self.write("requirements-%s.lock" % self.version,
+                            "requests==2.0 \\\n    --hash=sha256:abc\n")
+
+        self.assertFalse(lockfile.is_stale(locked, self.root))
+
+    def test_should_raise_VipError_for_editables(self):
+        self.write("requirements.txt",
+                   "-e git+https://example.com/repo.git#egg=repo\n")
+
+        with self.assertRaisesRegexp(core.VipError, "editable"):
+            lockfile.create_lockfile(self.vip_dir)
+
+    def test_should_raise_VipError_without_requirements(self):
+        with self.assertRaisesRegexp(core.VipError, "no requirements"):
+            lockfile.create_lockfile(self.vip_dir)
+
+    def test_should_install_lockfile_without_resolving(self):
+        self.write("requirements.txt", "requests\n")
+        locked = self.write("requirements-%s.lock" % self.version,
+                            "requests==2.0 \\\n    --hash=sha256:abc\n")
+
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip", ["install", "--no-deps", "--require-hashes",
+                                  "-r", locked]).AndReturn(0)
+        self.mox.ReplayAll()
+
+        self.assertEqual([locked],
+                         core.install_requirements_files(self.vip_dir))
+
+        self.mox.VerifyAll()
+        state = requirements.load_installed(self.vip_dir)
+        self.assertEqual(["requests==2.0 --hash=sha256:abc"],
+                         state["plan"].lines())
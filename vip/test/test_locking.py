@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import shutil
+import tempfile
+import threading
+
+from os import path
+
+from .test_helper import unittest
+
+from vip import core
+from vip import locking
+
+
+class TestFileLock(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.filename = path.join(self.root, ".vip.lock")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_timeout(self):
+        self.assertEqual(locking.DEFAULT_TIMEOUT, locking.get_timeout({}))
+        self.assertEqual(2.5, locking.get_timeout({"VIP_LOCK_TIMEOUT": "2.5"}))
+        with self.assertRaisesRegexp(core.VipError, "VIP_LOCK_TIMEOUT"):
+            locking.get_timeout({"VIP_LOCK_TIMEOUT": "soon"})
+
+    def test_should_time_out_when_lock_is_held(self):
+        with locking.FileLock(self.filename):
+            lock = locking.FileLock(self.filename, timeout=0.2)
+            with self.assertRaisesRegexp(core.VipError, "timed out"):
+                lock.acquire()
+            self.assertTrue(lock.waited)
+
+        # Released locks can be taken again
+        with locking.FileLock(self.filename, timeout=0) as lock:
+            self.assertFalse(lock.waited)
+
+    def test_should_wait_for_lock(self):
+        holder = locking.FileLock(self.filename)
+        holder.acquire()
+        timer = threading.Timer(0.2, holder.release)
+        timer.start()
+
+        try:
+            with locking.FileLock(self.filename, timeout=5) as lock:
+                self.assertTrue(lock.waited)
+        finally:
+            timer.join()
@@ -1,19 +1,103 @@
 # -*- coding: utf-8 -*-
 
 import os
+import shutil
 import signal
 import subprocess
+import sys
+import tempfile
 
 from os import path
 
 from .test_helper import mox
 from .test_helper import unittest
 
+from vip import core
+
 
 class TestMain(unittest.TestCase):
 
     def test_import(self):
         from vip import main
 
+    def test_should_reject_batch_file_with_commands(self):
+        from vip import main
+
+        m = mox.Mox()
+        m.StubOutWithMock(core, "logger", use_mock_anything=True)
+        core.logger.verbose = False
+        core.logger.exception(mox.StrContains("either a file or commands"))
+        m.ReplayAll()
+        try:
+            with self.assertRaises(SystemExit) as raised:
+                main.dispatch(["--batch", "flake8", "src", "--", "nosetests"])
+            self.assertEqual(1, raised.exception.code)
+            m.VerifyAll()
+        finally:
+            m.UnsetStubs()
+
+
+# Executed in a separate interpreter; reports modules imported by vip before
+# the command replaces the process
+DISPATCH_SCRIPT = """
+import os
+import sys
+
+modules = set(sys.modules)
+
+def execve(executable, args, environ):
+    sys.stdout.write(" ".join(sorted(set(sys.modules) - modules)))
+    sys.stdout.flush()
+    os._exit(0)
+
+os.execve = execve
+sys.argv = ["vip", "command", "-arg"]
+
+from vip import main
+main.main()
+"""
+
+
+@unittest.skipUnless(core.EXEC_BY_DEFAULT, "requires exec dispatch")
+class TestStartupBudget(unittest.TestCase):
+
+    # Modules that must not be imported on the `vip command ...` path
+    HEAVY_MODULES = ["argparse", "contextlib", "itertools", "json",
+                     "logging", "path", "signal", "subprocess", "tempfile",
+                     "virtualenv"]
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.fixture = path.join(path.dirname(path.abspath(__file__)),
+                                 "fixtures", "test1")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def get_imported_modules(self):
+        root = path.dirname(path.dirname(path.dirname(
+            path.abspath(__file__))))
+
+        environ = dict(os.environ, VIP_CACHE_DIR=self.cache_dir)
+        environ["PYTHONPATH"] = os.pathsep.join(
+            [root] + [p for p in [environ.get("PYTHONPATH")] if p])
+
+        p = subprocess.Popen([sys.executable, "-c", DISPATCH_SCRIPT],
+                             cwd=self.fixture, env=environ,
+                             stdout=subprocess.PIPE)
+        output = p.communicate()[0].decode()
+
+        self.assertEqual(0, p.returncode)
+        return set(output.split())
+
+    def test_dispatch_should_not_import_heavy_modules(self):
+        # The first run fills the discovery cache, the second one uses it
+        for _ in range(2):
+            imported = self.get_imported_modules()
+
+            self.assertIn("vip.main", imported)
+            self.assertEqual([], sorted(imported & set(self.HEAVY_MODULES)))
+
+
 if __name__ == '__main__':
     unittest.main()
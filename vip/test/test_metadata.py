@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from os import path
+
+from .test_helper import unittest
+
+from vip import core
+from vip import metadata
+
+
+class TestInstalledDistributions(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.vip_dir = path.join(self.root, ".vip")
+        os.mkdir(self.vip_dir)
+        with open(path.join(self.vip_dir, "pyvenv.cfg"), "w") as f:
+            f.write("version = 3.4.1\n")
+
+        self.site_packages = core.get_site_packages(self.vip_dir)
+        os.makedirs(self.site_packages)
+
+        self.write("Flask-0.10.dist-info/METADATA",
+                   "Metadata-Version: 2.0\nName: Flask\nVersion: 0.10\n"
+                   "\nVersion: 99\n")
+        self.write("nose-1.3.0-py3.4.egg-info/PKG-INFO",
+                   "Name: nose\nVersion: 1.3.0\n")
+        self.write("mox-0.5.3-py3.4.egg-info", "Name: mox\nVersion: 0.5.3\n")
+        self.write("broken-2.0.dist-info/RECORD", "")
+        self.write("flask/__init__.py", "")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        filename = path.join(self.site_packages, *name.split("/"))
+        if not path.isdir(path.dirname(filename)):
+            os.makedirs(path.dirname(filename))
+        with open(filename, "w") as f:
+            f.write(content)
+
+    def test_should_read_metadata(self):
+        distributions = metadata.get_installed_distributions(self.vip_dir)
+
+        self.assertEqual(["broken==2.0", "Flask==0.10", "mox==0.5.3",
+                          "nose==1.3.0"],
+                         sorted(map(str, distributions.values()),
+                                key=str.lower))
+        self.assertEqual("Flask", distributions["flask"].name)
+
+    def test_should_find_local_projects(self):
+        project = path.realpath(self.root)
+        self.write("MyLib.egg-link", "%s\n.\n" % path.join(project, "lib"))
+        self.write("project-0.1.dist-info/METADATA",
+                   "Name: Project\nVersion: 0.1\n")
+        self.write("project-0.1.dist-info/direct_url.json",
+                   '{"url": "file://%s", "dir_info": {"editable": true}}' %
+                   project)
+        self.write("Flask-0.10.dist-info/direct_url.json",
+                   '{"url": "https://example.com/Flask-0.10.tar.gz"}')
+
+        self.assertEqual({path.join(project, "lib"): "mylib",
+                          project: "project"},
+                         metadata.get_local_projects(self.vip_dir))
+
+    def test_should_cache_index_until_site_packages_changes(self):
+        index = metadata.get_installed_index(self.vip_dir)
+        self.assertEqual(("Flask", "0.10"), index["flask"])
+        self.assertTrue(path.isfile(path.join(self.vip_dir,
+                                              metadata.INDEX_FILENAME)))
+
+        # Index is used as long as the directory has not changed
+        self.write("Flask-0.10.dist-info/METADATA", "Version: 0.11\n")
+        self.assertEqual(index, metadata.get_installed_index(self.vip_dir))
+
+        shutil.rmtree(path.join(self.site_packages, "Flask-0.10.dist-info"))
+        os.utime(self.site_packages, (0, 0))
+        self.assertNotIn("flask", metadata.get_installed_index(self.vip_dir))
+
+    def test_should_check_requirements(self):
+        with open(path.join(self.root, "requirements.txt"), "w") as f:
+            f.write("flask==0.10\nnose<1\n")
+
+        report = core.check_requirements(self.vip_dir)
+
+        self.assertEqual([path.join(self.root, "requirements.txt")],
+                         report["files"])
+        self.assertEqual([("nose<1", "1.3.0")], report["mismatched"])
+        self.assertEqual([("broken", "2.0"), ("mox", "0.5.3")],
+                         report["extra"])
+
+    def test_should_update_requirements_file(self):
+        filename = path.join(self.root, "requirements.txt")
+        with open(filename, "w") as f:
+            f.write("# dependencies\nflask>=0.9\nrequests\n")
+        with open(path.join(self.root, "requirements-3.txt"), "w") as f:
+            f.write("mox\n")
+        # Development dependencies do not leak into requirements.txt
+        with open(path.join(self.root, "devel-requirements.txt"), "w") as f:
+            f.write("nose\n")
+
+        self.assertEqual(filename, core.update_requirements_file(
+            self.vip_dir))
+
+        with open(filename) as f:
+            self.assertEqual("# dependencies\nflask==0.10\nbroken==2.0\n",
+                             f.read())
+
+    def test_should_not_create_requirements_file_unless_asked(self):
+        self.assertIsNone(core.update_requirements_file(self.vip_dir,
+                                                        create=False))
+        self.assertFalse(path.exists(path.join(self.root,
+                                               "requirements.txt")))
@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+import tempfile
+
+from os import path
+
+from .test_helper import mox
+from .test_helper import unittest
+
+from vip import core
+from vip import requirements
+
+
+class RequirementsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, content):
+        filename = path.join(self.root, name)
+        with open(filename, "w") as f:
+            f.write(content)
+        return filename
+
+
+class TestRequirement(unittest.TestCase):
+
+    def test_parse(self):
+        r = requirements.Requirement.parse(
+            "Foo_Bar [a, b] >=1.0, <2 ; python_version < '3'")
+
+        self.assertEqual("Foo_Bar", r.name)
+        self.assertEqual(["a", "b"], r.extras)
+        self.assertEqual([">=1.0", "<2"], r.specs)
+        self.assertEqual("python_version < '3'", r.marker)
+        self.assertEqual(("foo-bar", "python_version < '3'"), r.key)
+
+    def test_parse_hashes(self):
+        r = requirements.Requirement.parse(
+            "foo==1.0 --hash=sha256:abc --hash sha256:def")
+
+        self.assertEqual(["==1.0"], r.specs)
+        self.assertEqual(["sha256:abc", "sha256:def"], r.hashes)
+        self.assertEqual("foo==1.0 --hash=sha256:abc --hash=sha256:def",
+                         str(r))
+
+    def test_parse_url(self):
+        self.assertIsNone(requirements.Requirement.parse(
+            "http://example.com/foo.tar.gz#egg=foo"))
+
+    def test_merge(self):
+        r = requirements.Requirement.parse("foo[a]>=1.0")
+        r.merge(requirements.Requirement.parse("Foo[b]<2,>=1.0"))
+
+        self.assertEqual("foo[a,b]>=1.0,<2", str(r))
+
+    def test_merge_should_raise_VipError_on_conflicting_pins(self):
+        r = requirements.Requirement.parse("foo==1.0", "a.txt")
+
+        with self.assertRaisesRegexp(core.VipError, "conflicting"):
+            r.merge(requirements.Requirement.parse("foo==1.1", "b.txt"))
+
+
+class TestInstallPlan(RequirementsTestCase):
+
+    def test_should_merge_files(self):
+        base = self.write("requirements.txt", "\n".join([
+            "# comment",
+            "-i http://pypi.example.com/simple",
+            "requests>=1.0  # trailing comment",
+            "-e git+https://example.com/repo.git#egg=repo",
+            "",
+        ]))
+        devel = self.write("devel-requirements.txt", "\n".join([
+            "-i http://pypi.example.com/simple",
+            "-r extra.txt",
+            "Requests<3",
+            "-e  git+https://example.com/repo.git#egg=repo",
+        ]))
+        self.write("extra.txt", "nose \\\n  ==1.2\n")
+
+        plan = requirements.InstallPlan.from_files([base, devel])
+
+        self.assertEqual([
+            "-i http://pypi.example.com/simple",
+            "requests>=1.0,<3",
+            "-e git+https://example.com/repo.git#egg=repo",
+            "nose==1.2",
+        ], plan.lines())
+
+    def test_should_raise_VipError_on_conflict(self):
+        base = self.write("requirements.txt", "nose==1.2\n")
+        version = self.write("requirements-2.txt", "nose==1.3\n")
+
+        with self.assertRaisesRegexp(core.VipError, "conflicting"):
+            requirements.InstallPlan.from_files([base, version])
+
+    def test_find_requirements_files(self):
+        expected = [self.write("requirements.txt", ""),
+                    self.write("requirements-27.txt", ""),
+                    self.write("devel-requirements.txt", "")]
+        self.write("prod-requirements.txt", "")
+
+        self.assertEqual(expected, requirements.find_requirements_files(
+            self.root, "devel", (2, 7, 3)))
+
+    def test_is_local(self):
+        for line in ["-e .", "./package", "-e ../lib",
+                     "file:///tmp/foo.tar.gz", "-c constraints.txt"]:
+            plan = requirements.InstallPlan()
+            plan.add_line(line)
+            self.assertTrue(plan.is_local(), line)
+
+        for line in ["nose==1.2", "-e git+https://example.com/foo#egg=foo",
+                     "https://example.com/foo.tar.gz#egg=foo",
+                     "--index-url https://example.com/simple"]:
+            plan = requirements.InstallPlan()
+            plan.add_line(line)
+            self.assertFalse(plan.is_local(), line)
+
+
+class TestInstallRequirementsFiles(RequirementsTestCase):
+
+    def setUp(self):
+        super(TestInstallRequirementsFiles, self).setUp()
+        self.mox = mox.Mox()
+        self.vip_dir = path.join(self.root, ".vip")
+        os.mkdir(self.vip_dir)
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        super(TestInstallRequirementsFiles, self).tearDown()
+
+    def test_should_install_merged_plan_at_once(self):
+        version = "".join(map(str, sys.version_info[:2]))
+        self.write("requirements.txt", "nose\n")
+        self.write("requirements-%s.txt" % version, "mox\n")
+
+        installed = []
+
+        def execute(vip_directory, command, args):
+            with open(args[-1]) as f:
+                installed.append((command, args[:-1], f.read()))
+            return 0
+
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+        core.execute_virtualenv_command = execute
+
+        core.install_requirements_files(self.vip_dir)
+
+        self.assertEqual([("pip", ["install", "-r"], "nose\nmox\n")],
+                         installed)
+        self.assertEqual([".vip", "requirements-%s.txt" % version,
+                          "requirements.txt"], sorted(os.listdir(self.root)))
+
+    def test_should_raise_VipError_when_pip_fails(self):
+        self.write("requirements.txt", "nose\n")
+
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip", ["install", "-r", mox.IgnoreArg()]
+        ).AndReturn(1)
+        self.mox.ReplayAll()
+
+        with self.assertRaisesRegexp(core.VipError, "exit code 1"):
+            core.install_requirements_files(self.vip_dir)
+
+        self.mox.VerifyAll()
+
+    def test_should_skip_installation_when_nothing_changed(self):
+        self.write("requirements.txt", "nose\n")
+
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip", ["install", "-r", mox.IgnoreArg()]
+        ).AndReturn(0)
+        self.mox.ReplayAll()
+
+        core.install_requirements_files(self.vip_dir)
+        core.install_requirements_files(self.vip_dir)
+
+        self.mox.VerifyAll()
+
+    def test_should_install_only_changes(self):
+        self.write("requirements.txt", "nose\nmox==0.5\n")
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+        core.execute_virtualenv_command = lambda *args: 0
+        core.install_requirements_files(self.vip_dir)
+
+        self.write("requirements.txt", "mox==0.6\nrequests\n")
+        calls = []
+
+        def execute(vip_directory, command, args):
+            if args[0] == "install":
+                with open(args[-1]) as f:
+                    args = args[:-1] + [f.read()]
+            calls.append(args)
+            return 0
+
+        core.execute_virtualenv_command = execute
+        core.install_requirements_files(self.vip_dir, uninstall=True)
+
+        self.assertEqual([["uninstall", "-y", "nose"],
+                          ["install", "-r", "mox==0.6\nrequests\n"]], calls)
+
+        state = requirements.load_installed(self.vip_dir)
+        self.assertEqual(["mox==0.6", "requests"], state["plan"].lines())
+
+    def test_should_remember_projects_left_installed(self):
+        self.write("requirements.txt", "nose\nmox==0.5\n")
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+        core.execute_virtualenv_command = lambda *args: 0
+        core.install_requirements_files(self.vip_dir)
+
+        self.write("requirements.txt", "mox==0.5\n")
+        calls = []
+
+        def execute(vip_directory, command, args):
+            calls.append(args[0])
+            return 0
+
+        core.execute_virtualenv_command = execute
+        core.install_requirements_files(self.vip_dir)
+
+        self.assertEqual([], calls)
+        state = requirements.load_installed(self.vip_dir)
+        self.assertEqual(["mox==0.5", "nose"], state["plan"].lines())
+
+        core.install_requirements_files(self.vip_dir, uninstall=True)
+
+        self.assertEqual(["uninstall"], calls)
+        state = requirements.load_installed(self.vip_dir)
+        self.assertEqual(["mox==0.5"], state["plan"].lines())
+
+    def test_sync_should_keep_projects_of_installed_prefixes(self):
+        self.write("requirements.txt", "nose\n")
+        self.write("devel-requirements.txt", "mox==0.5\n")
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+        core.execute_virtualenv_command = lambda *args: 0
+        core.install_requirements_files(self.vip_dir)
+        core.install_requirements_files(self.vip_dir, prefix="devel")
+
+        state = requirements.load_installed(self.vip_dir)
+        self.assertEqual(["devel"], state["prefixes"])
+
+        self.write("requirements.txt", "requests\n")
+        calls = []
+
+        def execute(vip_directory, command, args):
+            calls.append(args[:1] + [a for a in args[1:] if a != "-y"])
+            return 0
+
+        core.execute_virtualenv_command = execute
+        core.install_requirements_files(self.vip_dir, uninstall=True)
+
+        self.assertEqual([["uninstall", "nose"]], [c for c in calls
+                                                   if c[0] == "uninstall"])
+        state = requirements.load_installed(self.vip_dir)
+        self.assertEqual(["requests", "mox==0.5"], state["plan"].lines())
+        self.assertEqual(["devel"], state["prefixes"])
+
+        # Projects are uninstalled once files of the prefix drop them
+        self.write("devel-requirements.txt", "")
+        del calls[:]
+        core.install_requirements_files(self.vip_dir, uninstall=True)
+
+        self.assertEqual([["uninstall", "mox"]], calls)
+
+    def test_find_prefixes(self):
+        for name in ["requirements.txt", "devel-requirements.txt",
+                     "docs-requirements-27.txt", "devel-requirements.lock",
+                     "requirements-devel.txt"]:
+            self.write(name, "")
+
+        self.assertEqual(["devel", "docs"],
+                         requirements.find_prefixes(self.root))
+
+    def test_plan_difference(self):
+        installed = requirements.InstallPlan()
+        for line in ["-i http://example.com", "a==1", "b", "c"]:
+            installed.add_line(line)
+
+        plan = requirements.InstallPlan()
+        for line in ["-i http://example.com", "a==2", "c", "d"]:
+            plan.add_line(line)
+
+        added, removed = plan.difference(installed)
+        self.assertEqual(["-i http://example.com", "a==2", "d"],
+                         added.lines())
+        self.assertEqual(["b"], removed)
+
+
+class TestUpdateRequirementsLines(unittest.TestCase):
+
+    def test_should_pin_installed_versions_keeping_layout(self):
+        lines = ["# web\n", "-i http://example.com/simple\n",
+                 "Flask[async] >=0.8  # framework\n", "\n",
+                 "-e git+http://example.com/repo#egg=repo\n",
+                 "removed==1.0\n", "pywin32; sys_platform == 'win32'\n",
+                 "requests"]
+        installed = {"flask": ("Flask", "0.10"), "requests": ("requests",
+                                                              "2.0"),
+                     "werkzeug": ("Werkzeug", "0.9"), "nose": ("nose", "1.3")}
+
+        updated = requirements.update_requirements_lines(lines, installed,
+                                                         known=["nose"])
+
+        self.assertEqual(["# web\n", "-i http://example.com/simple\n",
+                          "Flask[async]==0.10  # framework\n", "\n",
+                          "-e git+http://example.com/repo#egg=repo\n",
+                          "pywin32; sys_platform == 'win32'\n",
+                          "requests==2.0\n", "Werkzeug==0.9\n"], updated)
+
+    def test_should_not_add_projects_of_other_entries(self):
+        project = path.realpath(tempfile.gettempdir())
+        lines = ["-e .\n", "-e git+http://example.com/lib#egg=MyLib\n",
+                 "http://example.com/foo-1.0.tar.gz#egg=foo\n", "flask\n"]
+        installed = {"flask": ("Flask", "0.10"), "mylib": ("MyLib", "1.0"),
+                     "foo": ("foo", "1.0"), "project": ("project", "0.1"),
+                     "nose": ("nose", "1.3")}
+
+        updated = requirements.update_requirements_lines(
+            lines, installed, local={project: "project"}, directory=project)
+
+        self.assertEqual(lines[:3] + ["flask==0.10\n", "nose==1.3\n"],
+                         updated)
+
+    def test_get_local_path(self):
+        directory = path.realpath(tempfile.gettempdir())
+        self.assertEqual(directory,
+                         requirements.get_local_path("-e .", directory))
+        self.assertEqual(path.join(directory, "pkg"),
+                         requirements.get_local_path("./pkg", directory))
+        self.assertEqual(path.join(directory, "pkg"),
+                         requirements.get_local_path(
+                             "file://%s/pkg#egg=pkg" % directory, "/"))
+        for line in ["nose", "-e git+http://example.com/lib#egg=lib",
+                     "-r base.txt"]:
+            self.assertIsNone(requirements.get_local_path(line, directory))
+
+
+class TestCheckRequirements(unittest.TestCase):
+
+    def test_should_report_differences(self):
+        plan = requirements.InstallPlan()
+        for line in ["flask>=0.9,<0.10", "nose==1.3", "requests",
+                     "pywin32; sys_platform == 'win32'",
+                     "-e git+http://example.com/repo#egg=Repo"]:
+            plan.add_line(line)
+        installed = {"flask": ("Flask", "0.10"), "nose": ("nose", "1.3.0"),
+                     "repo": ("Repo", "0.1"), "mox": ("mox", "0.5.3")}
+
+        report = requirements.check_requirements(plan, installed)
+
+        self.assertEqual(["requests"], report["missing"])
+        self.assertEqual([("flask>=0.9,<0.10", "0.10")], report["mismatched"])
+        self.assertEqual([("mox", "0.5.3")], report["extra"])
+        self.assertEqual(["pywin32; sys_platform == 'win32'"],
+                         report["unchecked"])
+        self.assertFalse(report["satisfied"])
+
+    def test_should_raise_VipError_on_invalid_specifier(self):
+        with self.assertRaisesRegexp(core.VipError, "invalid version"):
+            requirements.matches_specs("1.0", ["=>1"])
+
+    def test_should_leave_versions_unchecked_without_libraries(self):
+        names = ["packaging", "packaging.specifiers", "pkg_resources"]
+        modules = dict((name, sys.modules.get(name)) for name in names)
+        plan = requirements.InstallPlan()
+        plan.add_line("nose==1.3")
+        try:
+            for name in names:
+                sys.modules[name] = None
+
+            self.assertIsNone(requirements.matches_specs("1.0", [">=1"]))
+            report = requirements.check_requirements(
+                plan, {"nose": ("nose", "1.2")})
+        finally:
+            for name, module in modules.items():
+                if module is None:
+                    del sys.modules[name]
+                else:
+                    sys.modules[name] = module
+
+        self.assertEqual(["nose==1.3"], report["unchecked"])
+        self.assertTrue(report["satisfied"])
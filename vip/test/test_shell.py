@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from os import path
+
+from .test_helper import unittest
+
+from vip import core
+from vip import shell
+
+
+def which(program):
+    for directory in os.environ.get("PATH", "").split(os.pathsep):
+        if core.is_exe(path.join(directory, program)):
+            return path.join(directory, program)
+    return None
+
+
+class TestShellHook(unittest.TestCase):
+
+    def test_should_raise_VipError_for_unsupported_shell(self):
+        with self.assertRaisesRegexp(core.VipError, "unsupported shell"):
+            shell.get_shell_hook("cmd.exe")
+
+
+@unittest.skipUnless(which("bash"), "requires bash")
+class TestBashHook(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.project = path.join(self.root, "project")
+        os.makedirs(path.join(self.project, ".vip", "bin"))
+        os.makedirs(path.join(self.project, "src", "module"))
+        os.makedirs(path.join(self.root, "other", ".venv", "bin"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def run_bash(self, script):
+        script = shell.get_shell_hook("bash") + script
+        p = subprocess.Popen(["bash", "--norc", "-c", script],
+                             cwd=self.root, stdout=subprocess.PIPE,
+                             env={"PATH": "/usr/bin:/bin"})
+        output = p.communicate()[0].decode()
+        self.assertEqual(0, p.returncode)
+        return output.splitlines()
+
+    def test_should_activate_nearest_virtualenv(self):
+        output = self.run_bash("""
+            cd project/src/module; _vip_hook; echo "$VIRTUAL_ENV:$PATH"
+            cd ../../../other; _vip_hook; echo "$VIRTUAL_ENV:$PATH"
+            cd ..; _vip_hook; echo "$VIRTUAL_ENV:$PATH"
+        """)
+
+        vip_bin = path.join(self.project, ".vip", "bin")
+        venv_bin = path.join(self.root, "other", ".venv", "bin")
+        self.assertEqual([
+            path.join(self.project, ".vip") + ":" + vip_bin + ":/usr/bin:/bin",
+            path.join(self.root, "other", ".venv") + ":" + venv_bin +
+            ":/usr/bin:/bin",
+            ":/usr/bin:/bin",
+        ], output)
+
+    def test_should_stop_at_ceiling_directories(self):
+        output = self.run_bash("""
+            VIP_CEILING_DIRECTORIES="/nowhere:%s"
+            cd project/src/module; _vip_hook; echo "$VIRTUAL_ENV"
+            cd ..; _vip_hook; echo "$VIRTUAL_ENV"
+        """ % path.join(self.project, "src"))
+
+        self.assertEqual(["", path.join(self.project, ".vip")], output)
+
+    def test_should_activate_default_interpreter_virtualenv(self):
+        other = path.join(self.root, "other")
+        shutil.rmtree(path.join(other, ".venv"))
+        os.makedirs(path.join(other, ".vip", "py27", "bin"))
+        os.makedirs(path.join(other, ".vip", "py33", "bin"))
+        with open(path.join(other, ".vip", core.DEFAULT_PYTHON_FILENAME),
+                  "w") as f:
+            f.write("3.3\n")
+
+        output = self.run_bash("""
+            cd other; _vip_hook; echo "$VIRTUAL_ENV"
+            VIP_PYTHON=2.7 _vip_hook -f; echo "$VIRTUAL_ENV"
+        """)
+
+        self.assertEqual([path.join(other, ".vip", "py33"),
+                          path.join(other, ".vip", "py27")], output)
+
+    def test_should_install_hook_once(self):
+        output = self.run_bash("""
+            PROMPT_COMMAND="_vip_hook;true"
+            %s
+            echo "$PROMPT_COMMAND"
+        """ % shell.get_shell_hook("bash"))
+
+        self.assertEqual(["_vip_hook;true"], output)
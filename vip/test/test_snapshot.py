@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+
+from os import path
+
+from .test_helper import unittest
+from .test_templates import make_virtualenv
+
+from vip import core
+from vip import snapshot
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.vip_dir = path.join(self.root, "project", ".vip")
+        make_virtualenv(self.vip_dir)
+        open(path.join(self.vip_dir, "installed-index.json"), "w").close()
+        os.mkdir(path.join(self.vip_dir, "logs"))
+
+        self.target = path.join(self.root, "restored")
+        self.filename = path.join(self.root, "snapshot.tar.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read(self, *parts):
+        with open(path.join(*parts)) as f:
+            return f.read()
+
+    def test_get_compression(self):
+        self.assertEqual("gz", snapshot.get_compression("env.tgz"))
+        self.assertEqual("xz", snapshot.get_compression("env.tar.xz"))
+        self.assertEqual("", snapshot.get_compression("env.tar"))
+        self.assertEqual("gz", snapshot.get_compression("-"))
+
+    def test_should_start_with_manifest(self):
+        manifest = snapshot.create_snapshot(self.vip_dir, self.filename)
+
+        with tarfile.open(self.filename) as archive:
+            names = archive.getnames()
+            stored = json.loads(archive.extractfile(
+                snapshot.MANIFEST_NAME).read().decode("utf-8"))
+
+        self.assertEqual(snapshot.MANIFEST_NAME, names[0])
+        self.assertEqual(manifest, stored)
+        self.assertEqual(self.vip_dir, manifest["path"])
+        self.assertEqual(["bin/activate", "bin/pip",
+                          "lib/python2.7/site-packages/project.pth"],
+                         manifest["files"])
+        self.assertNotIn("logs", names)
+        self.assertNotIn("installed-index.json", names)
+        if hasattr(os, "symlink"):
+            self.assertEqual(["lib64"], manifest["links"])
+
+    def test_should_restore_in_another_directory(self):
+        snapshot.create_snapshot(self.vip_dir, self.filename)
+
+        restored = snapshot.restore_snapshot(self.filename, self.target)
+
+        self.assertEqual(path.join(self.target, ".vip"), restored)
+        self.assertEqual("#!%s/bin/python\nimport pip\n" % restored,
+                         self.read(restored, "bin", "pip"))
+        self.assertEqual("%s/src\n" % restored, self.read(
+            restored, "lib", "python2.7", "site-packages", "project.pth"))
+        # Files not listed in the manifest are not rewritten
+        self.assertEqual("print('%s')\n" % self.vip_dir, self.read(
+            restored, "lib", "python2.7", "site-packages", "module.py"))
+        if hasattr(os, "symlink"):
+            self.assertEqual(path.join(restored, "lib"),
+                             os.readlink(path.join(restored, "lib64")))
+        self.assertEqual([".vip"], os.listdir(self.target))
+
+    def test_should_not_overwrite_virtualenv(self):
+        snapshot.create_snapshot(self.vip_dir, self.filename)
+
+        with self.assertRaisesRegexp(core.VipError, "already exists"):
+            snapshot.restore_snapshot(self.filename,
+                                      path.dirname(self.vip_dir))
+
+    def test_should_reject_other_archives(self):
+        with tarfile.open(self.filename, "w:gz") as archive:
+            info = tarfile.TarInfo("../escape")
+            archive.addfile(info, io.BytesIO(b""))
+
+        with self.assertRaisesRegexp(core.VipError, "not a vip snapshot"):
+            snapshot.restore_snapshot(self.filename, self.target)
+        self.assertEqual([], os.listdir(self.target))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import io
+import os
+import shutil
+import tempfile
+
+from os import path
+
+from .test_helper import unittest
+
+from vip import core
+from vip import stream
+
+
+SCRIPT = """#!/bin/sh
+echo first
+echo error >&2
+printf 'no newline'
+exit 3
+"""
+
+
+@unittest.skipIf(core.is_win, "POSIX-specific test")
+class StreamTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.vip_dir = path.join(self.root, ".vip")
+        os.makedirs(path.join(self.vip_dir, "bin"))
+
+        command = path.join(self.vip_dir, "bin", "command")
+        with open(command, "w") as f:
+            f.write(SCRIPT)
+        os.chmod(command, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+
+class TestCommandStream(StreamTestCase):
+
+    def test_should_iterate_over_lines(self):
+        command = stream.CommandStream(self.vip_dir, "command", [])
+        lines = list(command)
+
+        self.assertEqual([("stdout", "first\n"), ("stdout", "no newline")],
+                         [line for line in lines if line[0] == "stdout"])
+        self.assertEqual([("stderr", "error\n")],
+                         [line for line in lines if line[0] == "stderr"])
+        self.assertEqual(3, command.returncode)
+
+    def test_should_split_long_lines(self):
+        command = stream.CommandStream(self.vip_dir, "command", [],
+                                       max_line=4)
+
+        self.assertEqual(["firs", "t\n", "no n", "ewli", "ne"],
+                         [line for name, line in command if name == "stdout"])
+
+    def test_should_raise_VipError_when_command_is_not_found(self):
+        with self.assertRaisesRegexp(core.VipError, "not found"):
+            stream.CommandStream(self.vip_dir, "missing", [])
+
+
+class TestTee(StreamTestCase):
+
+    def test_should_copy_output_to_log(self):
+        stdout, stderr = io.BytesIO(), io.BytesIO()
+
+        code = stream.tee_virtualenv_command(self.vip_dir, "command", [],
+                                             stdout=stdout, stderr=stderr)
+
+        self.assertEqual(3, code)
+        self.assertEqual(b"first\nno newline", stdout.getvalue())
+        self.assertEqual(b"error\n", stderr.getvalue())
+
+        with open(stream.get_log_filename(self.vip_dir, "command")) as f:
+            content = f.read()
+        self.assertEqual(len("first\nno newlineerror\n"), len(content))
+        for line in ["first\n", "no newline", "error\n"]:
+            self.assertIn(line, content)
+
+    def test_should_prefix_lines_with_timestamps(self):
+        stdout = io.BytesIO()
+
+        stream.tee_virtualenv_command(self.vip_dir, "command", [],
+                                      log=False, timestamps=True,
+                                      stdout=stdout, stderr=io.BytesIO())
+
+        lines = stdout.getvalue().decode().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertRegexpMatches(lines[0], r"^\d{4}-\d\d-\d\dT[\d:.]+ first$")
+
+
+class TestRotatingLog(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.filename = path.join(self.root, "logs", "command.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_should_rotate_files(self):
+        log = stream.RotatingLog(self.filename, max_bytes=4, backups=2)
+        for line in [b"aaa\n", b"bbb\n", b"ccc\n", b"ddd\n"]:
+            log.write(line)
+        log.close()
+
+        self.assertEqual(["command.log", "command.log.1", "command.log.2"],
+                         sorted(os.listdir(path.dirname(self.filename))))
+        with open(self.filename) as f:
+            self.assertEqual("ddd\n", f.read())
+        with open(self.filename + ".2") as f:
+            self.assertEqual("bbb\n", f.read())
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from os import path
+
+from .test_helper import mox
+from .test_helper import unittest
+
+from vip import core
+from vip import relocate
+from vip import requirements
+from vip import templates
+
+
+def make_virtualenv(vip_dir):
+    """ Creates a fake virtualenv, with its location embedded in files """
+    site_packages = path.join(vip_dir, "lib", "python2.7", "site-packages")
+    bin_dir = path.join(vip_dir, "bin")
+    os.makedirs(site_packages)
+    os.makedirs(bin_dir)
+
+    files = {
+        path.join(bin_dir, "pip"): "#!%s/bin/python\nimport pip\n" % vip_dir,
+        path.join(bin_dir, "activate"): 'VIRTUAL_ENV="%s"\n' % vip_dir,
+        path.join(site_packages, "project.pth"): "%s/src\n" % vip_dir,
+        path.join(site_packages, "module.py"): "print('%s')\n" % vip_dir,
+    }
+    for filename, content in files.items():
+        with open(filename, "w") as f:
+            f.write(content)
+    os.chmod(path.join(bin_dir, "pip"), 0o755)
+
+    if hasattr(os, "symlink"):
+        os.symlink(path.join(vip_dir, "lib"), path.join(vip_dir, "lib64"))
+
+
+class TemplatesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.template = path.join(self.root, "template")
+        make_virtualenv(self.template)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def read(self, *parts):
+        with open(path.join(*parts)) as f:
+            return f.read()
+
+
+class TestRelocate(TemplatesTestCase):
+
+    def test_should_find_files_to_relocate(self):
+        self.assertEqual([
+            path.join("bin", "activate"),
+            path.join("bin", "pip"),
+            path.join("lib", "python2.7", "site-packages", "project.pth"),
+        ], relocate.find_files_to_relocate(self.template))
+
+    def test_should_relocate_moved_virtualenv(self):
+        moved = path.join(self.root, "moved")
+        os.rename(self.template, moved)
+
+        relocate.relocate(moved, self.template)
+
+        self.assertEqual("#!%s/bin/python\nimport pip\n" % moved,
+                         self.read(moved, "bin", "pip"))
+        self.assertTrue(os.access(path.join(moved, "bin", "pip"), os.X_OK))
+        if hasattr(os, "symlink"):
+            self.assertEqual(path.join(moved, "lib"),
+                             os.readlink(path.join(moved, "lib64")))
+
+
+class TestMaterialize(TemplatesTestCase):
+
+    def test_should_clone_template(self):
+        target = path.join(self.root, "project", ".vip")
+
+        methods = templates.materialize(self.template, target)
+
+        site_packages = path.join(target, "lib", "python2.7", "site-packages")
+        self.assertEqual('VIRTUAL_ENV="%s"\n' % target,
+                         self.read(target, "bin", "activate"))
+        self.assertEqual("%s/src\n" % target,
+                         self.read(site_packages, "project.pth"))
+        # Files that are not scripts are cloned as they are
+        self.assertEqual("print('%s')\n" % self.template,
+                         self.read(site_packages, "module.py"))
+        self.assertEqual(3, methods["copy"])
+
+        # Template stays intact
+        self.assertEqual('VIRTUAL_ENV="%s"\n' % self.template,
+                         self.read(self.template, "bin", "activate"))
+
+    def test_should_fail_when_target_exists(self):
+        with self.assertRaises(OSError):
+            templates.materialize(self.template, self.template)
+
+
+class TestTemplateStore(TemplatesTestCase):
+
+    def setUp(self):
+        super(TestTemplateStore, self).setUp()
+        self.mox = mox.Mox()
+        self.store = templates.TemplateStore(path.join(self.root, "store"))
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        super(TestTemplateStore, self).tearDown()
+
+    def test_should_build_template_with_requirements(self):
+        base = self.store.get_path()
+        relocate.relocate(self.template, self.template, base)
+        os.makedirs(self.store.directory)
+        os.rename(self.template, base)
+
+        plan = requirements.InstallPlan()
+        plan.add_line("nose==1.2")
+
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+        core.execute_virtualenv_command(
+            mox.IgnoreArg(), "pip", ["install", "-r", mox.IgnoreArg()]
+        ).AndReturn(0)
+        self.mox.ReplayAll()
+
+        template = self.store.ensure(plan)
+        self.assertEqual(template, self.store.ensure(plan))
+
+        self.mox.VerifyAll()
+        self.assertEqual(self.store.get_path(plan), template)
+        self.assertEqual('VIRTUAL_ENV="%s"\n' % template,
+                         self.read(template, "bin", "activate"))
+        self.assertEqual(["nose==1.2"],
+                         requirements.load_installed(template)["plan"].lines())
+        self.assertEqual(sorted([path.basename(base),
+                                 path.basename(template)]),
+                         sorted(os.listdir(self.store.directory)))
+
+    def test_should_keep_templates_of_local_requirements_per_project(self):
+        paths = []
+        for name in ("a", "b"):
+            project = path.join(self.root, name)
+            os.mkdir(project)
+            with open(path.join(project, "requirements.txt"), "w") as f:
+                f.write("-e .\nnose==1.2\n")
+            plan = requirements.InstallPlan.from_files(
+                requirements.find_requirements_files(project))
+            paths.append(self.store.get_path(plan, project))
+
+        self.assertNotEqual(paths[0], paths[1])
+
+        plan = requirements.InstallPlan()
+        plan.add_line("nose==1.2")
+        self.assertEqual(self.store.get_path(plan, path.join(self.root, "a")),
+                         self.store.get_path(plan, path.join(self.root, "b")))
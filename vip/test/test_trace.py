@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+
+from os import path
+
+from .test_helper import unittest
+
+from vip import main
+from vip import trace
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        trace.disable()
+
+    def tearDown(self):
+        trace.disable()
+        shutil.rmtree(self.root)
+
+    def test_should_do_nothing_when_disabled(self):
+        self.assertIs(trace._NO_SPAN, trace.span("phase"))
+        with trace.span("phase"):
+            pass
+        trace.flush()
+
+        self.assertFalse(trace.is_enabled())
+
+    def test_should_write_json_record(self):
+        filename = path.join(self.root, "trace.json")
+        trace.enable(filename, "json")
+
+        with trace.span("phase", directory="value"):
+            pass
+        trace.flush()
+
+        with open(filename) as f:
+            data = json.load(f)
+        self.assertEqual(["import", "phase"],
+                         [phase["name"] for phase in data["phases"]])
+        self.assertEqual({"directory": "value"}, data["phases"][1]["args"])
+        self.assertEqual(os.getpid(), data["pid"])
+        self.assertGreaterEqual(data["total"], data["phases"][1]["duration"])
+
+    def test_should_write_chrome_trace_events(self):
+        filename = path.join(self.root, "trace.json")
+        trace.enable(filename, "chrome")
+
+        with trace.span("phase"):
+            pass
+        trace.flush()
+
+        with open(filename) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertEqual(["import", "phase"], [e["name"] for e in events])
+        self.assertEqual(set(["X"]), set(e["ph"] for e in events))
+        self.assertTrue(all(isinstance(e["ts"], int) for e in events))
+
+    def test_should_reject_unknown_format(self):
+        self.assertRaises(ValueError, trace.enable, None, "xml")
+
+    def test_should_record_decorated_function(self):
+        @trace.traced("decorated")
+        def function(value):
+            """ Docstring. """
+            return value * 2
+
+        self.assertEqual(4, function(2))
+
+        reported = []
+        trace.enable(output=False, report=lambda *args: reported.append(args))
+        self.assertEqual(6, function(3))
+
+        self.assertEqual(["import", "decorated"],
+                         [name for name, _ in reported])
+        self.assertEqual("function", function.__name__)
+        self.assertEqual(" Docstring. ", function.__doc__)
+
+    def test_should_report_phases_without_output(self):
+        reported = []
+        trace.enable_reporting(lambda *args: reported.append(args))
+
+        with trace.span("phase"):
+            pass
+        trace.flush()
+
+        self.assertTrue(trace.is_enabled())
+        self.assertEqual(["import", "phase"], [name for name, _ in reported])
+
+    def test_should_enable_from_environment(self):
+        self.assertIsNone(trace.enable_from_environment({}))
+        self.assertIsNone(trace.enable_from_environment({"VIP_TRACE": "0"}))
+
+        self.assertIsNone(
+            trace.enable_from_environment({"VIP_TRACE": "1"}).filename)
+        self.assertEqual("trace.json", trace.enable_from_environment(
+            {"VIP_TRACE": "trace.json"}).filename)
+
+
+class TestSplitTraceOptions(unittest.TestCase):
+
+    def test_should_remove_leading_options(self):
+        self.assertEqual(
+            (["python", "--trace"], {"trace": True, "format": "chrome"}),
+            main.split_trace_options(["--trace", "--trace-format=chrome",
+                                      "python", "--trace"]))
+        self.assertEqual(
+            (["-v", "--init"], {"trace": "out.json"}),
+            main.split_trace_options(["-v", "--trace=out.json", "--init"]))
+
+    def test_should_stop_at_double_dash(self):
+        self.assertEqual(
+            (["-v", "--", "--trace", "x"], {"trace": True}),
+            main.split_trace_options(["--trace", "-v", "--", "--trace", "x"]))
+
+    def test_should_leave_arguments_without_options(self):
+        self.assertEqual((["pip", "install"], {}),
+                         main.split_trace_options(["pip", "install"]))
+        self.assertEqual(([], {}), main.split_trace_options([]))
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from os import path
+
+from .test_helper import mox
+from .test_helper import unittest
+
+from vip import core
+from vip import watch
+
+
+class TestGetWatchedFilenames(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_should_include_missing_and_included_files(self):
+        with open(path.join(self.root, "requirements.txt"), "w") as f:
+            f.write("-r shared/base.txt\n")
+        os.mkdir(path.join(self.root, "shared"))
+        with open(path.join(self.root, "shared", "base.txt"), "w") as f:
+            f.write("# nothing yet\n")
+
+        filenames = watch.get_watched_filenames(self.root, "devel", (2, 7))
+
+        for name in ["requirements.txt", "requirements-27.txt",
+                     "requirements-27.lock", "devel-requirements.txt",
+                     "devel-requirements-27.lock",
+                     path.join("shared", "base.txt")]:
+            self.assertIn(path.join(self.root, name), filenames)
+        self.assertNotIn(path.join(self.root, "requirements-33.txt"),
+                         filenames)
+
+
+class ObserverTestMixin(object):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.filename = path.join(self.root, "requirements.txt")
+        self.observer = self.create_observer()
+        self.observer.watch([self.filename])
+
+    def tearDown(self):
+        self.observer.close()
+        shutil.rmtree(self.root)
+
+    def write(self, filename, content):
+        # Modification times of some filesystems have a one second
+        # resolution, so polling needs a new size
+        with open(filename, "w") as f:
+            f.write(content)
+
+    def test_should_notice_created_file(self):
+        self.assertFalse(self.observer.wait(0))
+
+        self.write(self.filename, "six\n")
+
+        self.assertTrue(self.observer.wait(2))
+        while self.observer.wait(0.1):
+            pass
+
+        self.write(path.join(self.root, "other.txt"), "six\n")
+        self.assertFalse(self.observer.wait(0.3))
+
+    def test_should_notice_removed_file(self):
+        self.write(self.filename, "six\n")
+        self.observer.watch([self.filename])
+
+        os.remove(self.filename)
+
+        self.assertTrue(self.observer.wait(2))
+
+
+class TestPollingObserver(ObserverTestMixin, unittest.TestCase):
+
+    def create_observer(self):
+        return watch.PollingObserver(interval=0.05)
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "requires inotify")
+class TestInotifyObserver(ObserverTestMixin, unittest.TestCase):
+
+    def create_observer(self):
+        return watch.InotifyObserver()
+
+
+class FakeObserver(object):
+    """ Reports given changes, starting every burst of them when the
+    watcher is idle, then stops the watcher once it is idle again. Waiting
+    for the watcher ends after a deadline, so a failure cannot hang.
+    """
+
+    def __init__(self, changes, deadline=10):
+        self.changes = list(changes)
+        self.deadline = time.time() + deadline
+        self.stop = threading.Event()
+        self.watcher = None
+        self.watched = 0
+        self.in_burst = False
+
+    def watch(self, filenames):
+        self.watched += 1
+
+    def wait_for_idle_watcher(self):
+        while not self.watcher.is_idle() and time.time() < self.deadline:
+            time.sleep(0.01)
+
+    def wait(self, timeout):
+        if not self.changes:
+            self.wait_for_idle_watcher()
+            self.stop.set()
+            return False
+
+        if not self.in_burst:
+            self.wait_for_idle_watcher()
+        changed = self.changes.pop(0)
+        self.in_burst = changed
+        return changed
+
+    def close(self):
+        pass
+
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.mox = mox.Mox()
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.vip_dir = path.join(self.root, ".vip")
+        os.mkdir(self.vip_dir)
+        self.installs = []
+
+        self.mox.StubOutWithMock(core, "install_requirements_files")
+        core.install_requirements_files = self.install_requirements_files
+        self.mox.StubOutWithMock(core, "logger", use_mock_anything=True)
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        shutil.rmtree(self.root)
+
+    def install_requirements_files(self, vip_directory, directory, **kwargs):
+        self.installs.append((vip_directory, directory, kwargs))
+        if len(self.installs) == 1:
+            raise OSError("cannot write install-plan.txt")
+        if len(self.installs) == 2:
+            raise core.VipError("no such package")
+
+    def test_should_sync_after_changes_settle(self):
+        # A change reported in three bursts, then another one
+        observer = FakeObserver([True, True, True, False, True, False])
+        watcher = watch.Watcher(self.vip_dir, prefix="devel",
+                                observer=observer)
+        observer.watcher = watcher
+
+        watcher.run(observer.stop, timeout=0.01)
+
+        # The first sync and one after every burst
+        self.assertEqual(3, watcher.syncs)
+        self.assertEqual(3, len(self.installs))
+        self.assertEqual(3, observer.watched)
+        self.assertEqual((self.vip_dir, self.root, {
+            "prefix": "devel", "wheel_cache": None, "uninstall": True}),
+            self.installs[0])
+
+    def test_should_survive_failed_sync(self):
+        watcher = watch.Watcher(self.vip_dir,
+                                observer=watch.PollingObserver())
+
+        watcher.sync()
+        watcher.sync()
+        watcher.sync()
+
+        self.assertEqual(3, watcher.syncs)
+        self.assertEqual(3, len(self.installs))
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from os import path
+
+from .test_helper import mox
+from .test_helper import unittest
+
+from vip import core
+from vip import requirements
+from vip import wheels
+
+
+class WheelhouseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.wheelhouse = wheels.Wheelhouse(path.join(self.root, "wheels"),
+                                            max_size=100)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def add_wheel(self, name, size=10, mtime=None, tag="py27"):
+        filename = path.join(self.wheelhouse.get_directory(tag), name)
+        with open(filename, "wb") as f:
+            f.write(b"x" * size)
+        if mtime is not None:
+            os.utime(filename, (mtime, mtime))
+        return filename
+
+
+class TestWheelhouse(WheelhouseTestCase):
+
+    def test_parse_wheel_filename(self):
+        self.assertEqual(("foo-bar", "1.0"), wheels.parse_wheel_filename(
+            "/tmp/Foo_Bar-1.0-py2.py3-none-any.whl"))
+        self.assertIsNone(wheels.parse_wheel_filename("foo-1.0.tar.gz"))
+
+    def test_should_be_satisfiable_with_pinned_requirements(self):
+        self.add_wheel("nose-1.2-py2-none-any.whl")
+        self.add_wheel("Mox-0.5-py2-none-any.whl")
+
+        plan = requirements.InstallPlan()
+        plan.add_line("nose==1.2")
+        plan.add_line("mox==0.5")
+        self.assertTrue(self.wheelhouse.is_satisfiable("py27", plan))
+
+        plan.add_line("requests")
+        self.assertFalse(self.wheelhouse.is_satisfiable("py27", plan))
+
+    def test_should_not_be_satisfiable_with_other_versions(self):
+        self.add_wheel("nose-1.2-py2-none-any.whl")
+
+        plan = requirements.InstallPlan()
+        plan.add_line("nose==1.3")
+        self.assertFalse(self.wheelhouse.is_satisfiable("py27", plan))
+        self.assertFalse(self.wheelhouse.is_satisfiable("py33", plan))
+
+    def test_prune_should_remove_least_recently_used_wheels(self):
+        old = self.add_wheel("a-1.0-py2-none-any.whl", 50, mtime=1000)
+        self.add_wheel("b-1.0-py2-none-any.whl", 50, mtime=3000)
+        self.add_wheel("c-1.0-py3-none-any.whl", 50, mtime=2000,
+                       tag="py33")
+
+        self.assertEqual([old], self.wheelhouse.prune())
+
+        stats = self.wheelhouse.stats()
+        self.assertEqual(2, stats["count"])
+        self.assertEqual(100, stats["size"])
+        self.assertEqual({"py27": (1, 50), "py33": (1, 50)}, stats["tags"])
+
+    @unittest.skipIf(core.is_win, "requires shared locks")
+    def test_prune_should_wait_for_installs(self):
+        self.add_wheel("a-1.0-py2-none-any.whl", 200)
+
+        with self.wheelhouse.lock(shared=True):
+            # Other installs can go on
+            with self.wheelhouse.lock(shared=True):
+                pass
+
+            os.environ["VIP_LOCK_TIMEOUT"] = "0.1"
+            try:
+                with self.assertRaisesRegexp(core.VipError, "timed out"):
+                    self.wheelhouse.prune()
+            finally:
+                del os.environ["VIP_LOCK_TIMEOUT"]
+
+        self.assertEqual(1, len(self.wheelhouse.prune()))
+
+    def test_get_max_size(self):
+        self.assertEqual(wheels.DEFAULT_MAX_SIZE * 1024 * 1024,
+                         wheels.get_max_size({}))
+        self.assertEqual(512 * 1024 * 1024, wheels.get_max_size(
+            {"VIP_WHEEL_CACHE_SIZE": "512"}))
+        with self.assertRaisesRegexp(core.VipError,
+                                     "invalid VIP_WHEEL_CACHE_SIZE: 1G"):
+            wheels.get_max_size({"VIP_WHEEL_CACHE_SIZE": "1G"})
+
+
+class TestWheelhouseInstall(WheelhouseTestCase):
+
+    def setUp(self):
+        super(TestWheelhouseInstall, self).setUp()
+        self.mox = mox.Mox()
+        self.mox.StubOutWithMock(core, "execute_virtualenv_command")
+
+        self.vip_dir = path.join(self.root, ".vip")
+        os.makedirs(path.join(self.vip_dir, "lib", "python2.7",
+                              "site-packages"))
+        self.wheel_dir = self.wheelhouse.get_directory("py27")
+
+        self.requirements = path.join(self.root, "requirements.txt")
+        with open(self.requirements, "w") as f:
+            f.write("nose==1.2\n")
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        super(TestWheelhouseInstall, self).tearDown()
+
+    def test_should_build_missing_wheels(self):
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip",
+            ["wheel", "--find-links", self.wheel_dir,
+             "--wheel-dir", self.wheel_dir, "-r", self.requirements]
+        ).AndReturn(0)
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip",
+            ["install", "--no-index", "--find-links", self.wheel_dir,
+             "-r", self.requirements]
+        ).AndReturn(0)
+        self.mox.ReplayAll()
+
+        self.assertEqual(0, self.wheelhouse.install(self.vip_dir,
+                                                    self.requirements))
+        self.mox.VerifyAll()
+
+    def test_should_install_from_cache_only(self):
+        wheel = self.add_wheel("nose-1.2-py2-none-any.whl", mtime=1000)
+        os.mkdir(path.join(self.vip_dir, "lib", "python2.7",
+                           "site-packages", "nose-1.2.dist-info"))
+
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip",
+            ["install", "--no-index", "--find-links", self.wheel_dir,
+             "-r", self.requirements]
+        ).AndReturn(0)
+        self.mox.ReplayAll()
+
+        self.assertEqual(0, self.wheelhouse.install(self.vip_dir,
+                                                    self.requirements))
+        self.mox.VerifyAll()
+        self.assertGreater(path.getmtime(wheel), 1000)
+
+    def test_should_build_pruned_dependencies(self):
+        self.add_wheel("nose-1.2-py2-none-any.whl")
+        install = ["install", "--no-index", "--find-links", self.wheel_dir,
+                   "-r", self.requirements]
+
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip", install).AndReturn(1)
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip",
+            ["wheel", "--find-links", self.wheel_dir,
+             "--wheel-dir", self.wheel_dir, "-r", self.requirements]
+        ).AndReturn(0)
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip", install).AndReturn(0)
+        self.mox.ReplayAll()
+
+        self.assertEqual(0, self.wheelhouse.install(self.vip_dir,
+                                                    self.requirements))
+        self.mox.VerifyAll()
+
+    @unittest.skipIf(core.is_win, "requires shared locks")
+    def test_should_not_wait_for_other_installs_to_prune(self):
+        wheel = self.add_wheel("a-1.0-py2-none-any.whl", 200)
+        core.execute_virtualenv_command(
+            self.vip_dir, "pip", mox.IgnoreArg()).MultipleTimes().AndReturn(0)
+        self.mox.ReplayAll()
+
+        with self.wheelhouse.lock(shared=True):
+            self.assertEqual(0, self.wheelhouse.install(self.vip_dir,
+                                                        self.requirements))
+
+        self.assertTrue(path.exists(wheel))
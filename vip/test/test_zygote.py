@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from os import path
+
+from .test_helper import unittest
+
+from vip import core
+from vip import zygote
+
+
+SCRIPT = """
+import os
+import sys
+
+sys.stdout.write("%s %s %s %s\\n" % (sys.argv[1:], os.getcwd(),
+                                     os.environ.get("ZYGOTE_TEST"),
+                                     "colorsys" in sys.modules))
+sys.exit(int(sys.argv[1]))
+"""
+
+
+class TestCanServe(unittest.TestCase):
+
+    def test_should_accept_scripts_and_modules(self):
+        self.assertTrue(zygote.can_serve("python", ["script.py", "-v"]))
+        self.assertTrue(zygote.can_serve("python", ["-c", "pass"]))
+        self.assertTrue(zygote.can_serve("python", ["-m", "json.tool"]))
+
+    def test_should_reject_other_commands(self):
+        self.assertFalse(zygote.can_serve("python", []))
+        self.assertFalse(zygote.can_serve("python", ["-u", "script.py"]))
+        self.assertFalse(zygote.can_serve("python", ["-m"]))
+        self.assertFalse(zygote.can_serve("pip", ["install"]))
+
+
+@unittest.skipUnless(not core.is_win and zygote.is_supported(),
+                     "requires Unix sockets with descriptor passing")
+class TestZygote(unittest.TestCase):
+
+    def setUp(self):
+        self.root = path.realpath(tempfile.mkdtemp())
+        self.socket_path = path.join(self.root, zygote.SOCKET_FILENAME)
+        self.script = path.join(self.root, "script.py")
+        with open(self.script, "w") as f:
+            f.write(SCRIPT)
+
+        self.server = subprocess.Popen(
+            [sys.executable, zygote.__file__.replace(".pyc", ".py"),
+             "--socket", self.socket_path, "--preload", "colorsys"],
+            stderr=subprocess.PIPE)
+
+        deadline = time.time() + 10
+        while not path.exists(self.socket_path):
+            self.assertIsNone(self.server.poll())
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            self.server.send_signal(signal.SIGTERM)
+        self.server.wait()
+        self.server.stderr.close()
+        shutil.rmtree(self.root)
+
+    def request(self, args):
+        with tempfile.TemporaryFile() as output:
+            with open(os.devnull) as stdin:
+                code = zygote.request(
+                    self.socket_path, args, {"ZYGOTE_TEST": "yes"},
+                    self.root, fds=(stdin.fileno(), output.fileno(),
+                                    output.fileno()))
+            output.seek(0)
+            return code, output.read().decode()
+
+    def test_should_run_script_in_forked_process(self):
+        code, output = self.request([self.script, "3", "arg"])
+
+        self.assertEqual(3, code)
+        self.assertEqual("['3', 'arg'] %s yes True\n" % self.root, output)
+
+    def test_should_run_code_and_report_errors(self):
+        code, output = self.request(["-c", "import sys; print(sys.argv); "
+                                     "raise ValueError('boom')", "a"])
+
+        self.assertEqual(1, code)
+        self.assertIn("['-c', 'a']", output)
+        self.assertIn("ValueError: boom", output)
+
+    def test_should_remove_socket_on_exit(self):
+        self.server.send_signal(signal.SIGTERM)
+        self.server.wait()
+
+        self.assertFalse(path.exists(self.socket_path))
+        self.assertIsNone(self.request(["-c", "pass"])[0])
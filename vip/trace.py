@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timing of vip phases, like discovery, executable resolution or pip runs.
+
+Tracing is enabled with `--trace[=file]` or `VIP_TRACE` environment
+variable and writes either a JSON record of phases, or a Chrome trace-event
+file (`--trace-format=chrome` or `VIP_TRACE_FORMAT=chrome`), which can be
+opened in chrome://tracing or Perfetto. Without a file, the record goes to
+standard error.
+
+When tracing is disabled, `span` returns a shared object with empty methods,
+so instrumented code pays for a single function call. This module is
+imported on the `vip command ...` path, so it imports nothing heavy until
+the trace is written.
+"""
+
+import os
+import sys
+import time
+
+clock = getattr(time, "monotonic", time.time)
+
+FORMATS = ("json", "chrome")
+
+# The trace starts when vip is imported
+_loaded = clock()
+
+_tracer = None
+
+
+class _NoSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span(object):
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.add(self.name, self.started, clock() - self.started,
+                        self.args)
+        return False
+
+
+class Tracer(object):
+    """ Collects phases as (name, start, duration, args) tuples, with times
+    in seconds since vip has been imported.
+
+    Args:
+        filename: str, where to write the trace, standard error when None
+        format: str, one of FORMATS
+        report: a function called with name and duration of every phase
+        output: bool, whether to write the trace at all
+    """
+
+    def __init__(self, filename=None, format="json", report=None,
+                 output=True):
+        self.filename = filename
+        self.format = format
+        self.report = report
+        self.output = output
+        self.events = []
+        self.written = False
+
+    def span(self, name, args):
+        return _Span(self, name, args)
+
+    def add(self, name, started, duration, args=None):
+        self.events.append((name, started - _loaded, duration, args or {}))
+        if self.report is not None:
+            self.report(name, duration)
+
+    def to_json(self):
+        return {
+            "argv": sys.argv,
+            "pid": os.getpid(),
+            "total": clock() - _loaded,
+            "phases": [{"name": name, "start": start, "duration": duration,
+                        "args": args}
+                       for name, start, duration, args in self.events],
+        }
+
+    def to_chrome(self):
+        pid = os.getpid()
+        return {
+            "displayTimeUnit": "ms",
+            "traceEvents": [{
+                "name": name, "cat": "vip", "ph": "X", "pid": pid, "tid": 0,
+                "ts": int(start * 1e6), "dur": int(duration * 1e6),
+                "args": args,
+            } for name, start, duration, args in self.events],
+        }
+
+    def write(self):
+        """ Writes the trace, only once. """
+        if self.written or not self.output:
+            return
+        self.written = True
+
+        import json
+
+        data = self.to_chrome() if self.format == "chrome" else \
+            self.to_json()
+        content = json.dumps(data, indent=2, sort_keys=True) + "\n"
+
+        if self.filename is None:
+            sys.stderr.write(content)
+            sys.stderr.flush()
+        else:
+            with open(self.filename, "w") as f:
+                f.write(content)
+
+
+def enable(filename=None, format=None, report=None, output=True):
+    """ Starts tracing, the time since vip has been imported is recorded as
+    `import` phase. See `Tracer` for arguments.
+
+    Raises:
+        ValueError: when format is not known
+    """
+    global _tracer
+
+    format = format or os.environ.get("VIP_TRACE_FORMAT") or "json"
+    if format not in FORMATS:
+        raise ValueError("unknown trace format: %s (choose from %s)" % (
+            format, ", ".join(FORMATS)))
+
+    _tracer = Tracer(filename, format, report, output)
+    _tracer.add("import", _loaded, clock() - _loaded)
+    return _tracer
+
+
+def enable_from_environment(environ=None):
+    """ Starts tracing when `VIP_TRACE` is set: to "1" for standard error,
+    or to a file name.
+    """
+    environ = os.environ if environ is None else environ
+    value = environ.get("VIP_TRACE")
+    if value and value != "0":
+        return enable(None if value in ("1", "-") else value)
+    return None
+
+
+def enable_reporting(report):
+    """ Passes name and duration of every following phase to report,
+    starting tracing without output when it is disabled.
+    """
+    if _tracer is None:
+        enable(report=report, output=False)
+    else:
+        _tracer.report = report
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def span(name, **args):
+    """ Returns a context manager, which records duration of the block as a
+    phase when tracing is enabled.
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, args)
+
+
+def flush():
+    """ Writes the trace, if enabled. Called before vip replaces itself with
+    a command and when it exits.
+    """
+    if _tracer is not None:
+        _tracer.write()
+
+
+def traced(name):
+    """ A decorator recording calls of a function as name phase. """
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.span(name, {}):
+                return function(*args, **kwargs)
+
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__module__ = function.__module__
+        return wrapper
+    return decorator
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+"""
+Keeping a virtualenv in sync with requirements files as they change.
+
+`vip --watch [prefix]` watches every requirements file and lockfile that
+`--sync` would consider (see `core.get_requirements_filenames`), whether it
+exists or not, and files they include with `-r`. After a change, it waits
+until files stop changing for a moment, and syncs the virtualenv in a
+background thread: `core.install_requirements_files` installs only what has
+changed since the last install and uninstalls what has been removed.
+Changes made during a sync trigger another one after it.
+
+Files are watched with inotify on Linux, and by polling their modification
+times elsewhere.
+"""
+
+import os
+import sys
+import threading
+import time
+
+from vip import core
+
+
+# Seconds without changes, after which the virtualenv is synced
+DEFAULT_DEBOUNCE = 0.5
+
+POLL_INTERVAL = 1.0
+
+
+def get_watched_filenames(directory, prefix=None, version=None):
+    """ Returns absolute paths of requirements files and lockfiles for a
+    prefix and an interpreter version, existing or not, and files included
+    by existing ones.
+    """
+    from vip import lockfile
+    from vip import requirements
+
+    names = list(core.get_requirements_filenames(prefix, version)) + \
+        list(core.get_requirements_filenames(
+            prefix, version, extension=lockfile.LOCK_EXTENSION))
+    filenames = set(os.path.abspath(os.path.join(directory, name))
+                    for name in names)
+
+    for filename in requirements.find_requirements_files(directory, prefix,
+                                                         version):
+        included = set()
+        try:
+            for _ in requirements.iter_requirement_lines(filename, included):
+                pass
+        except core.VipError:
+            pass
+        filenames.update(included)
+
+    return sorted(filenames)
+
+
+def get_state(filenames):
+    """ Returns modification times and sizes of files, None for missing
+    ones.
+    """
+    state = {}
+    for filename in filenames:
+        try:
+            st = os.stat(filename)
+            state[filename] = (st.st_mtime, st.st_size)
+        except OSError:
+            state[filename] = None
+    return state
+
+
+class PollingObserver(object):
+    """ Notices changes of files by comparing their modification times. """
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self._state = {}
+
+    def watch(self, filenames):
+        self._state = get_state(filenames)
+
+    def wait(self, timeout):
+        """ Waits up to timeout seconds for a change of watched files.
+
+        Returns:
+            bool, whether a file has changed
+        """
+        deadline = time.time() + timeout
+        while True:
+            state = get_state(self._state)
+            if state != self._state:
+                self._state = state
+                return True
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+class InotifyObserver(object):
+    """ Notices changes of files with inotify, watching their directories,
+    so files can also be created, removed or replaced.
+
+    Raises:
+        OSError: when inotify is not available
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | \
+        IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or
+                                 "libc.so.6", use_errno=True)
+        fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+        self._fd = fd
+        self._directories = {}
+        self._filenames = set()
+
+    def watch(self, filenames):
+        import ctypes
+
+        for wd in self._directories:
+            self._libc.inotify_rm_watch(self._fd, wd)
+        self._directories = {}
+        self._filenames = set(filenames)
+
+        encoding = sys.getfilesystemencoding() or "utf-8"
+        for directory in set(os.path.dirname(f) for f in filenames):
+            path = directory.encode(encoding) \
+                if not isinstance(directory, bytes) else directory
+            wd = self._libc.inotify_add_watch(self._fd, ctypes.c_char_p(path),
+                                              self.MASK)
+            if wd >= 0:
+                self._directories[wd] = directory
+            else:
+                core.logger.debug("cannot watch %s: %s" % (
+                    directory, os.strerror(ctypes.get_errno())))
+
+    def _read_events(self):
+        """ Yields paths of files with pending events. """
+        import errno
+        import struct
+
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+
+        encoding = sys.getfilesystemencoding() or "utf-8"
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from("iIII", data,
+                                                          offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+            offset += 16 + length
+            if wd in self._directories and name:
+                yield os.path.join(self._directories[wd],
+                                   name.decode(encoding, "replace"))
+
+    def wait(self, timeout):
+        """ Waits up to timeout seconds for a change of watched files.
+
+        Returns:
+            bool, whether a file has changed
+        """
+        import select
+
+        deadline = time.time() + timeout
+        while True:
+            remaining = max(0, deadline - time.time())
+            readable = select.select([self._fd], [], [], remaining)[0]
+            if not readable:
+                return False
+            if any(path in self._filenames for path in self._read_events()):
+                return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def create_observer():
+    """ Returns an InotifyObserver on Linux, a PollingObserver elsewhere or
+    when inotify is not available.
+    """
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyObserver()
+        except (OSError, AttributeError) as e:
+            core.logger.debug("inotify is not available: %s" % e)
+    return PollingObserver()
+
+
+class Watcher(object):
+    """ Syncs a virtualenv with requirements files whenever they change.
+
+    Args:
+        vip_directory: str, a path to virtualenv
+        directory: str, where requirements files are, by default the
+            directory containing vip_directory
+        prefix: str, see `core.install_requirements_files`
+        wheel_cache: bool, see `core.install_requirements_files`
+        debounce: float, seconds without changes before a sync
+        observer: an object watching files, see `create_observer`
+    """
+
+    def __init__(self, vip_directory, directory=None, prefix=None,
+                 wheel_cache=None, debounce=DEFAULT_DEBOUNCE, observer=None):
+        if directory is None:
+            directory = core.get_project_directory(vip_directory)
+        self.vip_directory = vip_directory
+        self.directory = directory
+        self.prefix = prefix
+        self.wheel_cache = wheel_cache
+        self.debounce = debounce
+        self.observer = create_observer() if observer is None else observer
+        self.syncs = 0
+
+        self._pending = threading.Event()
+        self._syncing = False
+        self._stopping = False
+
+    def is_idle(self):
+        """ Tells whether no sync is running or requested. """
+        return not self._syncing and not self._pending.is_set()
+
+    def get_filenames(self):
+        return get_watched_filenames(
+            self.directory, self.prefix,
+            core.get_virtualenv_python_version(self.vip_directory))
+
+    def sync(self):
+        """ Installs and uninstalls packages, so the virtualenv matches
+        requirements files. Errors are logged, so watching goes on.
+        """
+        try:
+            with core.lock_virtualenv(self.vip_directory):
+                core.install_requirements_files(
+                    self.vip_directory, self.directory, prefix=self.prefix,
+                    wheel_cache=self.wheel_cache, uninstall=True)
+        except core.VipError as e:
+            core.logger.error("sync failed: %s" % e)
+        except Exception as e:
+            # The worker thread has to survive, or nothing is synced again
+            core.logger.exception("sync failed: %s" % e)
+        self.syncs += 1
+
+    def _work(self):
+        while True:
+            self._pending.wait()
+            if self._stopping:
+                return
+            self._syncing = True
+            self._pending.clear()
+            try:
+                self.sync()
+            finally:
+                self._syncing = False
+
+    def run(self, stop=None, timeout=POLL_INTERVAL):
+        """ Syncs the virtualenv, and then again after every change, until
+        stop event is set or KeyboardInterrupt.
+
+        Args:
+            stop: a threading.Event
+            timeout: float, how often to check for stop
+        """
+        worker = threading.Thread(target=self._work)
+        worker.daemon = True
+        worker.start()
+
+        self._pending.set()
+        self.observer.watch(self.get_filenames())
+        core.logger.info("Watching requirements files in %s" %
+                         self.directory)
+
+        try:
+            while stop is None or not stop.is_set():
+                if not self.observer.wait(timeout):
+                    continue
+
+                # Files are often written in several steps
+                while self.observer.wait(self.debounce):
+                    pass
+
+                core.logger.info("Requirements files have changed")
+                self._pending.set()
+                self.observer.watch(self.get_filenames())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stopping = True
+            self._pending.set()
+            worker.join()
+            self.observer.close()
+
+
+def watch(vip_directory, prefix=None, wheel_cache=None):
+    """ Syncs a virtualenv with requirements files until interrupted, see
+    `Watcher`.
+    """
+    Watcher(vip_directory, prefix=prefix, wheel_cache=wheel_cache).run()
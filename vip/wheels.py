@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+
+"""
+Host-wide cache of wheels shared by all virtualenvs.
+
+Wheels are kept in a per-user cache directory, in a subdirectory for every
+interpreter version, e.g. `~/.cache/vip/wheels/py27`. Packages are built
+into the cache with `pip wheel` and installed from it without consulting
+the package index, so that subsequent installs of the same requirements are
+mostly local file copies. Modification time of a wheel marks its last use
+and the least recently used wheels are removed when the cache grows over
+its size limit.
+"""
+
+import os
+import re
+
+from vip import core
+from vip import requirements
+
+
+WHEELS_DIRECTORY = "wheels"
+
+# A file in the cache directory locked while wheels are used or pruned
+LOCK_FILENAME = ".lock"
+
+# Size limit in megabytes, can be overridden with VIP_WHEEL_CACHE_SIZE
+DEFAULT_MAX_SIZE = 1024
+
+_pin_re = re.compile(r"^==(?P<version>[^,*]+)$")
+
+
+def is_enabled(wheel_cache=None):
+    """ Tells if the cache should be used, consulting VIP_WHEEL_CACHE
+    environment variable when wheel_cache is None.
+    """
+    if wheel_cache is None:
+        return os.environ.get("VIP_WHEEL_CACHE", "") not in ("", "0")
+    return bool(wheel_cache)
+
+
+def get_tag(vip_directory):
+    """ Returns a name of the cache subdirectory for the interpreter in
+    vip_directory, like `py27`.
+    """
+    return "py%d%d" % core.get_virtualenv_python_version(vip_directory)
+
+
+def parse_wheel_filename(filename):
+    """ Splits a wheel filename into a normalized project name and version.
+
+    Returns:
+        a (name, version) tuple, or None when filename is not a wheel
+    """
+    filename = os.path.basename(filename)
+    if not filename.endswith(".whl"):
+        return None
+
+    parts = filename[:-len(".whl")].split("-")
+    if len(parts) not in (5, 6):
+        return None
+
+    return requirements.normalize_name(parts[0]), parts[1]
+
+
+def _installed_projects(vip_directory):
+    """ Returns (name, version) pairs of distributions installed in
+    vip_directory, based on names of their metadata directories.
+    """
+    projects = set()
+    site_packages = core.get_site_packages(vip_directory)
+
+    try:
+        entries = os.listdir(site_packages)
+    except OSError:
+        return projects
+
+    for entry in entries:
+        base, ext = os.path.splitext(entry)
+        if ext in (".dist-info", ".egg-info"):
+            parts = base.split("-")
+            if len(parts) >= 2:
+                projects.add((requirements.normalize_name(parts[0]),
+                              parts[1]))
+    return projects
+
+
+def get_max_size(environ=None):
+    """ Returns the size limit of the cache in bytes, `VIP_WHEEL_CACHE_SIZE`
+    environment variable in megabytes or `DEFAULT_MAX_SIZE`.
+
+    Raises:
+        VipError: when the variable is not a number
+    """
+    environ = os.environ if environ is None else environ
+    value = environ.get("VIP_WHEEL_CACHE_SIZE")
+    if not value:
+        return DEFAULT_MAX_SIZE * 1024 * 1024
+    try:
+        return int(float(value) * 1024 * 1024)
+    except ValueError:
+        raise core.VipError("invalid VIP_WHEEL_CACHE_SIZE: %s" % value)
+
+
+class Wheelhouse(object):
+    """ A directory with wheels, shared by virtualenvs on the host. """
+
+    def __init__(self, directory=None, max_size=None):
+        if directory is None:
+            directory = os.path.join(core.get_cache_directory(),
+                                     WHEELS_DIRECTORY)
+
+        if max_size is None:
+            max_size = get_max_size()
+
+        self.directory = directory
+        self.max_size = max_size
+
+    def get_directory(self, tag):
+        directory = os.path.join(self.directory, tag)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return directory
+
+    def iter_wheels(self):
+        """ Yields (tag, path) pairs of all cached wheels. """
+        if not os.path.isdir(self.directory):
+            return
+
+        for tag in sorted(os.listdir(self.directory)):
+            directory = os.path.join(self.directory, tag)
+            if not os.path.isdir(directory):
+                continue
+
+            for name in sorted(os.listdir(directory)):
+                if parse_wheel_filename(name) is not None:
+                    yield tag, os.path.join(directory, name)
+
+    def find(self, tag, name, version=None):
+        """ Returns paths of cached wheels of a project. """
+        name = requirements.normalize_name(name)
+        directory = os.path.join(self.directory, tag)
+        if not os.path.isdir(directory):
+            return []
+
+        found = []
+        for filename in sorted(os.listdir(directory)):
+            parsed = parse_wheel_filename(filename)
+            if parsed and parsed[0] == name and \
+                    version in (None, parsed[1]):
+                found.append(os.path.join(directory, filename))
+        return found
+
+    def is_satisfiable(self, tag, plan):
+        """ Tells if all requirements from an install plan are pinned to
+        versions available in the cache, so the index is not needed.
+        """
+        for requirement in plan.requirements:
+            if not isinstance(requirement, requirements.Requirement):
+                return False
+
+            match = [_pin_re.match(s) for s in requirement.specs]
+            versions = [m.group("version") for m in match if m]
+            if len(versions) != 1 or \
+                    not self.find(tag, requirement.name, versions[0]):
+                return False
+
+        return True
+
+    def touch(self, tag, projects):
+        """ Marks wheels of (name, version) projects as recently used. """
+        for name, version in projects:
+            for filename in self.find(tag, name, version):
+                try:
+                    os.utime(filename, None)
+                except OSError:
+                    pass
+
+    def stats(self):
+        """ Returns a dict with number and size of wheels per tag. """
+        tags = {}
+        for tag, filename in self.iter_wheels():
+            count, size = tags.get(tag, (0, 0))
+            tags[tag] = (count + 1, size + os.path.getsize(filename))
+
+        return {
+            "directory": self.directory,
+            "max_size": self.max_size,
+            "tags": tags,
+            "count": sum(count for count, _ in tags.values()),
+            "size": sum(size for _, size in tags.values()),
+        }
+
+    def lock(self, shared=False, timeout=None):
+        """ Returns a lock of the cache. Installs hold it shared, so wheels
+        they use are not pruned meanwhile, and pruning holds it exclusively.
+        See `locking.FileLock` for timeout.
+        """
+        from vip import locking
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        return locking.FileLock(os.path.join(self.directory, LOCK_FILENAME),
+                                timeout=timeout, shared=shared)
+
+    def prune(self, max_size=None):
+        """ Removes the least recently used wheels until the cache fits in
+        max_size bytes.
+
+        Returns:
+            a list of removed files
+        """
+        with self.lock():
+            return self._prune(self.max_size if max_size is None
+                               else max_size)
+
+    def _prune(self, max_size):
+        wheels = []
+        for _, filename in self.iter_wheels():
+            st = os.stat(filename)
+            wheels.append((st.st_mtime, st.st_size, filename))
+        wheels.sort()
+
+        total = sum(size for _, size, _ in wheels)
+        removed = []
+        for _, size, filename in wheels:
+            if total <= max_size:
+                break
+            os.remove(filename)
+            removed.append(filename)
+            total -= size
+
+        return removed
+
+    def install(self, vip_directory, requirements_file):
+        """ Installs a requirements file into vip_directory through the
+        cache.
+
+        When all requirements are pinned to cached wheels pip is run once,
+        without the index. Otherwise missing wheels are built into the cache
+        first. Only requirements themselves are checked, so when that install
+        fails, e.g. because a wheel of a dependency has been pruned, missing
+        wheels are built and the install is retried.
+
+        Returns:
+            exit code of the last pip run
+        """
+        tag = get_tag(vip_directory)
+        directory = self.get_directory(tag)
+        plan = requirements.InstallPlan.from_files([requirements_file])
+
+        with self.lock(shared=True):
+            satisfiable = self.is_satisfiable(tag, plan)
+            if satisfiable:
+                core.logger.info("All requirements found in %s" % directory)
+            else:
+                code = self._build(vip_directory, directory,
+                                   requirements_file)
+                if code:
+                    return code
+
+            code = self._install(vip_directory, directory, requirements_file)
+            if code and satisfiable:
+                core.logger.info("Building missing wheels into %s" %
+                                 directory)
+                code = self._build(vip_directory, directory,
+                                   requirements_file)
+                if not code:
+                    code = self._install(vip_directory, directory,
+                                         requirements_file)
+
+            if not code:
+                self.touch(tag, _installed_projects(vip_directory))
+
+        if not code:
+            self._prune_if_idle()
+
+        return code
+
+    def _prune_if_idle(self):
+        """ Prunes the cache unless other processes are using it. A finished
+        install never fails because of pruning.
+        """
+        try:
+            with self.lock(timeout=0):
+                self._prune(self.max_size)
+        except (core.VipError, IOError, OSError) as e:
+            core.logger.debug("wheel cache not pruned: %s" % e)
+
+    def _build(self, vip_directory, directory, requirements_file):
+        return core.execute_virtualenv_command(
+            vip_directory, "pip",
+            ["wheel", "--find-links", directory, "--wheel-dir",
+             directory, "-r", requirements_file])
+
+    def _install(self, vip_directory, directory, requirements_file):
+        return core.execute_virtualenv_command(
+            vip_directory, "pip",
+            ["install", "--no-index", "--find-links", directory,
+             "-r", requirements_file])
@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+"""
+A pre-forked interpreter server, which makes short `vip python ...` runs
+start faster.
+
+The server runs with the interpreter of a virtualenv, imports a list of
+modules once and listens on `.vip/zygote.sock` Unix socket. A client sends
+its arguments, environment, working directory and standard streams (as file
+descriptors) to the server, which forks a process running the script with
+modules already imported, and reports its exit code back. Start it with:
+
+    vip --serve --preload numpy,mylib
+
+The server is run as a script by an interpreter from the virtualenv, which
+may not have vip installed, so this module uses the standard library only.
+Passing file descriptors requires Python 3.3 or newer on a POSIX system.
+"""
+
+import os
+import sys
+
+
+SOCKET_FILENAME = "zygote.sock"
+
+# How often the server reaps finished processes, in seconds
+REAP_INTERVAL = 1.0
+
+# Maximal size of a request
+MAX_REQUEST = 16 * 1024 * 1024
+
+
+class ZygoteError(Exception):
+    pass
+
+
+def get_socket_path(vip_directory):
+    return os.path.join(vip_directory, SOCKET_FILENAME)
+
+
+def can_serve(command, args):
+    """ Tells whether a command can be run by the server: only `python`
+    with a script, `-c` or `-m` and no interpreter options.
+    """
+    if os.path.basename(command) != "python" or not args:
+        return False
+    if args[0] in ("-c", "-m"):
+        return len(args) > 1
+    return not args[0].startswith("-")
+
+
+def is_supported():
+    import socket
+    return hasattr(socket, "AF_UNIX") and hasattr(socket.socket, "sendmsg")
+
+
+# Client
+
+
+def request(socket_path, args, environ, cwd, fds=(0, 1, 2)):
+    """ Runs `python args` in a process forked by the server.
+
+    Signals SIGINT, SIGTERM and SIGHUP received while waiting are passed to
+    the process.
+
+    Args:
+        socket_path: str, a path to the server socket
+        args: a list of interpreter arguments, see `can_serve`
+        environ: a dict with environment of the process
+        cwd: str, a working directory of the process
+        fds: standard input, output and error of the process
+
+    Returns:
+        exit code of the process, or None when no server is running
+
+    Raises:
+        ZygoteError: when the server fails after accepting the request
+    """
+    import array
+    import json
+    import signal
+    import socket
+    import struct
+
+    if not is_supported():
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except socket.error:
+        client.close()
+        return None
+
+    data = json.dumps({"args": list(args), "environ": dict(environ),
+                       "cwd": cwd}).encode("utf-8")
+    data = struct.pack("!I", len(data)) + data
+
+    pid = [None]
+
+    def forward(signum, frame):
+        if pid[0] is not None:
+            os.kill(pid[0], signum)
+
+    forwarded = (signal.SIGINT, signal.SIGTERM, signal.SIGHUP)
+    handlers = [signal.signal(signum, forward) for signum in forwarded]
+
+    try:
+        sent = client.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                        array.array("i", fds))])
+        client.sendall(data[sent:])
+
+        for line in client.makefile("rb"):
+            kind, value = line.decode("ascii").split()
+            if kind == "pid":
+                pid[0] = int(value)
+            elif kind == "exit":
+                return int(value)
+    except (socket.error, ValueError) as e:
+        raise ZygoteError("zygote server failed: %s" % e)
+    finally:
+        for signum, handler in zip(forwarded, handlers):
+            signal.signal(signum, handler)
+        client.close()
+
+    raise ZygoteError("zygote server closed the connection")
+
+
+# Server
+
+
+def _receive_request(connection):
+    import array
+    import json
+    import socket
+    import struct
+
+    fds = array.array("i")
+    data, ancillary, _, _ = connection.recvmsg(
+        65536, socket.CMSG_SPACE(3 * fds.itemsize))
+
+    for level, kind, payload in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            payload = payload[:len(payload) - len(payload) % fds.itemsize]
+            fds.frombytes(payload)
+
+    try:
+        if len(fds) != 3 or len(data) < 4:
+            raise ValueError("malformed request")
+
+        size = struct.unpack("!I", data[:4])[0]
+        if size > MAX_REQUEST:
+            raise ValueError("request too large")
+
+        data = data[4:]
+        while len(data) < size:
+            chunk = connection.recv(size - len(data))
+            if not chunk:
+                raise ValueError("truncated request")
+            data += chunk
+
+        return json.loads(data.decode("utf-8")), list(fds)
+    except ValueError:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+
+def _reopen_standard_streams():
+    def reopen(fd, mode):
+        buffering = 1 if mode == "w" and os.isatty(fd) else -1
+        return os.fdopen(fd, mode, buffering, closefd=False)
+
+    sys.stdin = sys.__stdin__ = reopen(0, "r")
+    sys.stdout = sys.__stdout__ = reopen(1, "w")
+    sys.stderr = sys.__stderr__ = reopen(2, "w")
+
+
+def _execute(args):
+    """ Runs interpreter arguments in the current process. """
+    import runpy
+
+    if args[0] == "-c":
+        sys.argv = ["-c"] + args[2:]
+        sys.path.insert(0, "")
+        namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+        exec(compile(args[1], "<string>", "exec"), namespace)
+    elif args[0] == "-m":
+        sys.argv = args[1:]
+        sys.path.insert(0, "")
+        runpy.run_module(args[1], run_name="__main__", alter_sys=True)
+    else:
+        sys.argv = list(args)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(args[0])))
+        runpy.run_path(args[0], run_name="__main__")
+
+
+def _run(request, fds):
+    """ Runs a request in a forked process, never returns. """
+    import signal
+    import traceback
+
+    code = 1
+    try:
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+        for fd in fds:
+            if fd > 2:
+                os.close(fd)
+
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["environ"])
+        _reopen_standard_streams()
+
+        _execute(request["args"])
+        code = 0
+    except SystemExit as e:
+        if e.code is None:
+            code = 0
+        elif isinstance(e.code, int):
+            code = e.code
+        else:
+            sys.stderr.write("%s\n" % e.code)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(code & 0xff)
+
+
+def _handle(connection, request, fds):
+    """ Forks a process for request and reports its pid and exit code,
+    never returns.
+    """
+    import signal
+
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        pid = os.fork()
+        if pid == 0:
+            connection.close()
+            _run(request, fds)
+
+        for fd in fds:
+            os.close(fd)
+        connection.sendall(("pid %d\n" % pid).encode("ascii"))
+
+        _, status = os.waitpid(pid, 0)
+        if os.WIFSIGNALED(status):
+            code = 128 + os.WTERMSIG(status)
+        else:
+            code = os.WEXITSTATUS(status)
+        connection.sendall(("exit %d\n" % code).encode("ascii"))
+    finally:
+        os._exit(0)
+
+
+def _reap():
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except OSError:
+            return
+        if pid == 0:
+            return
+
+
+def _is_alive(socket_path):
+    import socket
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        client.close()
+
+
+def serve(socket_path, preload=()):
+    """ Imports preload modules and serves requests until terminated. """
+    import signal
+    import socket
+
+    if not is_supported():
+        raise ZygoteError("zygote server requires Python 3.3 or newer on a "
+                          "POSIX system")
+
+    for name in preload:
+        __import__(name)
+
+    if os.path.exists(socket_path):
+        if _is_alive(socket_path):
+            raise ZygoteError("zygote server is already running at %s" %
+                              socket_path)
+        os.remove(socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(socket_path)
+    except socket.error as e:
+        server.close()
+        raise ZygoteError("cannot listen on %s: %s" % (socket_path, e))
+    os.chmod(socket_path, 0o600)
+    server.listen(64)
+    server.settimeout(REAP_INTERVAL)
+    stamp = os.stat(socket_path).st_ino
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sys.stderr.write("vip zygote listening on %s\n" % socket_path)
+    sys.stderr.flush()
+
+    try:
+        while True:
+            _reap()
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                continue
+
+            try:
+                connection.settimeout(None)
+                request, fds = _receive_request(connection)
+            except (socket.error, ValueError) as e:
+                sys.stderr.write("vip zygote: invalid request: %s\n" % e)
+                connection.close()
+                continue
+
+            if os.fork() == 0:
+                server.close()
+                _handle(connection, request, fds)
+
+            connection.close()
+            for fd in fds:
+                os.close(fd)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        # Do not remove a socket of a server started later
+        try:
+            if os.stat(socket_path).st_ino == stamp:
+                os.remove(socket_path)
+        except OSError:
+            pass
+
+
+def main(argv=None):
+    import argparse
+
+    # Modules next to this file must not shadow ones used by scripts
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or ".") != here]
+
+    parser = argparse.ArgumentParser(description="vip zygote server")
+    parser.add_argument("--socket", required=True,
+                        help="a path of the socket to listen on")
+    parser.add_argument("--preload", default="",
+                        help="comma separated list of modules to import")
+    args = parser.parse_args(argv)
+
+    preload = [name.strip() for name in args.preload.split(",")
+               if name.strip()]
+    try:
+        serve(args.socket, preload)
+    except ZygoteError as e:
+        sys.stderr.write("fatal: %s\n" % e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()